@@ -1,13 +1,54 @@
 from ultralytics import YOLO
+import os
+import sys
 import numpy as np
 import cv2
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exp2'))
+from render import draw_skeleton, OverlayWriter
+from ingest import ingest_results
+from pose_cache import PoseCache, video_poses
+from adaptive import adaptive_video_poses
+from roi import roi_video_poses
+from live import LatencyStats, live_poses
+from kinematics import Kinematics
+from rolling import RollingStabilityIndex
+from templates import TemplateIndex
+from snapshots import SnapshotWriter
+from profiling import StageProfiler
+
 # 視訊模式處理
 window_size = 30  # 可根據需求調整視窗大小(幀數)
 
 # 載入 YOLO Pose 模型
-model = YOLO('yolo11x-pose.pt')
+weights_path = 'yolo11x-pose.pt'
+model = YOLO(weights_path)
+
+# 姿態推論快取 (見 exp2/pose_cache.py)：調整門檻或指標後重跑時不必重新推論
+# 快取命中且 headless (也不輸出疊加影片) 時不解碼影片，只在觸發存檔時讀取該幀
+use_pose_cache = True
+pose_cache_max_gb = 20
+inference_params = {}  # 傳給 model(frame, **inference_params)
+
+# 自適應頻率推論 (見 exp2/adaptive.py)：adaptive_stride > 1 時平穩期間每 adaptive_stride 幀才推論一次，
+# 中間的幀以光流 ('flow') 或內插 ('interpolate') 估計，動作劇烈時自動回到每幀推論
+# adaptive_stride = 1 為每幀推論 (可使用推論快取)
+adaptive_stride = 1
+adaptive_motion_threshold = 150.0  # 回到每幀推論的關節平均速度 (像素/秒)
+adaptive_estimator = 'flow'
+
+# ROI 裁切推論 (見 exp2/roi.py)：以前一幀關鍵點外框裁切影格，在 roi_imgsz 上推論，
+# 每 roi_redetect_every 幀或追蹤遺失時改以整張影格重新偵測；適合 1080p / 4K 影片中人只佔一小塊的情況
+roi_inference = False
+roi_imgsz = 320
+roi_redetect_every = 30
+
+# 即時攝影機模式 (見 exp2/live.py)：設定 live_source 時永遠只處理最新的一幀，推論來不及時丟棄舊幀
+# live_source = 0 為第一台攝影機；設為影片路徑時依原始幀率播放，代替攝影機測試
+live_source = None
+latency_budget = 0.2  # 秒，從交換區取出時已超過預算的幀直接略過 (None 為不限)
+latency_report = './live_latency.json'  # 結束時寫出擷取到指標算完的延遲百分位數
 
 # 設定圖片或視訊路徑
 # img_path = '../../test/test2.png'
@@ -15,6 +56,26 @@ img_path = './test_video.mp4'
 # is_video = False  # 設定是否為視訊模式
 is_video = True
 
+# 無顯示器 (headless) 批次模式：不繪製也不呼叫 cv2.imshow / plt.show
+headless = False
+overlay_path = None  # 設定路徑 (例如 './overlay.mp4') 時另外輸出完整 COCO 骨架的疊加影片
+overlay_stride = 1  # 疊加影片每隔幾幀寫出一幀
+
+# 模仿任務的參考動作：名稱 -> 參考錄影的 keypoints_data.npy / .csv，留空則不比對
+template_sources = {}
+template_cache = './templates_cache.npz'  # 預先計算的模板特徵快取，來源改變時自動重建
+
+# 觸發存檔：在背景執行緒寫出影格到 ./save/<執行編號>/，事件 (含執行編號與來源影片) 附加到 ./save/events.jsonl
+# (見 snapshots.py；plot_gen.py 預設只繪製最後一次執行)
+snapshot_format = 'png'  # 'png'、'jpg' 或 'webp'
+snapshot_quality = None  # png 為壓縮等級 0~9，jpg / webp 為 0~100，None 為 OpenCV 預設值
+
+# 分段計時 (見 exp2/profiling.py)：解碼、推論、.cpu() 搬移、指標、繪圖、存檔等每幀各階段的耗時、幀率與記憶體峰值，
+# 設定 profile_report (例如 './profile_report.json') 時於結束時寫出報告，預設 None 為停用；可用 python ../exp2/profiling.py 舊報告.json 新報告.json 比對退步
+profile_report = None
+profile_frames = 0  # 大於 0 時從第 profile_start 幀起對這麼多幀啟用 cProfile，結果寫入報告與 profile.prof
+profile_start = 30  # 略過模型暖機的幀
+
 # 定義關節連接關係，用於繪製骨架
 connections = [
     (5, 7),  # 肩膀到肘部
@@ -35,6 +96,9 @@ def calculate_joint_angles(points):
         return np.degrees(angle)
     return None
 
+# 三次差分的工作區，每幀重複使用同一組緩衝區 (見 exp2/kinematics.py)
+_kinematics = Kinematics()
+
 def motion_smoothness(angles):
     """
     計算運動平滑性 (基於 Jerk Minimization)
@@ -42,38 +106,15 @@ def motion_smoothness(angles):
     :return: 運動平滑性 (越小越平滑)
     """
     if len(angles) >= 4:
-        jerk = np.diff(angles, n=3)  # 三次微分
-        return np.mean(np.abs(jerk))  # 計算絕對值平均
+        jerk = _kinematics.jerk(angles)  # 三次微分
+        return np.mean(np.abs(jerk, out=jerk))  # 計算絕對值平均
     return None
 
-def movement_stability_index(trajectories, center_of_mass):
-    """
-    計算動作穩定性指數 (MSI)
-    :param trajectories: 關節的軌跡 (形狀: Nx2, 每行為 (x, y))
-    :param center_of_mass: 身體質心的軌跡 (形狀: Nx2, 每行為 (x, y))
-    :return: 穩定性指數 (越小越穩定)
-    """
-    if len(trajectories) != len(center_of_mass):
-        raise ValueError("Trajectories and center of mass must have the same length.")
-    
-    # 軌跡方差
-    trajectory_var = np.var(trajectories, axis=0).mean()  # x 和 y 方向的平均方差
-    
-    # 質心偏移量
-    com_deviation = np.linalg.norm(np.diff(center_of_mass, axis=0), axis=1).mean()
-    
-    # 合併為穩定性指數
-    return trajectory_var + com_deviation
-
-# 存儲觸發時的數據與圖片
-def save_frame_data(frame, frame_index, angle, smoothness, msi):
-    filename = f"./save/saved_frame_{frame_index}.png"
-    cv2.imwrite(filename, frame)
-    with open(f"./save/saved_frame_{frame_index}.txt", "w") as f:
-        f.write(f"Angle: {angle}\n")
-        f.write(f"Motion Smoothness: {smoothness}\n")
-        f.write(f"Movement Stability Index: {msi}\n")
-    print(f"Frame data saved: {filename}")
+# 存儲觸發時的數據與圖片 (交給背景寫入器，不阻塞影片迴圈)
+def save_frame_data(writer, frame, frame_index, angle, smoothness, msi):
+    filename = writer.submit(frame, frame_index, angle=float(angle), motion_smoothness=float(smoothness),
+                             movement_stability_index=float(msi))
+    print(f"Frame data queued: {filename}")
 
 # 圖片模式處理
 if not is_video:
@@ -81,75 +122,92 @@ if not is_video:
     results = model(img)
 
     # 遍歷每個偵測結果，取得關鍵點並繪製骨架
-    for result in results:
-        keypoints = result.keypoints.xy.cpu().numpy()  # 取得所有關鍵點座標
-        
-        for person_keypoints in keypoints:
-            # 繪製點
-            for (x, y) in person_keypoints:
-                if x > 0 and y > 0:  # 過濾無效座標
-                    cv2.circle(img, (int(x), int(y)), radius=5, color=(255, 0, 0), thickness=-1)
-            
-            # 繪製線條
-            for (start, end) in connections:
-                if person_keypoints[start][0] > 0 and person_keypoints[start][1] > 0 and \
-                   person_keypoints[end][0] > 0 and person_keypoints[end][1] > 0:
-                    pt1 = (int(person_keypoints[start][0]), int(person_keypoints[start][1]))
-                    pt2 = (int(person_keypoints[end][0]), int(person_keypoints[end][1]))
-                    cv2.line(img, pt1, pt2, color=(0, 255, 0), thickness=2)
-            
-            # 計算關節角度 (假設肩膀-肘部-手腕)
+    for pose in ingest_results(results):
+        keypoints = pose.xy  # 所有關鍵點座標，低信心的關節由 pose.valid 標記
+
+        # 繪製點與線條
+        if not headless:
+            draw_skeleton(img, keypoints, connections, valid=pose.valid)
+
+        for person_keypoints, person_valid in zip(keypoints, pose.valid):
+            # 計算關節角度 (假設肩膀-肘部-手腕)，三個關節皆有效才計算
             indices = [5, 7, 9]
             selected_points = [person_keypoints[i] for i in indices]
-            angle = calculate_joint_angles(selected_points)
+            angle = calculate_joint_angles(selected_points) if person_valid[indices].all() else None
             if angle is not None:
                 print(f"Joint Angle (shoulder-elbow-wrist): {angle:.2f} degrees")
 
     # 顯示結果
-    cv2.imshow('Pose Detection', img)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+    if not headless:
+        cv2.imshow('Pose Detection', img)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
 
 # 視訊模式處
 else:
     # 設定冷卻間隔幀數
     cooldown_frames = 30
     last_saved_frame = -cooldown_frames
-    cap = cv2.VideoCapture(img_path)
+    # 只有從影片檔讀取時才開啟 (取得 fps、快取命中時補讀存檔的幀)；即時模式由擷取執行緒開啟來源
+    cap = cv2.VideoCapture(img_path) if live_source is None else None
     angles = []  # 用於存儲每幀的角度
-    trajectories = []  # 用於存儲關節的軌跡
-    center_of_mass = []  # 用於存儲質心的軌跡 (假設質心為關節的平均值)
+    # 關節軌跡與質心 (假設質心為關節的平均值) 的滑動視窗統計，每幀 O(1) 更新
+    stability = RollingStabilityIndex(window_size=window_size)
+    msi = None
     saved_frames = []  # 存儲已儲存的幀索引
+    snapshot_writer = SnapshotWriter('./save', snapshot_format, snapshot_quality,
+                                     source=live_source if live_source is not None else img_path)
+    overlay = None
+    if overlay_path is not None:
+        fps = (cap.get(cv2.CAP_PROP_FPS) if cap is not None else 0) or 30
+        overlay = OverlayWriter(overlay_path, fps=fps, frame_stride=overlay_stride)
+    matcher = None
+    if template_sources:
+        matcher = TemplateIndex.cached(template_cache, template_sources).matcher()
 
-    frame_index = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        results = model(frame)
+    # 快取命中時不推論；headless 時也不解碼影片
+    need_frames = not headless or overlay is not None
+    profiler = StageProfiler(enabled=profile_report is not None, profile_frames=profile_frames,
+                             profile_start=profile_start, profile_path='./profile.prof',
+                             metadata={'video': live_source if live_source is not None else img_path,
+                                       'weights': weights_path, 'params': inference_params})
+    if roi_inference and adaptive_stride > 1:
+        raise ValueError("roi_inference and adaptive_stride > 1 cannot be combined; enable only one.")
+    latency_stats = None
+    if live_source is not None:
+        latency_stats = LatencyStats(latency_budget)
+        poses = live_poses(live_source, model, latency_stats, latency_budget, inference_params,
+                           profiler=profiler)
+    elif roi_inference:
+        poses = roi_video_poses(img_path, model, roi_imgsz, roi_redetect_every, inference_params,
+                                profiler=profiler)
+    elif adaptive_stride > 1:
+        poses = adaptive_video_poses(img_path, model, adaptive_stride, adaptive_motion_threshold,
+                                     adaptive_estimator, inference_params, profiler=profiler)
+    else:
+        # 推論快取只用於逐幀推論 (ROI 與自適應推論的結果依設定而異，不寫入快取)
+        pose_cache = PoseCache(max_bytes=pose_cache_max_gb * 1024 ** 3) if use_pose_cache else None
+        poses = video_poses(img_path, model, pose_cache, weights_path, inference_params,
+                            need_frames=need_frames, profiler=profiler)
+    for frame_index, frame, pose in profiler.iterate(poses, 'poses'):
+        keypoints = pose.xy  # 所有關鍵點座標，低信心的關節由 pose.valid 標記
 
-        for result in results:
-            keypoints = result.keypoints.xy.cpu().numpy()  # 取得所有關鍵點座標
+        # 疊加影片另外繪製完整骨架；有畫面顯示時在副本上繪製
+        if overlay is not None:
+            with profiler.stage('overlay'):
+                overlay.write(frame_index, frame, keypoints, copy=not headless, valid=pose.valid)
 
-            for person_keypoints in keypoints:
-                # 繪製點
-                for (x, y) in person_keypoints:
-                    if x > 0 and y > 0:
-                        cv2.circle(frame, (int(x), int(y)), radius=5, color=(255, 0, 0), thickness=-1)
+        # 繪製點與線條
+        if not headless:
+            with profiler.stage('draw'):
+                draw_skeleton(frame, keypoints, connections, valid=pose.valid)
 
-                # 繪製線條
-                for (start, end) in connections:
-                    if person_keypoints[start][0] > 0 and person_keypoints[start][1] > 0 and \
-                       person_keypoints[end][0] > 0 and person_keypoints[end][1] > 0:
-                        pt1 = (int(person_keypoints[start][0]), int(person_keypoints[start][1]))
-                        pt2 = (int(person_keypoints[end][0]), int(person_keypoints[end][1]))
-                        cv2.line(frame, pt1, pt2, color=(0, 255, 0), thickness=2)
-
-                # 計算關節角度 (肩膀-肘部-手腕)
+        with profiler.stage('metrics'):
+            for person_keypoints, person_valid in zip(keypoints, pose.valid):
+                # 計算關節角度 (肩膀-肘部-手腕)，三個關節皆有效才計算
                 indices = [5, 7, 9]  # 關鍵點索引，依據實際Model定義
                 selected_points = [person_keypoints[i] for i in indices]
-                angle = calculate_joint_angles(selected_points)
+                angle = calculate_joint_angles(selected_points) if person_valid[indices].all() else None
                 if angle is not None:
                     angles.append(angle)
                     # 視窗化：只保留最後 window_size 個資料
@@ -157,39 +215,66 @@ else:
                         angles = angles[-window_size:]
                     print(f"Joint Angle (shoulder-elbow-wrist): {angle:.2f} degrees")
 
-                # 更新軌跡和質心數據
-                trajectories.append(person_keypoints[:, :2])  # 只存儲 x, y
-                center_of_mass.append(np.mean(person_keypoints, axis=0))
+                # 更新軌跡和質心數據 (只使用 x, y)
+                msi = stability.update(person_keypoints[:, :2])
 
-                # 視窗化：只保留最後 window_size 個資料
-                if len(trajectories) > window_size:
-                    trajectories = trajectories[-window_size:]
-                if len(center_of_mass) > window_size:
-                    center_of_mass = center_of_mass[-window_size:]
+            # 以第一個人的動作比對參考模板 (串流子序列 DTW)
+            if matcher is not None and len(keypoints):
+                match = matcher.update(keypoints[0], valid=pose.valid[0])
+                if match is not None:
+                    print(f"Best template: {match['template']} (cost {match['cost']:.4f}, "
+                          f"frames {match['start']}-{match['end']})")
 
-        # 計算運動平滑性 (Motion Smoothness)
-        smoothness = motion_smoothness(angles)
-        if smoothness is not None:
-            print(f"Motion Smoothness (last {window_size} frames): {smoothness:.2f}")
+            # 計算運動平滑性 (Motion Smoothness)
+            smoothness = motion_smoothness(angles)
+            if smoothness is not None:
+                print(f"Motion Smoothness (last {window_size} frames): {smoothness:.2f}")
 
-        # 計算動作穩定性指數 (Movement Stability Index)
-        if len(trajectories) > 1 and len(center_of_mass) > 1:
-            msi = movement_stability_index(np.array(trajectories), np.array(center_of_mass))
-            print(f"Movement Stability Index (last {window_size} frames): {msi:.2f}")
+            # 計算動作穩定性指數 (Movement Stability Index)
+            if msi is not None:
+                print(f"Movement Stability Index (last {window_size} frames): {msi:.2f}")
 
         # 觸發條件檢查
         if smoothness is not None and msi is not None:
             if (smoothness > 5.0 or msi > 10.0) and (frame_index - last_saved_frame >= cooldown_frames):
-                save_frame_data(frame, frame_index, angles[-1], smoothness, msi)
-                saved_frames.append(frame_index)
-                last_saved_frame = frame_index
+                snapshot = frame
+                if snapshot is None:
+                    # 未解碼影片時只讀取要存檔的這一幀；讀取失敗時略過這次存檔
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                    ret, snapshot = cap.read()
+                    if not ret:
+                        snapshot = None
+                        print(f"Cannot read frame {frame_index}, snapshot skipped")
+                if snapshot is not None:
+                    with profiler.stage('snapshot'):
+                        if headless:
+                            # headless 模式平時不繪製，只在存檔時補畫骨架
+                            draw_skeleton(snapshot, keypoints, connections, valid=pose.valid)
+                        save_frame_data(snapshot_writer, snapshot, frame_index, angles[-1], smoothness, msi)
+                    saved_frames.append(frame_index)
+                    last_saved_frame = frame_index
 
         # 顯示結果
-        cv2.imshow('Pose Detection', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
+        if not headless:
+            with profiler.stage('display'):
+                cv2.imshow('Pose Detection', frame)
+                key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                break
+        profiler.frame()
+    poses.close()  # 提早結束時停止擷取執行緒並釋放影片
+    with profiler.stage('snapshot_flush'):
+        snapshot_writer.close()  # 等待尚未寫完的觸發存檔
+
+    if profile_report is not None:
+        profiler.print_summary(profiler.save(profile_report))
 
-        frame_index += 1
+    if latency_stats is not None:
+        latency = latency_stats.summary()
+        print(f"Live latency: p50 {latency.get('latency_p50_ms', float('nan')):.1f}ms, "
+              f"p95 {latency.get('latency_p95_ms', float('nan')):.1f}ms, "
+              f"processed {latency['processed']}/{latency['captured']} frames")
+        latency_stats.save(latency_report)
 
     # 繪製圖表
     plt.figure(figsize=(10, 6))
@@ -200,7 +285,12 @@ else:
     plt.legend()
     plt.grid()
     plt.savefig("joint_angles_plot.png")
-    plt.show()
+    if not headless:
+        plt.show()
 
-    cap.release()
-    cv2.destroyAllWindows()
+    if cap is not None:
+        cap.release()
+    if overlay is not None:
+        overlay.release()
+    if not headless:
+        cv2.destroyAllWindows()
@@ -1,38 +1,48 @@
 import os
+import sys
 import matplotlib.pyplot as plt
-import numpy as np
-
-def plot_data(data_folder):
-    frames = []
-    angles = []
-    smoothness = []
-    stability = []
+from snapshots import EVENT_LOG, read_events
 
+def read_legacy_txt(data_folder):
+    """讀取舊版每個事件一個的 saved_frame_<幀>.txt"""
+    events = []
     # 遞迴遍歷資料夾
     for root, _, files in os.walk(data_folder):
         for file in files:
             if file.endswith('.txt'):
-                frame_id = file.split('_')[-1].split('.')[0]
+                frame_id = int(file.split('_')[-1].split('.')[0])
                 txt_path = os.path.join(root, file)
 
                 # 讀取數據
                 with open(txt_path, 'r') as f:
                     lines = f.readlines()
-                    angle = float(lines[0].split(':')[-1].strip())
-                    motion_smoothness = float(lines[1].split(':')[-1].strip())
-                    movement_stability_index = float(lines[2].split(':')[-1].strip())
+                events.append({
+                    'frame': frame_id,
+                    'angle': float(lines[0].split(':')[-1].strip()),
+                    'motion_smoothness': float(lines[1].split(':')[-1].strip()),
+                    'movement_stability_index': float(lines[2].split(':')[-1].strip()),
+                })
+    return events
 
-                frames.append(frame_id)
-                angles.append(angle)
-                smoothness.append(motion_smoothness)
-                stability.append(movement_stability_index)
+def plot_data(data_folder, run='latest'):
+    """
+    run: 要繪製的執行編號 (events.jsonl 中的 run)，預設為最後一次執行；
+         同一個記錄中有多次執行 (或不同影片) 時只取一次，避免重複與混在一起
+    """
+    # 直接讀取 exp1_a.py 寫出的 events.jsonl，沒有記錄時才讀舊版的 .txt
+    if os.path.exists(os.path.join(data_folder, EVENT_LOG)):
+        events = read_events(data_folder, run=run)
+        if events and events[0].get('run'):
+            print(f"Run {events[0]['run']} ({events[0].get('source')}): {len(events)} events")
+    else:
+        events = read_legacy_txt(data_folder)
 
-    # 排序frames以確保數據對應
-    sorted_indices = np.argsort(frames)
-    frames = [frames[i] for i in sorted_indices]
-    angles = [angles[i] for i in sorted_indices]
-    smoothness = [smoothness[i] for i in sorted_indices]
-    stability = [stability[i] for i in sorted_indices]
+    # 依幀排序以確保數據對應
+    events.sort(key=lambda event: event['frame'])
+    frames = [event['frame'] for event in events]
+    angles = [event['angle'] for event in events]
+    smoothness = [event['motion_smoothness'] for event in events]
+    stability = [event['movement_stability_index'] for event in events]
 
     # 創建三張圖表
     plt.figure(figsize=(10, 6))
@@ -68,5 +78,5 @@ def plot_data(data_folder):
     # plt.show()
     plt.savefig('result.png')
 
-# 執行函數
-plot_data("./save")
\ No newline at end of file
+# 執行函數；python plot_gen.py [run] 可指定執行編號
+plot_data("./save", sys.argv[1] if len(sys.argv) > 1 else 'latest')
\ No newline at end of file
@@ -0,0 +1,156 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exp2'))
+from kinematics import finite_differences
+
+# 以累積和 (prefix sum) 計算 exp1 指標的滑動視窗版本：
+# 整段錄影的逐幀指標只需 O(frames)，不必每幀重新切片並轉成陣列。
+
+
+def window_starts(num_frames, window_size):
+    """
+    每一幀視窗的起點與長度 (前 window_size - 1 幀視窗較短，與 exp1_a.py 的做法相同)。
+    :param window_size: 整數，或 shape = (N,) 的逐幀視窗大小
+    """
+    t = np.arange(num_frames)
+    window_size = np.broadcast_to(np.asarray(window_size, dtype=np.int64), (num_frames,))
+    if np.any(window_size < 1):
+        raise ValueError("window_size must be at least 1 frame.")
+    starts = np.maximum(0, t - window_size + 1)
+    return starts, t - starts + 1
+
+
+def rolling_motion_smoothness(angles, window_size):
+    """
+    每一幀最近 window_size 個角度的運動平滑性 (三次差分絕對值平均)。
+    :param angles: 關節角度序列，shape = (N,)
+    :param window_size: 整數，或 shape = (N,) 的逐幀視窗大小
+    :return: shape = (N,)，視窗內少於 4 個角度時為 NaN
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    num_frames = len(angles)
+    jerk = finite_differences(angles)[2]
+    np.abs(jerk, out=jerk)
+    prefix = np.concatenate([[0.0], np.cumsum(jerk)])
+
+    starts, lengths = window_starts(num_frames, window_size)
+    result = np.full(num_frames, np.nan)
+    ok = lengths >= 4
+    # 視窗 [s, t] 內的 jerk 索引為 s .. t-3
+    t = np.arange(num_frames)[ok]
+    result[ok] = (prefix[t - 2] - prefix[starts[ok]]) / (lengths[ok] - 3)
+    return result
+
+
+def rolling_movement_stability_index(trajectories, center_of_mass, window_size):
+    """
+    每一幀最近 window_size 幀的動作穩定性指數 (MSI)，以累積和一次算出所有視窗。
+    :param trajectories: 關節的軌跡，shape = (N, joints, 2)
+    :param center_of_mass: 身體質心的軌跡，shape = (N, 2)
+    :param window_size: 整數，或 shape = (N,) 的逐幀視窗大小
+    :return: shape = (N,)，視窗內少於 2 幀時為 NaN
+    """
+    trajectories = np.asarray(trajectories, dtype=np.float64)
+    center_of_mass = np.asarray(center_of_mass, dtype=np.float64)
+    if len(trajectories) != len(center_of_mass):
+        raise ValueError("Trajectories and center of mass must have the same length.")
+    num_frames = len(trajectories)
+    flat = trajectories.reshape(num_frames, -1)
+    if num_frames:
+        flat = flat - flat.mean(axis=0)  # 先置中，避免平方和相減的浮點誤差
+
+    # 軌跡方差：var = E[x²] - E[x]²，各座標分別計算後取平均
+    prefix = np.zeros((num_frames + 1, flat.shape[1]))
+    np.cumsum(flat, axis=0, out=prefix[1:])
+    prefix_sq = np.concatenate([[0.0], np.cumsum((flat ** 2).sum(axis=1))])
+
+    # 質心偏移量：相鄰幀質心距離的累積和
+    steps = np.linalg.norm(np.diff(center_of_mass, axis=0), axis=1)
+    prefix_step = np.concatenate([[0.0], np.cumsum(steps)])
+
+    starts, lengths = window_starts(num_frames, window_size)
+    t = np.arange(num_frames)
+    window_sum = prefix[t + 1] - prefix[starts]
+    sum_sq = prefix_sq[t + 1] - prefix_sq[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trajectory_var = (sum_sq / lengths - ((window_sum / lengths[:, None]) ** 2).sum(axis=1)) / flat.shape[1]
+        com_deviation = (prefix_step[t] - prefix_step[starts]) / (lengths - 1)
+    result = np.maximum(trajectory_var, 0.0) + com_deviation
+    result[lengths < 2] = np.nan
+    return result
+
+
+class RollingStabilityIndex:
+    """
+    串流版的動作穩定性指數 (MSI)，每幀推入一組關節座標，O(1) 更新。
+    以環形緩衝區維護視窗內座標的和、平方和與質心位移和，
+    取代 exp1_a.py 中 trajectories = trajectories[-window_size:] 的串列切片。
+    """
+
+    def __init__(self, window_size=30):
+        if window_size < 2:
+            raise ValueError("window_size must be at least 2 frames.")
+        self.window_size = window_size
+        self._origin = None  # 以第一幀為原點，降低平方和的數值大小
+        self._coords = None
+        self._steps = np.zeros(window_size)
+        self._last_com = None
+        self.count = 0
+
+    def _resync(self):
+        n = min(self.count, self.window_size)
+        coords = self._coords[:n]
+        self._sum = coords.sum(axis=0)
+        self._sum_sq = (coords ** 2).sum()
+        self._step_sum = self._steps[:n].sum()
+
+    def update(self, joint_positions):
+        """
+        推入一幀的關節座標並回傳最新的 MSI。
+        :param joint_positions: shape = (joints, 2)
+        :return: MSI，視窗內少於 2 幀時回傳 None
+        """
+        joint_positions = np.asarray(joint_positions, dtype=np.float64)
+        flat = joint_positions.reshape(-1)
+        com = joint_positions.mean(axis=0)
+        w = self.window_size
+
+        if self._coords is None:
+            self._origin = flat.copy()
+            self._coords = np.zeros((w, flat.size))
+            self._sum = np.zeros(flat.size)
+            self._sum_sq = 0.0
+            self._step_sum = 0.0
+        flat = flat - self._origin
+
+        pos = self.count % w
+        # 移除即將被覆蓋的最舊一幀
+        if self.count >= w:
+            oldest = self._coords[pos]
+            self._sum -= oldest
+            self._sum_sq -= oldest @ oldest
+            # 最舊一幀之後的位移 (位於下一個槽位) 在新的視窗中不再需要
+            self._step_sum -= self._steps[(pos + 1) % w]
+            self._steps[(pos + 1) % w] = 0.0
+
+        self._coords[pos] = flat
+        self._sum += flat
+        self._sum_sq += flat @ flat
+        # 第 pos 槽位存放從前一幀走到此幀的質心位移
+        step = np.linalg.norm(com - self._last_com) if self._last_com is not None else 0.0
+        self._steps[pos] = step
+        self._step_sum += step
+        self._last_com = com
+        self.count += 1
+
+        if self.count % w == 0:
+            self._resync()
+
+        n = min(self.count, w)
+        if n < 2:
+            return None
+        trajectory_var = max(self._sum_sq / n - ((self._sum / n) ** 2).sum(), 0.0) / flat.size
+        com_deviation = self._step_sum / (n - 1)
+        return trajectory_var + com_deviation
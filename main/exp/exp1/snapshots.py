@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import threading
+import uuid
+from queue import Queue
+import cv2
+
+# 觸發存檔的背景寫入器：
+# 主迴圈只把 (影格, 指標) 放入佇列，影像編碼與寫檔在背景執行緒進行，異常動作連續觸發時擷取不會卡住。
+# 每個事件附加到同一個 events.jsonl (每行一筆，含遞增的事件編號與影像檔名)，
+# 取代每個事件各一個 .txt；plot_gen.py 直接讀取這個記錄。
+# 每次執行有自己的 run 編號：事件記錄 run 與來源影片，影像寫到 <directory>/<run>/，
+# 重複執行或換影片時不會覆蓋先前的影像，讀取時可只取某一次執行的事件。
+
+EVENT_LOG = 'events.jsonl'
+_END = object()
+
+# 影像格式 -> (副檔名, OpenCV 品質參數)
+IMAGE_FORMATS = {
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),  # 0~9，越大越小越慢
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),  # 0~100
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),  # 1~100
+}
+
+
+def new_run_id():
+    """依時間排序的執行編號，例如 20261018-153012-3fa2c1"""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def read_events(path, run=None):
+    """
+    讀取事件記錄 (events.jsonl 或其所在資料夾)，回傳 dict 的列表。
+    run: 只回傳此執行編號的事件；'latest' 為最後一次執行；None 為全部
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, EVENT_LOG)
+    events = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+    if run == 'latest':
+        run = events[-1].get('run') if events else None
+        if run is None:
+            return events  # 舊版記錄沒有執行編號
+    if run is not None:
+        events = [event for event in events if event.get('run') == run]
+    return events
+
+
+class SnapshotWriter:
+    """
+    在背景執行緒寫出觸發時的影格，並把事件附加到 events.jsonl。
+    記錄在影像寫完後才附加，記錄中的影像檔一定存在。
+    """
+
+    def __init__(self, directory='./save', image_format='png', quality=None, queue_size=32, prefix='saved_frame',
+                 source=None, run_id=None):
+        """
+        directory: 輸出資料夾
+        image_format: 'png'、'jpg' 或 'webp'
+        quality: 編碼品質 (png 為壓縮等級 0~9，jpg / webp 為 0~100)，None 時使用 OpenCV 預設值
+        queue_size: 等待寫出的事件上限；佇列滿時 submit 才會等待
+        prefix: 影像檔名前綴，檔名為 <run>/<prefix>_<frame_index><副檔名>
+        source: 來源影片路徑或攝影機編號，寫入每個事件
+        run_id: 執行編號，None 時以 new_run_id() 產生
+        """
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+        self.directory = directory
+        self.prefix = prefix
+        self.source = None if source is None else str(source)
+        self.run_id = new_run_id() if run_id is None else run_id
+        self.extension, flag = IMAGE_FORMATS[image_format]
+        self.params = [] if quality is None else [flag, int(quality)]
+        self.log_path = os.path.join(directory, EVENT_LOG)
+        self.error = None
+        os.makedirs(os.path.join(directory, self.run_id), exist_ok=True)
+
+        # 接續既有記錄的事件編號
+        self._next_event = len(read_events(self.log_path)) if os.path.exists(self.log_path) else 0
+        self._queue = Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, frame_index, **fields):
+        """
+        送出一個事件。frame 會先複製，呼叫端之後可繼續在原影格上繪製。
+        fields: 寫入記錄的指標，例如 angle、motion_smoothness、movement_stability_index
+        回傳影像檔路徑
+        """
+        if self.error is not None:
+            raise self.error
+        filename = f"{self.run_id}/{self.prefix}_{frame_index}{self.extension}"
+        event = {'event': self._next_event, 'run': self.run_id, 'source': self.source, 'frame': int(frame_index),
+                 'time': time.time(), 'image': filename}
+        event.update(fields)
+        self._next_event += 1
+        self._queue.put((frame.copy(), event))
+        return os.path.join(self.directory, filename)
+
+    def _run(self):
+        with open(self.log_path, 'a') as log:
+            while True:
+                item = self._queue.get()
+                if item is _END:
+                    return
+                if self.error is not None:
+                    continue  # 發生錯誤後只排空佇列，錯誤由 submit / close 拋出
+                frame, event = item
+                try:
+                    if not cv2.imwrite(os.path.join(self.directory, event['image']), frame, self.params):
+                        raise IOError(f"Failed to write {event['image']}")
+                    log.write(json.dumps(event) + '\n')
+                    log.flush()
+                except Exception as exc:
+                    self.error = exc
+
+    def close(self):
+        """等待佇列中的事件寫完"""
+        if self._thread.is_alive():
+            self._queue.put(_END)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
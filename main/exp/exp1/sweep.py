@@ -0,0 +1,113 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exp2'))
+from ingest import CONF_THRESHOLD
+from keypoint_io import load_any
+from metrics import batch_joint_angles
+from rolling import rolling_motion_smoothness, rolling_movement_stability_index
+
+# 視窗大小掃描：對已儲存的關鍵點一次算出每個視窗大小、每一幀的指標序列，
+# 取代 exp1_b.py 只在合成資料的最後一個視窗上計算的做法。
+
+ANGLE_TRIPLE = (5, 7, 9)  # 肩膀-肘部-手腕，與 exp1_a.py 相同
+METRICS = ('motion_smoothness', 'movement_stability_index')
+
+
+def person_series(keypoints, valid=None):
+    """
+    由單人的關鍵點 (frames, 17, 2) 算出各指標需要的序列。
+    :param valid: 有效關節平面，shape = (frames, 17)；角度的三個關節皆有效才計算 (與 exp1_a.py 相同)
+    回傳 dict: angles (度，無效的幀為 NaN)、trajectories、center_of_mass
+    """
+    return {
+        'angles': np.degrees(batch_joint_angles(keypoints, [ANGLE_TRIPLE], fill_value=np.nan, valid=valid)[0]),
+        'trajectories': keypoints,
+        'center_of_mass': keypoints.mean(axis=1),
+    }
+
+
+def sweep_keypoints(keypoints, window_sizes, metrics=METRICS, valid=None):
+    """
+    對單人的關鍵點序列計算所有視窗大小的逐幀指標。
+    :param keypoints: shape = (frames, 17, 2)
+    :param valid: 有效關節平面，shape = (frames, 17)，None 時所有關節視為有效
+    :return: dict (metric, window_size) -> shape = (frames,) 的指標序列
+    運動平滑性與 exp1_a.py 相同，視窗只計算角度有效的幀；角度無效的幀為 NaN
+    """
+    series = person_series(keypoints, valid)
+    angle_ok = ~np.isnan(series['angles'])
+    results = {}
+    for window_size in window_sizes:
+        if 'motion_smoothness' in metrics:
+            smoothness = np.full(len(keypoints), np.nan)
+            smoothness[angle_ok] = rolling_motion_smoothness(series['angles'][angle_ok], window_size)
+            results['motion_smoothness', window_size] = smoothness
+        if 'movement_stability_index' in metrics:
+            results['movement_stability_index', window_size] = rolling_movement_stability_index(
+                series['trajectories'], series['center_of_mass'], window_size)
+    return results
+
+
+def sweep_recording(path, window_sizes, metrics=METRICS):
+    """
+    對一支錄影的所有人計算所有視窗大小的逐幀指標。
+    :param path: keypoints_data.npy 或 keypoints_data.csv
+    :return: tidy DataFrame (recording, person, window_size, frame, metric, value)
+    """
+    keypoints, track_ids = load_any(path)
+    tables = []
+    for person_idx, track_id in enumerate(track_ids):
+        person = np.asarray(keypoints[:, person_idx], dtype=np.float64)
+        # 只使用有偵測到此人的幀，幀編號保留原始值
+        frames = np.flatnonzero(~np.all(np.isnan(person[..., 0]), axis=1))
+        if len(frames) == 0:
+            continue
+        # 與 exp1_a.py 相同以信心值門檻判斷有效關節 (舊版 CSV 以座標 > 0 視為信心 1)
+        with np.errstate(invalid='ignore'):
+            valid = person[frames, :, 2] >= CONF_THRESHOLD
+        for (metric, window_size), values in sweep_keypoints(person[frames, :, :2], window_sizes, metrics,
+                                                             valid).items():
+            tables.append(pd.DataFrame({
+                'recording': path,
+                'person': track_id,
+                'window_size': window_size,
+                'frame': frames,
+                'metric': metric,
+                'value': values,
+            }))
+    if not tables:
+        return pd.DataFrame(columns=['recording', 'person', 'window_size', 'frame', 'metric', 'value'])
+    return pd.concat(tables, ignore_index=True)
+
+
+def run_sweep(paths, window_sizes, metrics=METRICS, output_path='sweep_results.csv', max_workers=None):
+    """
+    以行程池平行處理多支錄影，並將結果寫成一張 tidy 表格。
+    :param paths: 關鍵點檔案列表
+    :param window_sizes: 欲測試的視窗大小
+    :param max_workers: 行程數，預設為 CPU 核心數
+    """
+    window_sizes = list(window_sizes)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(sweep_recording, paths,
+                                   [window_sizes] * len(paths), [tuple(metrics)] * len(paths)))
+    results = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    if output_path is not None:
+        results.to_csv(output_path, index=False)
+    return results
+
+
+if __name__ == "__main__":
+    # 想要測試的 window_sizes 與錄影
+    window_sizes = [5, 10, 20, 30, 50, 80, 100]
+    paths = [
+        '../exp2/rec/walk/normal/keypoints_data.csv',
+        '../exp2/rec/walk/abnormal/keypoints_data.csv',
+    ]
+
+    results = run_sweep(paths, window_sizes, output_path='./sweep_results.csv')
+    print(results.groupby(['recording', 'metric', 'window_size'])['value'].describe())
@@ -0,0 +1,279 @@
+import os
+import sys
+import json
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exp2'))
+from ingest import CONF_THRESHOLD
+from keypoint_io import load_any
+from metrics import batch_joint_angles, _hold_angles
+
+# 模仿任務的動作模板索引：
+# 每個參考動作只計算一次正規化的關節角度序列並快取到磁碟，
+# 即時或錄影的關鍵點再以串流的子序列 DTW (SPRING) 同時比對所有模板。
+
+# 模仿任務使用的關節角度 (前一關節, 頂點關節, 後一關節)
+TEMPLATE_TRIPLES = {
+    "left_elbow": (5, 7, 9),
+    "right_elbow": (6, 8, 10),
+    "left_shoulder": (7, 5, 11),
+    "right_shoulder": (8, 6, 12),
+    "left_hip": (5, 11, 13),
+    "right_hip": (6, 12, 14),
+    "left_knee": (11, 13, 15),
+    "right_knee": (12, 14, 16),
+}
+
+TEMPLATE_FORMAT = 2  # 特徵計算方式改變時遞增，舊的快取自動重建 (2: 依信心值沿用無效關節的前一個角度)
+
+
+def angle_features(keypoints, triples=TEMPLATE_TRIPLES, valid=None):
+    """
+    將關鍵點轉成正規化的關節角度特徵 (角度 / π，範圍 0~1)。
+    keypoints: numpy array, shape = (frames, 17, 2)
+    valid: 有效關節平面，shape = (frames, 17)；無效關節 (或零長度肢段) 沿用前一幀的角度，
+           第一次有效之前為 0，與 SubsequenceMatcher.update 的串流處理相同
+    回傳 shape = (frames, len(triples))
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    angles = _hold_angles(batch_joint_angles(keypoints, list(triples.values()), fill_value=np.nan, valid=valid))
+    return np.nan_to_num(angles, nan=0.0).T / np.pi
+
+
+def _first_person(path, conf_threshold=CONF_THRESHOLD):
+    """
+    讀取參考錄影中第一個人有偵測到的幀。
+    回傳 (keypoints, valid)，shape 分別為 (frames, 17, 2) 與 (frames, 17)；
+    valid 以信心值門檻判斷 (舊版 CSV 以座標 > 0 視為信心 1)
+    """
+    keypoints, _ = load_any(path)
+    person = np.asarray(keypoints[:, 0], dtype=np.float64)
+    person = person[~np.all(np.isnan(person[..., 0]), axis=1)]
+    return person[..., :2], person[..., 2] >= conf_threshold
+
+
+class TemplateIndex:
+    """
+    預先計算好的動作模板特徵。
+    names: 模板名稱列表
+    features: 每個模板的特徵序列，shape = (frames, len(triples))
+    """
+
+    def __init__(self, names, features, triples=TEMPLATE_TRIPLES, sources=None):
+        self.names = list(names)
+        self.features = [np.asarray(feature, dtype=np.float64) for feature in features]
+        self.triples = dict(triples)
+        self.sources = dict(sources or {})
+        self.format = TEMPLATE_FORMAT
+
+    @classmethod
+    def from_keypoints(cls, templates, triples=TEMPLATE_TRIPLES, valid=None):
+        """
+        templates: dict 名稱 -> 關鍵點陣列 (frames, 17, 2)
+        valid: dict 名稱 -> 有效關節平面 (frames, 17)，缺少的模板視為所有關節有效
+        """
+        valid = valid or {}
+        features = [angle_features(kp, triples, valid.get(name)) for name, kp in templates.items()]
+        return cls(templates.keys(), features, triples)
+
+    @classmethod
+    def from_files(cls, sources, triples=TEMPLATE_TRIPLES):
+        """sources: dict 名稱 -> keypoints_data.npy / keypoints_data.csv 路徑"""
+        people = {name: _first_person(path) for name, path in sources.items()}
+        index = cls.from_keypoints({name: xy for name, (xy, _) in people.items()}, triples,
+                                   {name: valid for name, (_, valid) in people.items()})
+        index.sources = {name: _source_signature(path) for name, path in sources.items()}
+        return index
+
+    def save(self, path):
+        lengths = np.array([len(feature) for feature in self.features], dtype=np.int64)
+        np.savez(path,
+                 features=np.concatenate(self.features) if self.features else np.zeros((0, len(self.triples))),
+                 lengths=lengths,
+                 info=json.dumps({'format': TEMPLATE_FORMAT,
+                                  'names': self.names,
+                                  'triples': {k: list(v) for k, v in self.triples.items()},
+                                  'sources': self.sources}))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            info = json.loads(str(data['info']))
+            features = np.split(data['features'], np.cumsum(data['lengths'])[:-1])
+        triples = {k: tuple(v) for k, v in info['triples'].items()}
+        index = cls(info['names'], features, triples, info['sources'])
+        index.format = info.get('format', 1)
+        return index
+
+    @classmethod
+    def cached(cls, cache_path, sources, triples=TEMPLATE_TRIPLES):
+        """
+        讀取快取的模板索引；來源檔案或關節設定改變時重新建立並覆寫快取。
+        """
+        if os.path.exists(cache_path):
+            index = cls.load(cache_path)
+            signatures = {name: _source_signature(path) for name, path in sources.items()}
+            if (index.format == TEMPLATE_FORMAT and index.sources == signatures
+                    and index.triples == dict(triples)):
+                return index
+        index = cls.from_files(sources, triples)
+        index.save(cache_path)
+        return index
+
+    def matcher(self):
+        return SubsequenceMatcher(self)
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+class SubsequenceMatcher:
+    """
+    串流的子序列 DTW (SPRING)，每推入一幀同時更新所有模板的累積成本。
+    成本為模板完整對齊到目前這一幀的最小 DTW 距離 (平方歐氏距離總和)，
+    以模板長度正規化後比較不同長度的模板。
+    SPRING 沒有斜率限制，整個模板可能壓縮到一兩幀上；對齊跨越的幀數少於 min_span_ratio * 模板長度
+    的結果不採用，且推入的幀數達到模板長度之前不輸出該模板。
+    """
+
+    def __init__(self, index, min_span_ratio=0.5):
+        """
+        index: TemplateIndex
+        min_span_ratio: 比對結果至少需跨越的幀數，相對於模板長度
+        """
+        self.index = index
+        self.min_span_ratio = min_span_ratio
+        self.lengths = np.array([len(feature) for feature in index.features])
+        max_length = self.lengths.max() if len(self.lengths) else 0
+        num_features = len(index.triples)
+
+        # 模板補齊到相同長度，補齊的位置成本為 inf
+        self._templates = np.zeros((len(self.lengths), max_length, num_features))
+        self._pad = np.ones((len(self.lengths), max_length), dtype=bool)
+        for i, feature in enumerate(index.features):
+            self._templates[i, :len(feature)] = feature
+            self._pad[i, :len(feature)] = False
+
+        self._cost = np.full((len(self.lengths), max_length), np.inf)
+        self._start = np.zeros((len(self.lengths), max_length), dtype=np.int64)
+        self._rows = np.arange(len(self.lengths))
+        self._min_span = np.maximum((self.lengths * min_span_ratio).astype(np.int64), 1)
+        self._last_feature = np.zeros(num_features)  # 無效關節沿用的前一個特徵
+        self.count = 0
+
+    def reset(self):
+        self._cost[:] = np.inf
+        self._start[:] = 0
+        self._last_feature[:] = 0.0
+        self.count = 0
+
+    def update(self, frame_keypoints, valid=None):
+        """
+        推入一幀關鍵點 (17, 2)，valid 為此幀的有效關節 (17,)。
+        無效關節沿用前一幀的角度 (與 angle_features 對模板的處理相同)。
+        回傳目前最佳的比對結果 dict(template, cost, start, end)，沒有任何模板完成對齊時回傳 None
+        """
+        if valid is not None:
+            valid = np.asarray(valid)[None]
+        keypoints = np.asarray(frame_keypoints, dtype=np.float64)[None, :, :2]
+        angles = batch_joint_angles(keypoints, list(self.index.triples.values()),
+                                    fill_value=np.nan, valid=valid)[:, 0]
+        defined = ~np.isnan(angles)
+        self._last_feature[defined] = angles[defined] / np.pi
+        return self.update_features(self._last_feature.copy())
+
+    def update_features(self, feature):
+        t = self.count
+        self.count += 1
+        if len(self.lengths) == 0:
+            return None
+
+        # 此幀與模板每個位置的距離
+        local = np.sum((self._templates - feature) ** 2, axis=2)
+        local[self._pad] = np.inf
+
+        # d[i] = c[i] + min(d[i-1], a[i])，a[i] = min(前一幀的 d[i], d[i-1])，d[-1] = 0 (子序列可從任一幀開始)
+        # 以 min-plus 前綴掃描一次算完：d[i] = C[i] + min_{k<=i} (a[k] - C[k-1])
+        prev_cost = self._cost
+        prev_diag = np.concatenate([np.zeros((len(self.lengths), 1)), prev_cost[:, :-1]], axis=1)
+        prev_diag_start = np.concatenate([np.full((len(self.lengths), 1), t), self._start[:, :-1]], axis=1)
+        use_diag = prev_diag <= prev_cost
+        incoming = np.where(use_diag, prev_diag, prev_cost)
+        incoming_start = np.where(use_diag, prev_diag_start, self._start)
+        incoming[:, 0] = 0.0  # 從此幀開始新的子序列
+        incoming_start[:, 0] = t
+
+        with np.errstate(invalid='ignore'):
+            cumulative = np.cumsum(local, axis=1)
+            shifted = np.concatenate([np.zeros((len(self.lengths), 1)), cumulative[:, :-1]], axis=1)
+            candidates = incoming - shifted
+            candidates[np.isnan(candidates)] = np.inf
+        running_min = np.minimum.accumulate(candidates, axis=1)
+        positions = np.arange(candidates.shape[1])
+        # 每個位置達到目前最小值的 k，用來追蹤子序列起點
+        best_k = np.maximum.accumulate(np.where(candidates <= running_min, positions, 0), axis=1)
+
+        with np.errstate(invalid='ignore'):
+            self._cost = cumulative + running_min
+        self._cost[self._pad] = np.inf
+        self._start = np.take_along_axis(incoming_start, best_k, axis=1)
+
+        end_cost = self._cost[self._rows, self.lengths - 1] / self.lengths
+        starts = self._start[self._rows, self.lengths - 1]
+        # 尚未看到完整模板長度的幀，或對齊壓縮成過短的片段時不採用
+        eligible = (self.count >= self.lengths) & (t - starts + 1 >= self._min_span)
+        end_cost = np.where(eligible, end_cost, np.inf)
+        best = int(np.argmin(end_cost))
+        if not np.isfinite(end_cost[best]):
+            return None
+        return {
+            "template": self.index.names[best],
+            "cost": float(end_cost[best]),
+            "start": int(starts[best]),
+            "end": t,
+        }
+
+
+if __name__ == "__main__":
+    # 與直接計算的子序列 DTW 比對
+    rng = np.random.default_rng(0)
+    templates = {f"move_{i}": np.cumsum(rng.normal(size=(rng.integers(10, 25), 17, 2)), axis=0) + 300
+                 for i in range(4)}
+    stream = np.cumsum(rng.normal(size=(80, 17, 2)), axis=0) + 300
+    stream[30:30 + len(templates["move_2"])] = templates["move_2"]
+
+    index = TemplateIndex.from_keypoints(templates)
+    matcher = index.matcher()
+    query = angle_features(stream)
+    lengths = dict(zip(index.names, matcher.lengths))
+    planted_end = 30 + lengths["move_2"] - 1
+    for t, frame in enumerate(stream):
+        result = matcher.update(frame)
+        if result is not None:
+            # 看到完整模板長度之前不輸出，且不採用壓縮到過短片段的對齊
+            length = lengths[result["template"]]
+            assert t + 1 >= length and result["end"] - result["start"] + 1 >= length // 2, (t, result)
+        if t == planted_end:
+            assert result["template"] == "move_2" and result["start"] == 30 and np.isclose(result["cost"], 0.0)
+        for i, feature in enumerate(index.features):
+            # 暴力法：對所有起點計算完整 DTW
+            local = np.sum((query[:t + 1, None, :] - feature[None, :, :]) ** 2, axis=2)
+            dp = np.full((t + 2, len(feature) + 1), np.inf)
+            dp[:, 0] = 0.0
+            for a in range(1, t + 2):
+                for b in range(1, len(feature) + 1):
+                    dp[a, b] = local[a - 1, b - 1] + min(dp[a - 1, b], dp[a, b - 1], dp[a - 1, b - 1])
+            assert np.isclose(matcher._cost[i, len(feature) - 1], dp[t + 1, len(feature)])
+
+    # 模板與串流以相同的方式處理無效關節：同一段動作掉同樣的關節時仍完全對齊
+    valid = rng.random((len(stream), 17)) > 0.1
+    valid[30] = True
+    index = TemplateIndex.from_keypoints(templates, valid={"move_2": valid[30:planted_end + 1]})
+    matcher = index.matcher()
+    for t, (frame, frame_valid) in enumerate(zip(stream, valid)):
+        result = matcher.update(frame, valid=frame_valid)
+        if t == planted_end:
+            assert result["template"] == "move_2" and result["start"] == 30 and np.isclose(result["cost"], 0.0)
+    print(f"subsequence matcher ok, final match: {result}")
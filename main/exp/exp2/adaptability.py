@@ -0,0 +1,210 @@
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from dtaidistance import dtw
+
+
+def _as_series(series):
+    return np.ascontiguousarray(series, dtype=np.float64)
+
+
+def _band_offsets(query_length, template_length, window):
+    """
+    Sakoe-Chiba band of dtaidistance for query index i: template indices in [i - lower, i + upper].
+    """
+    if window is None:
+        window = max(query_length, template_length)
+    lower = max(0, query_length - template_length) + window - 1
+    upper = max(0, template_length - query_length) + window - 1
+    return lower, upper
+
+
+def lb_kim(query, template):
+    """
+    LB_Kim (first/last) lower bound of the DTW distance.
+
+    Parameters:
+    query, template (np.array): Time series.
+
+    Returns:
+    float: Lower bound in the units of dtw.distance().
+    """
+    bound = (query[0] - template[0]) ** 2
+    if len(query) > 1 and len(template) > 1:
+        bound += (query[-1] - template[-1]) ** 2
+    return np.sqrt(bound)
+
+
+def envelope(template, query_length, window=None):
+    """
+    Upper and lower envelope of a template over the warping band of every query index.
+
+    Parameters:
+    template (np.array): Template time series.
+    query_length (int): Length of the query series.
+    window (int): Sakoe-Chiba window, None for unconstrained DTW.
+
+    Returns:
+    tuple: (upper, lower), each with shape (query_length,).
+    """
+    lower, upper = _band_offsets(query_length, len(template), window)
+    width = lower + upper + 1
+    right_pad = max(0, query_length + upper - len(template))
+    padded_max = np.concatenate([np.full(lower, -np.inf), template, np.full(right_pad, -np.inf)])
+    padded_min = np.concatenate([np.full(lower, np.inf), template, np.full(right_pad, np.inf)])
+    upper_env = sliding_window_view(padded_max, width)[:query_length].max(axis=1)
+    lower_env = sliding_window_view(padded_min, width)[:query_length].min(axis=1)
+    return upper_env, lower_env
+
+
+def lb_keogh(query, template, window=None, template_envelope=None):
+    """
+    LB_Keogh lower bound of the DTW distance under a Sakoe-Chiba window.
+
+    Parameters:
+    query, template (np.array): Time series.
+    window (int): Sakoe-Chiba window, None for unconstrained DTW.
+    template_envelope (tuple): Precomputed envelope(template, len(query), window).
+
+    Returns:
+    float: Lower bound in the units of dtw.distance().
+    """
+    if template_envelope is None:
+        template_envelope = envelope(template, len(query), window)
+    upper_env, lower_env = template_envelope
+    above = np.clip(query - upper_env, 0.0, None)
+    below = np.clip(lower_env - query, 0.0, None)
+    return np.sqrt(np.sum(above ** 2 + below ** 2))
+
+
+def _dtw(query, template, window, max_dist=None):
+    kwargs = {} if window is None else {'window': window}
+    if max_dist is not None and np.isfinite(max_dist):
+        kwargs['max_dist'] = max_dist
+    return dtw.distance(query, template, use_pruning=True, **kwargs)
+
+
+def _distance_row(query, templates, window, max_dist):
+    """DTW distances from one query to every template, skipping templates whose bounds exceed max_dist."""
+    query = _as_series(query)
+    row = np.full(len(templates), np.inf)
+    for j, template in enumerate(templates):
+        if max_dist is not None:
+            if lb_kim(query, template) > max_dist or lb_keogh(query, template, window) > max_dist:
+                continue
+        row[j] = _dtw(query, template, window, max_dist)
+    return row
+
+
+def _nearest_row(query, templates, k, window):
+    """Top-k templates of one query: exact DTW in increasing lower-bound order until the bound exceeds the k-th best."""
+    query = _as_series(query)
+    bounds = np.array([lb_kim(query, template) for template in templates])
+    order = np.argsort(bounds)
+    best = []  # max-heap of (-distance, index)
+    for j in order:
+        kth_best = -best[0][0] if len(best) == k else np.inf
+        if bounds[j] >= kth_best:
+            break
+        if lb_keogh(query, templates[j], window) >= kth_best:
+            continue
+        distance = _dtw(query, templates[j], window, max_dist=kth_best)
+        if distance < kth_best:
+            if len(best) == k:
+                heapq.heapreplace(best, (-distance, j))
+            else:
+                heapq.heappush(best, (-distance, j))
+    best = sorted((-neg_distance, j) for neg_distance, j in best)
+    return [j for _, j in best], [distance for distance, _ in best]
+
+
+def _map_queries(fn, queries, extra_args, max_workers):
+    if max_workers == 1 or len(queries) <= 1:
+        return [fn(query, *extra_args) for query in queries]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        iterables = [repeat(arg, len(queries)) for arg in extra_args]
+        return list(executor.map(fn, queries, *iterables, chunksize=max(1, len(queries) // 32)))
+
+
+def adaptability_matrix(queries, templates, window=None, max_dist=None, max_workers=None):
+    """
+    DTW adaptability of every query against every reference template.
+
+    Parameters:
+    queries (list): Query angle series.
+    templates (list): Reference template bank.
+    window (int): Sakoe-Chiba window, None for unconstrained DTW.
+    max_dist (float): Pairs whose LB_Kim/LB_Keogh bound or DTW distance exceeds this are set to inf.
+    max_workers (int): Process pool size, 1 runs in the current process.
+
+    Returns:
+    np.array: Distance matrix with shape (queries, templates).
+    """
+    templates = [_as_series(template) for template in templates]
+    rows = _map_queries(_distance_row, list(queries), (templates, window, max_dist), max_workers)
+    return np.array(rows).reshape(len(rows), len(templates))
+
+
+def nearest_templates(queries, templates, k=1, window=None, max_workers=None):
+    """
+    Top-k nearest reference templates of every query by DTW distance.
+
+    Candidates are visited in increasing LB_Kim order and pruned with LB_Kim and
+    LB_Keogh before exact DTW, which also abandons early past the current k-th best.
+
+    Parameters:
+    queries (list): Query angle series.
+    templates (list): Reference template bank.
+    k (int): Number of nearest templates to return.
+    window (int): Sakoe-Chiba window, None for unconstrained DTW.
+    max_workers (int): Process pool size, 1 runs in the current process.
+
+    Returns:
+    tuple: (indices, distances), each a list per query sorted by distance.
+
+    Raises:
+    ValueError: If the template bank is empty or k < 1.
+    """
+    templates = [_as_series(template) for template in templates]
+    if not templates:
+        raise ValueError("The template bank is empty.")
+    if k < 1:
+        raise ValueError(f"k must be at least 1, got {k}.")
+    k = min(k, len(templates))
+    rows = _map_queries(_nearest_row, list(queries), (templates, k, window), max_workers)
+    return [indices for indices, _ in rows], [distances for _, distances in rows]
+
+
+if __name__ == "__main__":
+    # 自我檢查：與逐對 dtw.distance() 比對完整矩陣、門檻與 top-k
+    rng = np.random.default_rng(0)
+    queries = [np.cumsum(rng.normal(size=rng.integers(20, 40))) for _ in range(6)]
+    templates = [np.cumsum(rng.normal(size=rng.integers(20, 40))) for _ in range(12)]
+
+    for window in (None, 5):
+        kwargs = {} if window is None else {'window': window}
+        expected = np.array([[dtw.distance(_as_series(query), _as_series(template), **kwargs)
+                              for template in templates] for query in queries])
+
+        matrix = adaptability_matrix(queries, templates, window=window, max_workers=1)
+        assert np.allclose(matrix, expected)
+
+        max_dist = float(np.median(expected))
+        thresholded = adaptability_matrix(queries, templates, window=window, max_dist=max_dist, max_workers=1)
+        assert np.allclose(thresholded, np.where(expected <= max_dist, expected, np.inf))
+
+        indices, distances = nearest_templates(queries, templates, k=3, window=window, max_workers=1)
+        for row, query_indices, query_distances in zip(expected, indices, distances):
+            assert np.allclose(query_distances, np.sort(row)[:3])
+            assert np.allclose(row[query_indices], query_distances)
+
+    for bad_args in (([], 1), (templates, 0)):
+        try:
+            nearest_templates(queries, *bad_args, max_workers=1)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"nearest_templates accepted k={bad_args[1]} with {len(bad_args[0])} templates")
+    print("adaptability matches dtw.distance()")
@@ -0,0 +1,331 @@
+import time
+import numpy as np
+import cv2
+from ingest import CONF_THRESHOLD, PoseFrame, ingest_results
+from kinematics import Kinematics
+from metrics import JOINT_TRIPLES, batch_joint_angles
+from profiling import NULL_PROFILER
+
+# 自適應頻率推論：
+# 每 stride 幀才執行一次 YOLO Pose，中間的幀以光流 (Lucas-Kanade) 追蹤關鍵點，
+# 或在兩個推論幀之間線性內插；關節速度 (運動能量) 超過門檻時回到每幀推論，
+# 動作平穩一段時間後再恢復跳幀。
+
+
+def match_persons(prev_xy, prev_valid, xy, valid):
+    """
+    依身體中心距離將前一組人與目前的人貪婪配對。
+    回傳長度為 len(xy) 的陣列，值為對應的前一組索引，沒有對應時為 -1
+    """
+    def centroids(points, mask):
+        counts = mask.sum(axis=1)
+        sums = np.where(mask[..., None], points, 0.0).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts[:, None]
+
+    matches = np.full(len(xy), -1)
+    if len(prev_xy) == 0 or len(xy) == 0:
+        return matches
+    distance = np.linalg.norm(centroids(xy, valid)[:, None] - centroids(prev_xy, prev_valid)[None], axis=-1)
+    distance[np.isnan(distance)] = np.inf
+    for flat in np.argsort(distance, axis=None):
+        i, j = np.unravel_index(flat, distance.shape)
+        if not np.isfinite(distance[i, j]):
+            break
+        if matches[i] < 0 and j not in matches:
+            matches[i] = j
+    return matches
+
+
+def motion_energy(prev_pose, pose, frames_elapsed, fps=30, kinematics=None):
+    """
+    兩個姿態之間的運動能量：配對到的人之中，有效關節平均速度 (像素/秒) 的最大值。
+    速度與平滑度指標一樣由 kinematics 的一階差分算出，跨多幀時再除以間隔幀數。
+    kinematics: dt = 1 / fps 的 Kinematics 工作區，None 時新建
+    """
+    if frames_elapsed <= 0:
+        return 0.0
+    matches = match_persons(prev_pose.xy, prev_pose.valid, pose.xy, pose.valid)
+    current = np.flatnonzero(matches >= 0)
+    if len(current) == 0:
+        return 0.0
+    previous = matches[current]
+    both = prev_pose.valid[previous] & pose.valid[current]
+    kinematics = Kinematics(1.0 / fps, order=1) if kinematics is None else kinematics
+    # (2, persons, 17, 2) 的兩幀序列，一階差分只有一幀
+    velocity = kinematics.compute(np.stack([prev_pose.xy[previous], pose.xy[current]]))[0][0]
+    speed = np.linalg.norm(velocity, axis=-1) / frames_elapsed
+    counts = both.sum(axis=1)
+    if not counts.any():
+        return 0.0
+    mean_speed = np.where(both, speed, 0.0).sum(axis=1)[counts > 0] / counts[counts > 0]
+    return float(mean_speed.max())
+
+
+class AdaptiveScheduler:
+    """
+    決定每一幀是否執行推論。
+    平常每 stride 幀推論一次；運動能量超過 motion_threshold 時每幀推論，
+    連續 hold_frames 幀低於門檻後恢復跳幀。
+    """
+
+    def __init__(self, stride=4, motion_threshold=150.0, fps=30, hold_frames=None):
+        """
+        stride: 平穩時的推論間隔 (幀)，1 為每幀推論
+        motion_threshold: 回到每幀推論的關節平均速度門檻 (像素/秒)
+        fps: 影片幀率
+        hold_frames: 回到跳幀前需連續平穩的幀數，預設為 2 * stride
+        """
+        self.stride = max(1, int(stride))
+        self.motion_threshold = motion_threshold
+        self.fps = fps
+        self.hold_frames = 2 * self.stride if hold_frames is None else hold_frames
+        self._kinematics = Kinematics(1.0 / fps, order=1)
+        self.full_rate = False
+        self.energy = 0.0
+        self._last_inferred = None
+        self._last_pose = None
+        self._last_frame = None
+        self._calm = 0
+
+    def should_infer(self, frame_index):
+        return (self._last_inferred is None or self.full_rate
+                or frame_index - self._last_inferred >= self.stride)
+
+    def observe(self, frame_index, pose, inferred):
+        """以推論或估計出的姿態更新運動能量與推論頻率"""
+        if self._last_pose is not None:
+            self.energy = motion_energy(self._last_pose, pose, frame_index - self._last_frame, self.fps,
+                                        self._kinematics)
+            if self.energy > self.motion_threshold:
+                self.full_rate = True
+                self._calm = 0
+            elif self.full_rate:
+                self._calm += 1
+                if self._calm >= self.hold_frames:
+                    self.full_rate = False
+        if inferred:
+            self._last_inferred = frame_index
+        self._last_pose = pose
+        self._last_frame = frame_index
+
+
+def _flow_pose(prev_gray, gray, pose, win_size=(21, 21), max_level=3):
+    """以 Lucas-Kanade 光流把上一幀的有效關鍵點追蹤到目前這一幀"""
+    xy = np.array(pose.xy, dtype=np.float32)
+    valid = np.array(pose.valid, dtype=bool)
+    if valid.any():
+        points = xy[valid].reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None,
+                                                    winSize=win_size, maxLevel=max_level)
+        tracked = status.reshape(-1).astype(bool)
+        xy[valid] = moved.reshape(-1, 2)
+        lost = np.flatnonzero(valid)[~tracked]
+        valid.flat[lost] = False
+        xy.reshape(-1, 2)[lost] = 0.0
+    return PoseFrame(xy, pose.conf, valid, pose.track_ids)
+
+
+def _interpolate_pose(start_index, start_pose, end_index, end_pose, frame_index):
+    """在兩個推論幀之間線性內插；只出現在其中一端的人或關節沿用起點的值"""
+    weight = (frame_index - start_index) / (end_index - start_index)
+    xy = np.array(start_pose.xy, dtype=np.float32)
+    valid = np.array(start_pose.valid, dtype=bool)
+    matches = match_persons(end_pose.xy, end_pose.valid, start_pose.xy, start_pose.valid)
+    for i, j in enumerate(matches):
+        if j < 0:
+            continue
+        both = valid[i] & end_pose.valid[j]
+        xy[i][both] += weight * (end_pose.xy[j][both] - xy[i][both])
+    return PoseFrame(xy, start_pose.conf, valid, start_pose.track_ids)
+
+
+def adaptive_poses(frames, model, scheduler=None, estimator='flow', params=None,
+                   conf_threshold=CONF_THRESHOLD, profiler=None):
+    """
+    以自適應頻率推論逐幀產生姿態。
+    frames: (frame_index, frame) 的迭代器
+    model: YOLO Pose 模型，以 model(frame, **params) 推論
+    scheduler: AdaptiveScheduler，None 時使用預設值
+    estimator: 'flow' 以光流追蹤 (不延遲)，或 'interpolate' 在推論幀之間內插
+               (需等到下一個推論幀，最多延遲 stride 幀)
+    profiler: profiling.StageProfiler，分別計時 'inference'、'transfer' 與 'estimate' (光流或內插) 階段
+    產生 (frame_index, frame, PoseFrame, inferred)
+    """
+    profiler = NULL_PROFILER if profiler is None else profiler
+    scheduler = AdaptiveScheduler() if scheduler is None else scheduler
+    params = dict(params or {})
+    if estimator not in ('flow', 'interpolate'):
+        raise ValueError(f"Unknown keypoint estimator: {estimator}")
+
+    def infer(frame):
+        with profiler.stage('inference'):
+            results = model(frame, **params)
+        return ingest_results(results, conf_threshold, profiler)[0]
+
+    def interpolate(start, end_index, end_pose, frame_index):
+        with profiler.stage('estimate'):
+            return _interpolate_pose(*start, end_index, end_pose, frame_index)
+
+    prev_gray = None
+    prev_pose = None
+    key = None  # 內插模式最近一個推論幀 (frame_index, pose)
+    pending = []  # 內插模式等待下一個推論幀的 (frame_index, frame)
+
+    for frame_index, frame in frames:
+        inferred = scheduler.should_infer(frame_index)
+        if estimator == 'interpolate':
+            if not inferred:
+                pending.append((frame_index, frame))
+                continue
+            pose = infer(frame)
+            scheduler.observe(frame_index, pose, True)
+            for pending_index, pending_frame in pending:
+                yield pending_index, pending_frame, interpolate(key, frame_index, pose, pending_index), False
+            pending.clear()
+            key = (frame_index, pose)
+            yield frame_index, frame, pose, True
+            continue
+
+        with profiler.stage('estimate'):
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if not inferred:
+                pose = _flow_pose(prev_gray, gray, prev_pose)
+        if inferred:
+            pose = infer(frame)
+        scheduler.observe(frame_index, pose, inferred)
+        prev_gray, prev_pose = gray, pose
+        yield frame_index, frame, pose, inferred
+
+    if pending:
+        # 影片結束：最後一幀補做推論，其餘內插
+        last_index, last_frame = pending.pop()
+        pose = infer(last_frame)
+        for pending_index, pending_frame in pending:
+            yield pending_index, pending_frame, interpolate(key, last_index, pose, pending_index), False
+        yield last_index, last_frame, pose, True
+
+
+def read_frames(video_path, profiler=None):
+    """逐幀產生 (frame_index, frame)；profiler 將解碼計入 'decode' 階段"""
+    profiler = NULL_PROFILER if profiler is None else profiler
+    cap = cv2.VideoCapture(video_path)
+    try:
+        frame_index = 0
+        while cap.isOpened():
+            with profiler.stage('decode'):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame_index, frame
+            frame_index += 1
+    finally:
+        cap.release()
+
+
+def adaptive_video_poses(video_path, model, stride=4, motion_threshold=150.0, estimator='flow',
+                         params=None, fps=None, conf_threshold=CONF_THRESHOLD, profiler=None):
+    """
+    與 pose_cache.video_poses 相同的介面：產生 (frame_index, frame, PoseFrame)，
+    但以自適應頻率推論。
+    profiler: profiling.StageProfiler，計時 'decode'、'inference'、'transfer' 與 'estimate' 階段
+    """
+    if fps is None:
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        cap.release()
+    scheduler = AdaptiveScheduler(stride, motion_threshold, fps)
+    for frame_index, frame, pose, _ in adaptive_poses(read_frames(video_path, profiler), model, scheduler,
+                                                      estimator, params, conf_threshold, profiler):
+        yield frame_index, frame, pose
+
+
+def _pose_errors(reference, estimate):
+    """配對後的關鍵點誤差 (像素) 與關節角度誤差 (度)"""
+    matches = match_persons(reference.xy, reference.valid, estimate.xy, estimate.valid)
+    point_errors, angle_errors = [], []
+    triples = np.array(list(JOINT_TRIPLES.values()))
+    for i, j in enumerate(matches):
+        if j < 0:
+            continue
+        both = estimate.valid[i] & reference.valid[j]
+        point_errors.append(np.linalg.norm(estimate.xy[i][both] - reference.xy[j][both], axis=-1))
+        ok = both[triples].all(axis=1)
+        angles = batch_joint_angles(np.stack([estimate.xy[i], reference.xy[j]]), triples)
+        angle_errors.append(np.degrees(np.abs(angles[ok, 0] - angles[ok, 1])))
+    if not point_errors:
+        return np.zeros(0), np.zeros(0)
+    return np.concatenate(point_errors), np.concatenate(angle_errors)
+
+
+def compare_to_full_rate(video_path, model, stride=4, motion_threshold=150.0, estimator='flow', params=None,
+                         repeats=3, warmup=3):
+    """
+    對同一支影片分別以每幀推論與自適應推論執行，回報加速與準確度差異。
+    計時前先以第一幀做 warmup 次不計時的推論 (模型載入、CUDA 初始化等)，
+    兩種模式再交替執行 repeats 次，各取最短耗時，避免先執行的一方吸收暖機成本。
+    回傳 dict：幀數、推論次數、兩種模式的耗時與加速倍數，
+    以及估計幀相對於每幀推論的關鍵點誤差 (像素) 與關節角度誤差 (度)
+    """
+    params = dict(params or {})
+    for _, frame in read_frames(video_path):
+        for _ in range(warmup):
+            model(frame, **params)
+        break
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+
+    full_time = adaptive_time = float('inf')
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        reference = [ingest_results(model(frame, **params))[0] for _, frame in read_frames(video_path)]
+        full_time = min(full_time, time.perf_counter() - start)
+
+        scheduler = AdaptiveScheduler(stride, motion_threshold, fps)
+        start = time.perf_counter()
+        adaptive = list(adaptive_poses(read_frames(video_path), model, scheduler, estimator, params))
+        adaptive_time = min(adaptive_time, time.perf_counter() - start)
+
+    point_errors, angle_errors = [], []
+    for frame_index, _, pose, inferred in adaptive:
+        if not inferred:
+            points, angles = _pose_errors(reference[frame_index], pose)
+            point_errors.append(points)
+            angle_errors.append(angles)
+    point_errors = np.concatenate(point_errors) if point_errors else np.zeros(0)
+    angle_errors = np.concatenate(angle_errors) if angle_errors else np.zeros(0)
+    inferred_frames = sum(inferred for *_, inferred in adaptive)
+
+    def summary(values, fn):
+        return float(fn(values)) if len(values) else 0.0
+
+    return {
+        'frames': len(reference),
+        'inferred_frames': int(inferred_frames),
+        'inference_ratio': inferred_frames / max(1, len(reference)),
+        'repeats': max(1, repeats),
+        'full_rate_seconds': full_time,
+        'adaptive_seconds': adaptive_time,
+        'speedup': full_time / adaptive_time if adaptive_time > 0 else float('inf'),
+        'mean_keypoint_error_px': summary(point_errors, np.mean),
+        'p95_keypoint_error_px': summary(point_errors, lambda v: np.percentile(v, 95)),
+        'mean_angle_error_deg': summary(angle_errors, np.mean),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+    from ultralytics import YOLO
+
+    # 用法: python adaptive.py video.mp4 [weights.pt] [stride] [flow|interpolate] [repeats]
+    video_path = sys.argv[1]
+    model = YOLO(sys.argv[2] if len(sys.argv) > 2 else '../exp1/yolo11x-pose.pt')
+    stride = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    estimator = sys.argv[4] if len(sys.argv) > 4 else 'flow'
+    repeats = int(sys.argv[5]) if len(sys.argv) > 5 else 3
+    report = compare_to_full_rate(video_path, lambda frame: model(frame, verbose=False),
+                                  stride=stride, estimator=estimator, repeats=repeats)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,189 @@
+import os
+import csv
+import numpy as np
+from metrics import StreamingTrajectorySmoothness, StreamingJointAngleDynamics
+from tracks import KeypointTrackStore
+from keypoint_io import KeypointArrayWriter, to_csv
+from ingest import CONF_THRESHOLD, valid_mask
+from preprocess import StreamingPreprocessor
+from profiling import NULL_PROFILER
+
+# DCR 使用的肢段連接關係
+DCR_CONNECTIONS = [
+    (5, 7),  # 肩膀到肘部
+    (7, 9),  # 肘部到手腕
+]
+
+# DCR 計算函數
+def calculate_dcr(keypoints, connections=DCR_CONNECTIONS, valid=None):
+    """
+    動態協調比 (DCR)：有效肢段長度的標準差 / 平均值，一次計算所有幀與所有人。
+    keypoints: numpy array, shape = (17, 2)、(persons, 17, 2) 或 (frames, persons, 17, 2)
+    connections: 肢段連接關係列表，例如 render.COCO_CONNECTIONS 的完整骨架
+    valid: 有效關節平面，shape 為 keypoints 去掉最後一維，None 時以座標皆 > 0 判斷 (NaN 視為無效)
+    回傳去掉最後兩維的陣列 (單人時為 float)；有效肢段少於 2 段時為 0
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64)[..., :2]
+    connections = np.asarray(connections, dtype=np.intp).reshape(-1, 2)
+    start, end = connections[:, 0], connections[:, 1]
+
+    # 兩端關節皆有效的肢段才列入計算
+    if valid is None:
+        valid = valid_mask(keypoints)
+    valid = np.asarray(valid, dtype=bool)
+    limb_valid = valid[..., start] & valid[..., end]
+    lengths = np.linalg.norm(keypoints[..., end, :] - keypoints[..., start, :], axis=-1)
+    lengths = np.where(limb_valid, lengths, 0.0)
+
+    count = limb_valid.sum(axis=-1)
+    denom = np.maximum(count, 1)
+    mean = lengths.sum(axis=-1) / denom
+    var = np.where(limb_valid, (lengths - mean[..., None]) ** 2, 0.0).sum(axis=-1) / denom
+    dcr = np.where(count >= 2, np.sqrt(var) / (mean + 1e-5), 0.0)  # 避免除以 0
+    return float(dcr) if dcr.ndim == 0 else dcr
+
+
+class MetricsRecorder:
+    """
+    exp2 的逐幀指標計算與輸出。
+    每幀送入偵測到的關鍵點，依追蹤 ID 更新 DCR、平滑度與 JAD，
+    關鍵點邊處理邊寫入 keypoints_data.npy (欄位式格式，見 keypoint_io.py)，
+    結束時寫出 dcr_values.csv、smoothness_values.csv、jad_values.csv。
+    """
+
+    def __init__(self, output_dir='.', window_size=30, fps=30, joint_idx=10,
+                 max_persons=8, keypoints_csv=False, metadata=None, dcr_connections=DCR_CONNECTIONS,
+                 conf_threshold=CONF_THRESHOLD, preprocess=None, smoothing_lam=None, profiler=None):
+        """
+        output_dir: 輸出資料夾
+        window_size: 視窗大小(幀數)
+        fps: 影片幀率
+        joint_idx: 平滑度指標分析的關節索引
+        max_persons: keypoints_data.npy 的初始 person 欄位數；每個追蹤 ID 佔一欄，超過時自動擴充，不會丟棄偵測
+        keypoints_csv: 結束時是否另外轉出舊版的 keypoints_data.csv
+        metadata: 額外寫入 keypoints_data.json 的中繼資料
+        dcr_connections: DCR 使用的肢段連接關係
+        conf_threshold: 只給信心值時判斷有效關節的門檻
+        preprocess: 平滑度與 JAD 前的缺漏補齊/濾波設定 (StreamingPreprocessor 的參數，
+                    例如 {'lookahead': 5, 'one_euro': True})，None 時使用原始關鍵點；
+                    啟用時這兩項指標會延遲 lookahead 幀輸出
+        smoothing_lam: 平滑度 Var 改用固定 λ 的線性平滑運算子 (見 smoothing.py)，None 時使用 UnivariateSpline
+        profiler: profiling.StageProfiler，分別計時 'tracking'、'keypoint_write'、'dcr'、'smoothness'、'jad' 與 'csv' 階段
+        """
+        self.output_dir = output_dir
+        self.window_size = window_size
+        self.fps = fps
+        self.joint_idx = joint_idx
+        self.keypoints_csv = keypoints_csv
+        self.dcr_connections = dcr_connections
+        self.conf_threshold = conf_threshold
+        self.preprocess = preprocess
+        self.smoothing_lam = smoothing_lam
+        self.profiler = NULL_PROFILER if profiler is None else profiler
+
+        os.makedirs(output_dir, exist_ok=True)
+        # 指標只需要最近一個視窗，完整歷史由 keypoint_writer 寫入檔案
+        self.track_store = KeypointTrackStore(capacity=window_size, ring=True, conf_threshold=conf_threshold)
+        self.keypoint_writer = KeypointArrayWriter(
+            os.path.join(output_dir, 'keypoints_data.npy'), max_persons=max_persons, grow=True,
+            metadata=dict({'fps': fps, 'window_size': window_size}, **(metadata or {})))
+        self.dcr_values = []  # 用於存儲 DCR 指標
+        self.smoothness_values = []  # 用於存儲平滑度指標
+        self.jad_values = []  # 用於存儲關節角度動態指標
+        self.smoothers = {}  # 每個追蹤 ID 的串流平滑度指標
+        self.jad_streams = {}  # 每個追蹤 ID 的串流關節角度動態指標
+        self.preprocessors = {}  # 每個追蹤 ID 的串流前處理
+
+    def update(self, frame_index, keypoints, track_ids=None, confidences=None, valid=None):
+        """
+        送入一幀的偵測結果並更新所有指標。
+        keypoints: numpy array, shape = (persons, 17, 2)
+        track_ids: 追蹤器 ID (model.track)，None 時由 track_store 依位置配對
+        confidences: 關鍵點信心值，shape = (persons, 17)，None 時以座標是否 > 0 判斷
+        valid: 有效關節平面，shape = (persons, 17)，None 時由 confidences 與 conf_threshold 算出
+        回傳每個人的追蹤 ID；依位置配對時沒有任何有效關節的人為 None，不記錄也不計算指標
+        """
+        keypoints = np.reshape(keypoints, (-1, 17, 2))
+        if valid is None:
+            valid = valid_mask(keypoints, confidences, self.conf_threshold)
+        if confidences is None:
+            confidences = valid.astype(np.float32)
+
+        with self.profiler.stage('tracking'):
+            track_ids = self.track_store.update(frame_index, keypoints, confidences=confidences, track_ids=track_ids)
+        all_track_ids = track_ids
+        if None in track_ids:
+            kept = [i for i, track_id in enumerate(track_ids) if track_id is not None]
+            keypoints, confidences, valid = keypoints[kept], np.asarray(confidences)[kept], np.asarray(valid)[kept]
+            track_ids = [track_ids[i] for i in kept]
+        with self.profiler.stage('keypoint_write'):
+            self.keypoint_writer.write(frame_index, keypoints, confidences=confidences, track_ids=track_ids)
+
+        # 一次計算此幀所有人的 DCR
+        with self.profiler.stage('dcr'):
+            dcr_values = calculate_dcr(keypoints, self.dcr_connections, valid=valid)
+        for track_id, dcr in zip(track_ids, dcr_values.tolist()):
+            self.dcr_values.append((frame_index, track_id, dcr))
+
+        for person_valid, track_id in zip(valid, track_ids):
+            if track_id not in self.smoothers:
+                self.smoothers[track_id] = StreamingTrajectorySmoothness(
+                    window_size=self.window_size, joint_idx=self.joint_idx, fps=self.fps, lam=self.smoothing_lam)
+                self.jad_streams[track_id] = StreamingJointAngleDynamics(
+                    fps=self.fps, window_size=self.window_size)
+                if self.preprocess is not None:
+                    self.preprocessors[track_id] = StreamingPreprocessor(fps=self.fps, **self.preprocess)
+            latest = self.track_store[track_id].latest()
+            if track_id in self.preprocessors:
+                # 補齊缺漏後輸出的是 lookahead 幀之前的那一幀
+                for delayed in self.preprocessors[track_id].update(frame_index, latest, person_valid):
+                    self._update_track(track_id, *delayed)
+            else:
+                self._update_track(track_id, frame_index, latest, person_valid)
+
+        return all_track_ids
+
+    def _update_track(self, track_id, frame_index, keypoints, valid):
+        """更新單一追蹤 ID 的平滑度與 JAD 指標"""
+        # 計算平滑度指標 (每幀只推入一次新的關鍵點，不重算整個視窗)
+        with self.profiler.stage('smoothness'):
+            smoothness_result = self.smoothers[track_id].update(keypoints, valid=valid)
+        if smoothness_result is not None:
+            self.smoothness_values.append((frame_index, track_id, smoothness_result['Smoothness'], smoothness_result['MSJ'], smoothness_result['Var']))
+
+        # 計算關節角度動態指標 (滾動更新，不必每幀重新擬合 PCA)
+        with self.profiler.stage('jad'):
+            jad_features = self.jad_streams[track_id].update(keypoints, valid=valid)
+        if jad_features is not None and self.jad_streams[track_id].count > self.window_size:
+            self.jad_values.append((frame_index, track_id, jad_features['coordination_index']))
+
+    def close(self):
+        """完成 keypoints_data.npy 並將指標數據保存為 CSV"""
+        # 送出前處理中尚在等待的幀
+        for track_id, preprocessor in self.preprocessors.items():
+            for delayed in preprocessor.flush():
+                self._update_track(track_id, *delayed)
+        self.keypoint_writer.close()
+        with self.profiler.stage('csv'):
+            if self.keypoints_csv:
+                to_csv(self.keypoint_writer.path)
+            self.write_csv(self.output_dir)
+
+    def write_csv(self, output_dir='.'):
+        """將指標數據保存為 CSV"""
+        os.makedirs(output_dir, exist_ok=True)
+
+        with open(os.path.join(output_dir, 'dcr_values.csv'), 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(['Frame', 'Person', 'DCR'])
+            csvwriter.writerows(self.dcr_values)
+
+        with open(os.path.join(output_dir, 'smoothness_values.csv'), 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(['Frame', 'Person', 'Smoothness', 'MSJ', 'Var'])
+            csvwriter.writerows(self.smoothness_values)
+
+        with open(os.path.join(output_dir, 'jad_values.csv'), 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(['Frame', 'Person', 'Coordination_Index'])
+            csvwriter.writerows(self.jad_values)
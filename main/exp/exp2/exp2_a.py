@@ -1,19 +1,64 @@
 from ultralytics import YOLO
 import numpy as np
 import cv2
-import csv
-from metrics import compute_trajectory_smoothness, JointAngleDynamics
+from analysis import MetricsRecorder, DCR_CONNECTIONS
+from render import draw_skeleton, OverlayWriter
+from pose_cache import PoseCache, video_poses
+from adaptive import adaptive_video_poses
+from roi import roi_video_poses
+from sharding import run_sharded
+from profiling import StageProfiler
 
 # 視訊模式處理
 window_size = 30  # 可根據需求調整視窗大小(幀數)
 
 # 載入 YOLO Pose 模型
-model = YOLO('../exp1/yolo11x-pose.pt')
+weights_path = '../exp1/yolo11x-pose.pt'
+model = YOLO(weights_path)
+
+# 姿態推論快取：同一支影片、權重與推論參數只推論一次，之後直接讀取關鍵點
+# 快取命中且 headless (也不輸出疊加影片) 時完全不解碼影片
+use_pose_cache = True
+pose_cache_max_gb = 20
+inference_params = {}  # 傳給 model(frame, **inference_params)，例如 {'imgsz': 640}
+
+# 自適應頻率推論 (見 exp2/adaptive.py)：adaptive_stride > 1 時平穩期間每 adaptive_stride 幀才推論一次，
+# 中間的幀以光流 ('flow') 或內插 ('interpolate') 估計，動作劇烈時自動回到每幀推論
+# adaptive_stride = 1 為每幀推論 (可使用推論快取)
+adaptive_stride = 1
+adaptive_motion_threshold = 150.0  # 回到每幀推論的關節平均速度 (像素/秒)
+adaptive_estimator = 'flow'
+
+# ROI 裁切推論 (見 exp2/roi.py)：以前一幀關鍵點外框裁切影格，在 roi_imgsz 上推論，
+# 每 roi_redetect_every 幀或追蹤遺失時改以整張影格重新偵測；適合 1080p / 4K 影片中人只佔一小塊的情況
+roi_inference = False
+roi_imgsz = 320
+roi_redetect_every = 30
+
+# 長影片分段平行處理 (見 exp2/sharding.py)：num_shards > 1 時把影片切成 num_shards 段
+# (各往前重疊至少 window_size 幀，跨越段界的人偵測不足時自動加長)，
+# 每段在獨立的行程中解碼、推論並計算指標，合併後的輸出與逐幀處理相同；此模式不顯示畫面也不輸出疊加影片
+num_shards = 1
 
 # 設定圖片或視訊路徑
 img_path = './abnormal_walk.mp4'
 is_video = True
 
+# 無顯示器 (headless) 批次模式：不繪製也不呼叫 cv2.imshow
+headless = False
+overlay_path = None  # 設定路徑 (例如 './overlay.mp4') 時另外輸出完整 COCO 骨架的疊加影片
+overlay_stride = 1  # 疊加影片每隔幾幀寫出一幀
+
+# 關鍵點以欄位式 keypoints_data.npy 輸出，設為 True 時另外轉出 keypoints_data.csv
+keypoints_csv = False
+
+# 分段計時 (見 exp2/profiling.py)：解碼、推論、.cpu() 搬移、各項指標、繪圖與 npy / CSV 輸出的耗時、幀率與記憶體峰值，
+# 設定 profile_report (例如 './profile_report.json') 時於結束時寫出報告，預設 None 為停用；可用 python profiling.py 舊報告.json 新報告.json 比對退步
+# 分段處理 (num_shards > 1) 時只計時整體的 'sharded' 階段
+profile_report = None
+profile_frames = 0  # 大於 0 時從第 profile_start 幀起對這麼多幀啟用 cProfile，結果寫入報告與 profile.prof
+profile_start = 30  # 略過模型暖機的幀
+
 # 定義關節連接關係，用於繪製骨架
 connections = [
     (5, 7),  # 肩膀到肘部
@@ -21,120 +66,92 @@ connections = [
     # 添加更多連接點根據需求繪製完整骨架
 ]
 
-# 初始化存儲結構
-person_keypoints_sequence = []  # 用於存儲每個人的關鍵點序列
-dcr_values = []  # 用於存儲 DCR 指標
-smoothness_values = []  # 用於存儲平滑度指標
-jad_values = []  # 用於存儲關節角度動態指標
-
-# DCR 計算函數
-def calculate_dcr(keypoints):
-    if len(keypoints) < 2:
-        return 0  # 如果關鍵點不足，返回 0
-
-    limb_sync = []
-    for start, end in connections:
-        if (keypoints[start][0] > 0 and keypoints[start][1] > 0 and
-            keypoints[end][0] > 0 and keypoints[end][1] > 0):
-            limb_vector = keypoints[end] - keypoints[start]
-            limb_sync.append(np.linalg.norm(limb_vector))
-
-    if len(limb_sync) < 2:
-        return 0
-
-    dcr = np.std(limb_sync) / (np.mean(limb_sync) + 1e-5)  # 避免除以 0
-    return dcr
+# DCR 使用的肢段表；只有兩段時 DCR 只反映左手臂，可改為 render.COCO_CONNECTIONS 使用完整骨架
+dcr_connections = DCR_CONNECTIONS
+
+# 平滑度與 JAD 前先補齊低信心/掉點的關節 (最多往後看 lookahead 幀)，避免 (0, 0) 造成的 jerk 尖峰
+# 預設 None 使用原始關鍵點 (與原本的輸出相同)；設為 {'lookahead': 5, 'max_gap': 15} 啟用，
+# 再加上 'one_euro': True 可套用 One-Euro 濾波
+preprocess = None
+
+# 平滑度 Var 的擬合：None 為逐視窗 UnivariateSpline；設為 λ (例如 smoothing.DEFAULT_LAM) 時改用
+# 預先計算的線性平滑運算子，每幀只需一次矩陣乘法 (見 exp2/smoothing.py)
+smoothing_lam = None
+
+profiler = StageProfiler(enabled=profile_report is not None, profile_frames=profile_frames,
+                         profile_start=profile_start, profile_path='./profile.prof',
+                         metadata={'video': img_path, 'weights': weights_path, 'params': inference_params,
+                                   'num_shards': num_shards})
+
+# 初始化存儲結構 (追蹤 ID、DCR、平滑度與關節角度動態指標)；分段處理時由各段自行記錄
+recorder = None
+if not (is_video and num_shards > 1):
+    recorder = MetricsRecorder('.', window_size=window_size, fps=30, keypoints_csv=keypoints_csv,
+                               metadata={'video': img_path}, dcr_connections=dcr_connections,
+                               preprocess=preprocess, smoothing_lam=smoothing_lam, profiler=profiler)
+
+# 分段平行處理：各段自行推論並計算指標，合併後直接寫出 npy / CSV
+if is_video and num_shards > 1:
+    with profiler.stage('sharded'):
+        run_sharded(img_path, weights_path, '.', num_shards, window_size=window_size, fps=30,
+                    keypoints_csv=keypoints_csv, dcr_connections=dcr_connections, preprocess=preprocess,
+                    params=inference_params, smoothing_lam=smoothing_lam)
 
 # 視訊模式處理
-if is_video:
-    cap = cv2.VideoCapture(img_path)
-    frame_index = 0
-
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        results = model(frame)
-
-        for result in results:
-            keypoints = result.keypoints.xy.cpu().numpy()  # 取得所有關鍵點座標
-
-            for person_keypoints in keypoints:
-                # 繪製點
-                for (x, y) in person_keypoints:
-                    if x > 0 and y > 0:
-                        cv2.circle(frame, (int(x), int(y)), radius=5, color=(255, 0, 0), thickness=-1)
-
-                # 繪製線條
-                for (start, end) in connections:
-                    if person_keypoints[start][0] > 0 and person_keypoints[start][1] > 0 and \
-                       person_keypoints[end][0] > 0 and person_keypoints[end][1] > 0:
-                        pt1 = (int(person_keypoints[start][0]), int(person_keypoints[start][1]))
-                        pt2 = (int(person_keypoints[end][0]), int(person_keypoints[end][1]))
-                        cv2.line(frame, pt1, pt2, color=(0, 255, 0), thickness=2)
-
-                # 更新每個人關鍵點的序列
-                if len(person_keypoints_sequence) <= frame_index:
-                    person_keypoints_sequence.append([])  # 初始化序列列表
-
-                person_keypoints_sequence[frame_index].append(person_keypoints)
-
-                # 計算 DCR 並存儲
-                dcr = calculate_dcr(person_keypoints)
-                dcr_values.append((frame_index, dcr))
-
-        # 計算平滑度指標
-        
-        if len(person_keypoints_sequence) > 3:
-            keypoints_array = np.array(person_keypoints_sequence[-window_size:])  # 取最近 window_size 幀
-            keypoints_array = keypoints_array.squeeze()  # 去除多餘的維度
-            smoothness_result = compute_trajectory_smoothness(keypoints_array)
-            smoothness_values.append((frame_index, smoothness_result['Smoothness'], smoothness_result['MSJ'], smoothness_result['Var']))
-
-        # 計算關節角度動態指標
-
-        if len(person_keypoints_sequence) > 30:
-            keypoints_array = np.array(person_keypoints_sequence[-window_size:])
-            # print(keypoints_array.shape)
-            keypoints_array = keypoints_array.squeeze()
-            jad = JointAngleDynamics(keypoints_array, fps=30)
-            features = jad.aggregate_features()
-            jad_values.append((frame_index, features['coordination_index']))
-
-        # 顯示結果
-        cv2.imshow('Pose Detection', frame)
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-
-        frame_index += 1
-
-    cap.release()
-    cv2.destroyAllWindows()
-
-# 將數據保存為 CSV
-with open('keypoints_data.csv', 'w', newline='') as csvfile:
-    csvwriter = csv.writer(csvfile)
-    csvwriter.writerow(['Frame', 'Person', 'Keypoint_Index', 'Keypoint_X', 'Keypoint_Y'])
-    for frame_idx, persons in enumerate(person_keypoints_sequence):
-        for person_idx, keypoints in enumerate(persons):
-            for kp_idx, (x, y) in enumerate(keypoints):
-                csvwriter.writerow([frame_idx, person_idx, kp_idx, x, y])
-
-with open('dcr_values.csv', 'w', newline='') as csvfile:
-    csvwriter = csv.writer(csvfile)
-    csvwriter.writerow(['Frame', 'DCR'])
-    for frame_idx, dcr in dcr_values:
-        csvwriter.writerow([frame_idx, dcr])
-
-with open('smoothness_values.csv', 'w', newline='') as csvfile:
-    csvwriter = csv.writer(csvfile)
-    csvwriter.writerow(['Frame', 'Smoothness', 'MSJ', 'Var'])
-    for frame_idx, smoothness, msj, var in smoothness_values:
-        csvwriter.writerow([frame_idx, smoothness, msj, var])
-
-with open('jad_values.csv', 'w', newline='') as csvfile:
-    csvwriter = csv.writer(csvfile)
-    csvwriter.writerow(['Frame', 'Coordination_Index'])
-    for frame_idx, jad in jad_values:
-        csvwriter.writerow([frame_idx, jad])
\ No newline at end of file
+elif is_video:
+    overlay = None
+    if overlay_path is not None:
+        cap = cv2.VideoCapture(img_path)
+        overlay = OverlayWriter(overlay_path, fps=cap.get(cv2.CAP_PROP_FPS) or 30, frame_stride=overlay_stride)
+        cap.release()
+
+    if roi_inference and adaptive_stride > 1:
+        raise ValueError("roi_inference and adaptive_stride > 1 cannot be combined; enable only one.")
+
+    # 每幀一次取得 (x, y, conf) 與有效關節平面 (快取命中時不推論)
+    if roi_inference:
+        poses = roi_video_poses(img_path, model, roi_imgsz, roi_redetect_every, inference_params,
+                                profiler=profiler)
+    elif adaptive_stride > 1:
+        poses = adaptive_video_poses(img_path, model, adaptive_stride, adaptive_motion_threshold,
+                                     adaptive_estimator, inference_params, profiler=profiler)
+    else:
+        # 推論快取只用於逐幀推論 (ROI 與自適應推論的結果依設定而異，不寫入快取)
+        pose_cache = PoseCache(max_bytes=pose_cache_max_gb * 1024 ** 3) if use_pose_cache else None
+        poses = video_poses(img_path, model, pose_cache, weights_path, inference_params,
+                            need_frames=not headless or overlay is not None, profiler=profiler)
+    for frame_index, frame, pose in profiler.iterate(poses, 'poses'):
+        keypoints = pose.xy
+        # 有追蹤器 ID (model.track) 時直接使用，否則由 track_store 依位置配對
+        with profiler.stage('metrics'):
+            recorder.update(frame_index, keypoints, track_ids=pose.track_ids,
+                            confidences=pose.conf, valid=pose.valid)
+
+        # 疊加影片另外繪製完整骨架；有畫面顯示時在副本上繪製
+        if overlay is not None:
+            with profiler.stage('overlay'):
+                overlay.write(frame_index, frame, keypoints, copy=not headless, valid=pose.valid)
+
+        # 繪製點與線條並顯示結果
+        if not headless:
+            with profiler.stage('draw'):
+                draw_skeleton(frame, keypoints, connections, valid=pose.valid)
+            with profiler.stage('display'):
+                cv2.imshow('Pose Detection', frame)
+                key = cv2.waitKey(1) & 0xFF
+            if key == ord('q'):
+                break
+        profiler.frame()
+
+    if overlay is not None:
+        overlay.release()
+    if not headless:
+        cv2.destroyAllWindows()
+
+# 將數據保存為 npy / CSV
+if recorder is not None:
+    with profiler.stage('output'):
+        recorder.close()
+
+if profile_report is not None:
+    profiler.print_summary(profiler.save(profile_report))
@@ -0,0 +1,119 @@
+from collections import namedtuple
+import numpy as np
+from profiling import NULL_PROFILER
+
+# YOLO Pose 結果的關鍵點讀取層：
+# 每批結果只把 keypoints.data (x, y, conf) 從 GPU 搬到 CPU 一次，
+# 存成 float32 緩衝區並以向量化門檻算出有效關節 (valid) 平面，
+# 繪圖、DCR 與 metrics.py 的指標直接使用 valid，不再逐點檢查 x > 0 且 y > 0。
+
+NUM_KEYPOINTS = 17
+CONF_THRESHOLD = 0.5  # 與 ultralytics 將低信心關鍵點座標設為 0 的門檻相同
+
+# xy: (persons, 17, 2) float32，無效關節座標為 0
+# conf: (persons, 17) float32
+# valid: (persons, 17) bool
+# track_ids: 追蹤器 ID (model.track)，沒有時為 None
+PoseFrame = namedtuple('PoseFrame', ['xy', 'conf', 'valid', 'track_ids'])
+
+
+def valid_mask(keypoints, confidences=None, conf_threshold=CONF_THRESHOLD):
+    """
+    有效關節平面。
+    keypoints: shape = (..., 17, 2)
+    confidences: shape = (..., 17)，None 時以 x > 0 且 y > 0 判斷 (舊版資料沒有信心值)
+    回傳 shape = (..., 17) 的 bool 陣列
+    """
+    if confidences is None:
+        return np.all(np.asarray(keypoints)[..., :2] > 0, axis=-1)
+    return np.asarray(confidences) >= conf_threshold
+
+
+def _keypoint_data(result):
+    """單一結果的 keypoints.data；沒有偵測到人時 ultralytics 可能回傳 (1, 0, C)，視為空的"""
+    keypoints = result.keypoints
+    if keypoints is None or keypoints.data.shape[-2] != NUM_KEYPOINTS:
+        return None
+    return keypoints.data
+
+
+def _to_numpy(tensors):
+    """將多個 (persons, 17, C) 張量串接後一次搬到 CPU"""
+    if hasattr(tensors[0], 'cpu'):
+        import torch
+
+        return torch.cat(list(tensors)).cpu().numpy()
+    return np.concatenate([np.asarray(tensor) for tensor in tensors])
+
+
+def _track_ids(result):
+    boxes = result.boxes
+    if boxes is None or boxes.id is None:
+        return None
+    return boxes.id.int().cpu().numpy()
+
+
+def _raw_buffer(results, profiler=None):
+    """
+    一批結果的原始 (x, y, conf)，尚未套用門檻。
+    回傳 (buffer, offsets)：buffer 為 (persons, 17, 3) float32，第 i 個結果為 buffer[offsets[i]:offsets[i + 1]]
+    """
+    data = [_keypoint_data(result) for result in results]
+    counts = [0 if d is None else len(d) for d in data]
+    present = [d for d in data if d is not None and len(d)]
+
+    buffer = np.zeros((sum(counts), NUM_KEYPOINTS, 3), dtype=np.float32)
+    if present:
+        with (NULL_PROFILER if profiler is None else profiler).stage('transfer'):
+            stacked = _to_numpy(present)
+        buffer[..., :stacked.shape[-1]] = stacked
+        if stacked.shape[-1] != 3:
+            # 模型沒有輸出信心值時，以座標是否為 (0, 0) 判斷並視為信心 1
+            buffer[..., 2] = valid_mask(buffer)
+    return buffer, np.concatenate([[0], np.cumsum(counts)])
+
+
+def ingest_raw(results, profiler=None):
+    """
+    讀取一批 YOLO Pose 結果但不套用信心門檻 (低信心關節保留原始座標)，供快取保存。
+    以 mask_raw 轉成與 ingest_results 相同的 PoseFrame。
+    回傳每個結果對應的 (data, track_ids)，data 為 (persons, 17, 3) 的 (x, y, conf)
+    """
+    results = list(results)
+    buffer, offsets = _raw_buffer(results, profiler)
+    return [(buffer[start:end], _track_ids(result))
+            for result, start, end in zip(results, offsets[:-1], offsets[1:])]
+
+
+def mask_raw(data, track_ids=None, conf_threshold=CONF_THRESHOLD):
+    """
+    依 conf_threshold 將原始 (x, y, conf) 轉成 PoseFrame (低於門檻的關節座標設為 0)。
+    data: shape = (persons, 17, 3)，不會被修改
+    """
+    data = np.array(data, dtype=np.float32).reshape(-1, NUM_KEYPOINTS, 3)
+    valid = data[..., 2] >= conf_threshold
+    data[~valid, :2] = 0.0
+    return PoseFrame(data[..., :2], data[..., 2], valid, track_ids)
+
+
+def ingest_results(results, conf_threshold=CONF_THRESHOLD, profiler=None):
+    """
+    讀取一批 YOLO Pose 結果 (例如 model([frame, ...]) 的回傳值)。
+    profiler: profiling.StageProfiler，將 GPU -> CPU 搬移計入 'transfer' 階段
+    回傳每個結果對應的 PoseFrame，xy / conf / valid 皆為同一個緩衝區的 view
+    """
+    results = list(results)
+    buffer, offsets = _raw_buffer(results, profiler)
+    valid = buffer[..., 2] >= conf_threshold
+    buffer[~valid, :2] = 0.0
+
+    frames = []
+    for result, start, end in zip(results, offsets[:-1], offsets[1:]):
+        frames.append(PoseFrame(buffer[start:end, :, :2], buffer[start:end, :, 2],
+                                valid[start:end], _track_ids(result)))
+    return frames
+
+
+def ingest_result(result, conf_threshold=CONF_THRESHOLD):
+    """讀取單一 YOLO Pose 結果，回傳 PoseFrame"""
+    return ingest_results([result], conf_threshold)[0]
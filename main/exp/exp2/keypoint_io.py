@@ -0,0 +1,244 @@
+import os
+import json
+import warnings
+import numpy as np
+
+# 欄位式關鍵點格式：
+# <name>.npy  float32 陣列，shape = (frames, persons, 17, 3)，最後一維為 (x, y, conf)
+#             該幀沒有該人時整列為 NaN
+# <name>.json 中繼資料 (fps、來源影片、每個 person 欄位對應的追蹤 ID 等)
+# .npy 可直接以 np.load(..., mmap_mode='r') 記憶體映射讀取，不需解析文字。
+
+NUM_KEYPOINTS = 17
+KEYPOINT_DTYPE = np.dtype('<f4')
+
+
+def metadata_path(npy_path):
+    return os.path.splitext(npy_path)[0] + '.json'
+
+
+class KeypointArrayWriter:
+    """
+    邊處理影片邊寫入 (frames, persons, 17, 3) 的 .npy 檔。
+    檔頭先以預留長度寫入，關閉時再回填實際幀數，因此不必事先知道影片長度。
+    """
+
+    def __init__(self, path, max_persons=8, metadata=None, grow=False):
+        """
+        path: 輸出 .npy 路徑
+        max_persons: 每幀最多記錄的人數 (person 欄位數)
+        metadata: 額外寫入 .json 的中繼資料 (例如 fps、影片路徑)
+        grow: person 欄位不足時加倍欄位數並改寫已寫入的幀 (不丟棄偵測)；
+              False 時超出的偵測會被丟棄，關閉時發出警告
+        """
+        self.path = path
+        self.max_persons = max_persons
+        self.grow = grow
+        self.metadata = dict(metadata or {})
+        self.track_ids = []  # person 欄位 -> 追蹤 ID
+        self.dropped_detections = 0
+        self.frames = 0
+        self._slots = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'wb')
+        # 以極大的幀數寫檔頭，實際長度回填時檔頭長度不會改變
+        self._write_header(10 ** 12)
+        self._header_size = self._file.tell()
+        self._empty = np.full((max_persons, NUM_KEYPOINTS, 3), np.nan, dtype=KEYPOINT_DTYPE)
+
+    def _write_header(self, num_frames):
+        header = {
+            'descr': np.lib.format.dtype_to_descr(KEYPOINT_DTYPE),
+            'fortran_order': False,
+            'shape': (num_frames, self.max_persons, NUM_KEYPOINTS, 3),
+        }
+        np.lib.format.write_array_header_1_0(self._file, header)
+
+    def _slot(self, track_id):
+        if track_id not in self._slots:
+            if len(self.track_ids) >= self.max_persons:
+                if not self.grow:
+                    return None
+                self._widen(self.max_persons * 2)
+            self._slots[track_id] = len(self.track_ids)
+            self.track_ids.append(track_id)
+        return self._slots[track_id]
+
+    def _widen(self, max_persons):
+        """把 person 欄位數擴充為 max_persons，已寫入的幀以 NaN 補齊新欄位後重新寫出"""
+        self._file.close()
+        rows = np.fromfile(self.path, dtype=KEYPOINT_DTYPE, offset=self._header_size)
+        rows = rows.reshape(self.frames, self.max_persons, NUM_KEYPOINTS, 3)
+        widened = np.full((self.frames, max_persons, NUM_KEYPOINTS, 3), np.nan, dtype=KEYPOINT_DTYPE)
+        widened[:, :self.max_persons] = rows
+
+        self.max_persons = max_persons
+        self._file = open(self.path, 'wb')
+        self._write_header(10 ** 12)
+        self._header_size = self._file.tell()
+        widened.tofile(self._file)
+        self._empty = np.full((max_persons, NUM_KEYPOINTS, 3), np.nan, dtype=KEYPOINT_DTYPE)
+
+    def write(self, frame_index, keypoints, confidences=None, track_ids=None):
+        """
+        寫入一幀。中間缺少的幀會自動補上 NaN。
+        keypoints: numpy array, shape = (persons, 17, 2)
+        confidences: shape = (persons, 17)，None 時以 x > 0 且 y > 0 視為 1
+        track_ids: 每個人的追蹤 ID，None 時依偵測順序 0, 1, 2, ...
+        """
+        if frame_index < self.frames:
+            raise ValueError("Frames must be written in increasing order.")
+        while self.frames < frame_index:
+            self._file.write(self._empty.tobytes())
+            self.frames += 1
+
+        keypoints = np.asarray(keypoints, dtype=KEYPOINT_DTYPE).reshape(-1, NUM_KEYPOINTS, 2)
+        if confidences is None:
+            confidences = np.all(keypoints > 0, axis=-1)
+        confidences = np.asarray(confidences, dtype=KEYPOINT_DTYPE).reshape(-1, NUM_KEYPOINTS)
+        if track_ids is None:
+            track_ids = range(len(keypoints))
+
+        # 先分配欄位 (grow 時可能擴充欄位數) 再組出此幀
+        slots = [self._slot(int(track_id)) for track_id, _ in zip(track_ids, keypoints)]
+        row = self._empty.copy()
+        for xy, conf, slot in zip(keypoints, confidences, slots):
+            if slot is None:
+                self.dropped_detections += 1
+                continue
+            row[slot, :, :2] = xy
+            row[slot, :, 2] = conf
+        self._file.write(row.tobytes())
+        self.frames += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.seek(0)
+        self._write_header(self.frames)
+        if self._file.tell() != self._header_size:
+            raise RuntimeError("Header size changed while finalizing the keypoint file.")
+        self._file.close()
+
+        metadata = dict(self.metadata)
+        metadata.update({
+            'frames': self.frames,
+            'persons': self.max_persons,
+            'keypoints': NUM_KEYPOINTS,
+            'channels': ['x', 'y', 'conf'],
+            'track_ids': self.track_ids,
+            'dropped_detections': self.dropped_detections,
+        })
+        with open(metadata_path(self.path), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        if self.dropped_detections:
+            warnings.warn(f"{self.path}: dropped {self.dropped_detections} detections beyond "
+                          f"max_persons={self.max_persons}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_keypoints(path, mmap_mode='r'):
+    """
+    讀取欄位式關鍵點檔案。
+    回傳 (keypoints, metadata)，keypoints 預設為唯讀的記憶體映射陣列 (frames, persons, 17, 3)
+    """
+    keypoints = np.load(path, mmap_mode=mmap_mode)
+    metadata = {}
+    if os.path.exists(metadata_path(path)):
+        with open(metadata_path(path)) as f:
+            metadata = json.load(f)
+    return keypoints, metadata
+
+
+def from_dataframe(data):
+    """
+    將 keypoints_data.csv 格式的 DataFrame 轉成 (frames, persons, 17, 3) 陣列。
+    回傳 (keypoints, track_ids)；舊版 CSV 沒有信心值，conf 以 x > 0 且 y > 0 視為 1
+    """
+    track_ids, person_pos = np.unique(data['Person'].to_numpy(), return_inverse=True)
+    frames = data['Frame'].to_numpy()
+    num_frames = int(frames.max()) + 1 if len(frames) else 0
+    keypoints = np.full((num_frames, len(track_ids), NUM_KEYPOINTS, 3), np.nan, dtype=KEYPOINT_DTYPE)
+    index = (frames, person_pos, data['Keypoint_Index'].to_numpy())
+    x = data['Keypoint_X'].to_numpy()
+    y = data['Keypoint_Y'].to_numpy()
+    keypoints[index + (0,)] = x
+    keypoints[index + (1,)] = y
+    keypoints[index + (2,)] = (x > 0) & (y > 0)
+    return keypoints, [int(track_id) for track_id in track_ids]
+
+
+def load_any(path, mmap_mode='r'):
+    """
+    讀取 .npy 欄位式檔案或舊版 keypoints_data.csv。
+    回傳 (keypoints, track_ids)，keypoints shape = (frames, persons, 17, 3)
+    """
+    if path.endswith('.csv'):
+        import pandas as pd
+
+        return from_dataframe(pd.read_csv(path))
+    keypoints, metadata = load_keypoints(path, mmap_mode=mmap_mode)
+    track_ids = metadata.get('track_ids') or []
+    track_ids = list(track_ids) + list(range(len(track_ids), keypoints.shape[1]))
+    return keypoints, track_ids
+
+
+def keypoint_rows(keypoints, track_ids=None):
+    """
+    將 (frames, persons, 17, 3) 陣列展開成 keypoints_data.csv 的欄位。
+    回傳 dict: Frame, Person, Keypoint_Index, Keypoint_X, Keypoint_Y (各為 1D 陣列)
+    """
+    num_frames, num_persons = keypoints.shape[:2]
+    present = ~np.all(np.isnan(keypoints[..., 0]), axis=-1)  # (frames, persons)
+    frame_idx, person_idx = np.nonzero(present)
+    if track_ids is None or len(track_ids) == 0:
+        track_ids = np.arange(num_persons)
+    track_ids = np.asarray(list(track_ids) + [-1] * (num_persons - len(track_ids)))
+
+    xy = keypoints[frame_idx, person_idx, :, :2]  # (rows, 17, 2)
+    return {
+        'Frame': np.repeat(frame_idx, NUM_KEYPOINTS),
+        'Person': np.repeat(track_ids[person_idx], NUM_KEYPOINTS),
+        'Keypoint_Index': np.tile(np.arange(NUM_KEYPOINTS), len(frame_idx)),
+        'Keypoint_X': xy[..., 0].ravel(),
+        'Keypoint_Y': xy[..., 1].ravel(),
+    }
+
+
+def to_dataframe(path):
+    """讀取欄位式關鍵點檔案並轉成與 keypoints_data.csv 相同欄位的 DataFrame"""
+    import pandas as pd
+
+    keypoints, metadata = load_keypoints(path)
+    return pd.DataFrame(keypoint_rows(keypoints, metadata.get('track_ids')))
+
+
+def to_csv(path, csv_path=None):
+    """將欄位式關鍵點檔案轉成 keypoints_data.csv 格式"""
+    if csv_path is None:
+        csv_path = os.path.splitext(path)[0] + '.csv'
+    to_dataframe(path).to_csv(csv_path, index=False)
+    return csv_path
+
+
+def to_parquet(path, parquet_path=None):
+    """將欄位式關鍵點檔案轉成 Parquet (需要安裝 pyarrow 或 fastparquet)"""
+    if parquet_path is None:
+        parquet_path = os.path.splitext(path)[0] + '.parquet'
+    to_dataframe(path).to_parquet(parquet_path, index=False)
+    return parquet_path
+
+
+if __name__ == "__main__":
+    import sys
+
+    # 用法: python keypoint_io.py keypoints_data.npy [keypoints_data.csv]
+    print(f"CSV saved: {to_csv(*sys.argv[1:3])}")
@@ -0,0 +1,158 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # numba 為選用套件，未安裝時使用 NumPy 版本
+    njit = None
+
+# 共用的有限差分核心：
+# 一次算出速度、加速度與 jerk (一到三階差分除以 dt)，所有關節、座標軸與幀一起處理，
+# 結果寫入預先配置的緩衝區。平滑度、JAD 與 exp1 的運動平滑性都使用這裡的結果，
+# 逐幀呼叫時不再為每一階 np.diff 配置新陣列。
+# 數值與 np.diff(x) / dt 連續三次完全相同。
+
+NUMBA_AVAILABLE = njit is not None
+
+
+def _differences_numpy(x, dt, outputs):
+    previous = x
+    for out in outputs:
+        np.subtract(previous[1:], previous[:-1], out=out)
+        np.divide(out, dt, out=out)
+        previous = out
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _differences_numba(x, dt, velocity, acceleration, jerk):
+        # 每個通道只走訪一次時間軸，以四個暫存值同時算出三階差分
+        frames, channels = x.shape
+        for c in range(channels):
+            v_prev = 0.0
+            a_prev = 0.0
+            for i in range(1, frames):
+                v = (x[i, c] - x[i - 1, c]) / dt
+                velocity[i - 1, c] = v
+                if i >= 2:
+                    a = (v - v_prev) / dt
+                    acceleration[i - 2, c] = a
+                    if i >= 3:
+                        jerk[i - 3, c] = (a - a_prev) / dt
+                    a_prev = a
+                v_prev = v
+
+
+def _as_2d(x):
+    # 只用於 C-contiguous 陣列：其他陣列的 reshape 會回傳副本，寫入後不會反映到原陣列
+    return x.reshape(len(x), -1) if x.ndim != 2 else x
+
+
+def finite_differences(x, dt=1.0, order=3, out=None, use_numba=None):
+    """
+    沿第 0 軸 (時間) 計算一到 order 階差分。
+    x: shape = (frames, ...)，例如 (frames, 17, 2) 的關鍵點或 (frames, joints) 的角度
+    dt: 幀間隔 (秒)，exp1 的運動平滑性使用 1 (不除時間)
+    order: 最高階數 (1 = 速度, 2 = 加速度, 3 = jerk)
+    out: 預先配置的輸出列表，第 k 個 shape 為 (frames - k - 1, ...)，None 時新配置；
+         不連續的陣列 (例如切片的 view) 也可以，numba 版本會先寫入暫存區再複製回去
+    use_numba: None 時有安裝 numba 就使用；numba 版本只支援 order = 3
+    回傳 [velocity, acceleration, jerk][:order]
+    """
+    x = np.asarray(x, dtype=np.float64)
+    frames = len(x)
+    if out is None:
+        out = [np.empty((max(frames - k, 0),) + x.shape[1:]) for k in range(1, order + 1)]
+    if use_numba is None:
+        use_numba = NUMBA_AVAILABLE
+    if frames < 2:
+        return out
+    if use_numba and NUMBA_AVAILABLE and order == 3 and frames >= 4:
+        targets = [o if o.flags.c_contiguous else np.empty(o.shape) for o in out]
+        _differences_numba(_as_2d(np.ascontiguousarray(x)), float(dt), *[_as_2d(t) for t in targets])
+        for o, target in zip(out, targets):
+            if target is not o:
+                o[...] = target
+    else:
+        _differences_numpy(x, dt, out[:min(order, frames - 1)])
+    return out
+
+
+class Kinematics:
+    """
+    有限差分的工作區。
+    緩衝區依最長的輸入配置一次，之後同樣或更短的輸入直接寫入既有緩衝區，
+    回傳的是緩衝區的 view，下一次 compute() 會覆蓋，需要保留時請自行複製。
+    """
+
+    def __init__(self, dt=1.0, order=3, use_numba=None):
+        """
+        dt: 幀間隔 (秒)
+        order: 最高階數
+        use_numba: 見 finite_differences
+        """
+        self.dt = dt
+        self.order = order
+        self.use_numba = use_numba
+        self._buffers = None
+
+    def _ensure(self, shape):
+        frames, trailing = shape[0], shape[1:]
+        if (self._buffers is None or self._buffers[0].shape[1:] != trailing
+                or len(self._buffers[0]) < frames - 1):
+            self._buffers = [np.empty((max(frames - k, 0),) + trailing) for k in range(1, self.order + 1)]
+
+    def compute(self, x):
+        """
+        計算 x (frames, ...) 的一到 order 階差分。
+        回傳 [velocity, acceleration, jerk][:order]，各為工作區的 view
+        """
+        x = np.asarray(x, dtype=np.float64)
+        self._ensure(x.shape)
+        frames = len(x)
+        out = [buffer[:max(frames - k, 0)] for k, buffer in enumerate(self._buffers, start=1)]
+        return finite_differences(x, self.dt, self.order, out, self.use_numba)
+
+    def jerk(self, x):
+        """x 的三階差分 (工作區的 view)"""
+        return self.compute(x)[2]
+
+
+if __name__ == "__main__":
+    # NumPy 與 numba 版本都與連續三次 np.diff 相同
+    rng = np.random.default_rng(0)
+    keypoints = np.cumsum(rng.normal(size=(120, 17, 2)), axis=0)
+    dt = 1 / 30
+    expected = [np.diff(keypoints, n=k, axis=0) / dt ** k for k in (1, 2, 3)]
+    chained = [np.diff(keypoints, axis=0) / dt]
+    for _ in range(2):
+        chained.append(np.diff(chained[-1], axis=0) / dt)
+
+    workspace = Kinematics(dt, use_numba=False)
+    for result in (finite_differences(keypoints, dt, use_numba=False), workspace.compute(keypoints),
+                   workspace.compute(keypoints[:40])):
+        for got, want in zip(result, chained):
+            assert np.array_equal(got, want[:len(got)])
+    # 不連續的 out (切片的 view) 也必須寫入呼叫端的陣列
+    backing = [np.zeros((len(keypoints) - k, 17, 4)) for k in (1, 2, 3)]
+    strided = [array[..., ::2] for array in backing]
+    for use_numba in (False, True) if NUMBA_AVAILABLE else (False,):
+        for array in backing:
+            array.fill(0.0)
+        result = finite_differences(keypoints, dt, out=strided, use_numba=use_numba)
+        for got, view, want in zip(result, strided, chained):
+            assert got is view and np.array_equal(view, want)
+
+    if NUMBA_AVAILABLE:
+        # numba 版本與 NumPy 版本 (未安裝 numba 時的路徑) 結果相同
+        numba_workspace = Kinematics(dt, use_numba=True)
+        for x in (keypoints, keypoints[:40], keypoints[::2], keypoints[:, :, 0]):
+            for fast, fallback in ((finite_differences(x, dt, use_numba=True),
+                                    finite_differences(x, dt, use_numba=False)),
+                                   (numba_workspace.compute(x), workspace.compute(x))):
+                for got, want in zip(fast, fallback):
+                    assert np.array_equal(got, want)
+        for got, want in zip(finite_differences(keypoints, dt, use_numba=True), chained):
+            assert np.array_equal(got, want)
+    for got, want in zip(finite_differences(keypoints, dt), expected):
+        assert np.allclose(got, want)
+    print(f"kinematics ok (numba: {NUMBA_AVAILABLE})")
@@ -0,0 +1,170 @@
+import json
+import threading
+import time
+import numpy as np
+import cv2
+from ingest import CONF_THRESHOLD, ingest_results
+from profiling import NULL_PROFILER
+
+# 即時攝影機模式：
+# 擷取執行緒不斷把最新的一幀放進單格的 LatestFrameSlot，推論來不及時舊的幀直接被覆蓋 (丟棄)，
+# 推論端永遠只處理最新的一幀；等待期間已超過延遲預算的幀也不再處理。
+# 以影片檔代替攝影機時依影片幀率播放，行為與實際攝影機相同，可重現測試。
+
+
+class LatestFrameSlot:
+    """
+    擷取與推論之間只保留最新一幀的交換區。
+    put() 永遠不會阻塞：尚未被取走的舊幀直接覆蓋並計入 dropped。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if self._item is not None:
+                self.dropped += 1
+            self._item = item
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        """取出最新的一幀；來源結束且沒有剩餘的幀時回傳 None"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._item is not None or self._closed, timeout):
+                return None
+            item, self._item = self._item, None
+            return item
+
+
+class LatencyStats:
+    """擷取到指標算完的端到端延遲統計"""
+
+    def __init__(self, latency_budget=None):
+        self.latency_budget = latency_budget
+        self.latencies = []
+        self.inference_times = []
+        self.stale = 0  # 取出時已超過延遲預算而略過的幀
+        self.dropped = 0  # 在交換區中被較新的幀覆蓋的幀
+        self.captured = 0
+
+    def summary(self):
+        """回傳 dict：處理/丟棄幀數與延遲百分位數 (毫秒)"""
+        latencies = np.asarray(self.latencies) * 1000
+        summary = {
+            'captured': self.captured,
+            'processed': len(latencies),
+            'dropped': self.dropped,
+            'stale': self.stale,
+            'latency_budget_ms': None if self.latency_budget is None else self.latency_budget * 1000,
+        }
+        if len(latencies):
+            for q in (50, 90, 95, 99):
+                summary[f'latency_p{q}_ms'] = float(np.percentile(latencies, q))
+            summary['latency_max_ms'] = float(latencies.max())
+            summary['inference_mean_ms'] = float(np.mean(self.inference_times) * 1000)
+            if self.latency_budget is not None:
+                summary['over_budget'] = int(np.sum(latencies > self.latency_budget * 1000))
+        return summary
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def _capture(cap, slot, stats, realtime, fps, stop):
+    """擷取執行緒：讀取影格並放入交換區；realtime 時依 fps 控制節奏 (影片檔代替攝影機)"""
+    start = time.perf_counter()
+    frame_index = 0
+    try:
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if realtime:
+                delay = start + frame_index / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slot.put((frame_index, frame, time.perf_counter()))
+            stats.captured += 1
+            frame_index += 1
+    finally:
+        cap.release()
+        slot.close()
+
+
+def live_poses(source, model, stats=None, latency_budget=0.2, params=None, realtime=None,
+               conf_threshold=CONF_THRESHOLD, profiler=None):
+    """
+    即時姿態來源，介面與 pose_cache.video_poses 相同：產生 (frame_index, frame, PoseFrame)。
+    source: 攝影機編號 (例如 0) 或影片路徑
+    model: YOLO Pose 模型
+    stats: LatencyStats，記錄端到端延遲；下一次取幀時才記錄上一幀，因此包含呼叫端計算指標與顯示的時間
+    latency_budget: 延遲預算 (秒)，取出時已超過預算的幀直接略過；None 為不限
+    params: 推論參數，傳給 model(frame, **params)
+    realtime: 是否依影片幀率擷取，None 時影片檔為 True、攝影機為 False
+    profiler: profiling.StageProfiler，分別計時 'inference' 與 'transfer' 階段 (擷取在背景執行緒，不計時)
+    frame_index 為擷取的序號，略過的幀不會出現
+    """
+    profiler = NULL_PROFILER if profiler is None else profiler
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    if realtime is None:
+        realtime = not isinstance(source, int)
+    stats = LatencyStats(latency_budget) if stats is None else stats
+    params = dict(params or {})
+
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video source {source!r}.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    slot = LatestFrameSlot()
+    stop = threading.Event()
+    capture = threading.Thread(target=_capture, args=(cap, slot, stats, realtime, fps, stop), daemon=True)
+    capture.start()
+
+    try:
+        while True:
+            item = slot.get()
+            if item is None:
+                break
+            frame_index, frame, captured_at = item
+            if latency_budget is not None and time.perf_counter() - captured_at > latency_budget:
+                stats.stale += 1
+                continue
+            start = time.perf_counter()
+            with profiler.stage('inference'):
+                results = model(frame, **params)
+            pose = ingest_results(results, conf_threshold, profiler)[0]
+            stats.inference_times.append(time.perf_counter() - start)
+            yield frame_index, frame, pose
+            # 呼叫端已處理完此幀 (指標、顯示)
+            stats.latencies.append(time.perf_counter() - captured_at)
+    finally:
+        stop.set()
+        capture.join()
+        stats.dropped = slot.dropped
+
+
+if __name__ == "__main__":
+    import sys
+    from ultralytics import YOLO
+
+    # 用法: python live.py [攝影機編號或影片路徑] [weights.pt] [latency_budget 秒]
+    # 影片檔依原始幀率播放模擬攝影機，結束後輸出延遲百分位數
+    source = sys.argv[1] if len(sys.argv) > 1 else '0'
+    model = YOLO(sys.argv[2] if len(sys.argv) > 2 else '../exp1/yolo11x-pose.pt')
+    budget = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    stats = LatencyStats(budget)
+    for _ in live_poses(source, model, stats, budget, params={'verbose': False}):
+        pass
+    print(json.dumps(stats.summary(), indent=2))
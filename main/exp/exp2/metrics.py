@@ -1,20 +1,39 @@
 import numpy as np
 from scipy.interpolate import UnivariateSpline
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from scipy.signal import welch
 from scipy.stats import pearsonr
 from sklearn.decomposition import PCA
 from scipy.spatial.distance import euclidean
 from dtaidistance import dtw
+from kinematics import Kinematics
+from smoothing import residual_operator, smoothing_residuals
 
-def compute_trajectory_smoothness(keypoints, joint_idx=10, fps=30):
+# 各 fps 共用一個差分工作區，與 exp1 的 motion_smoothness 相同
+_KINEMATICS = {}
+
+
+def _trajectory_kinematics(dt):
+    if dt not in _KINEMATICS:
+        _KINEMATICS[dt] = Kinematics(dt)
+    return _KINEMATICS[dt]
+
+def compute_trajectory_smoothness(keypoints, joint_idx=10, fps=30, valid=None, lam=None):
     """
     計算某個關節的軌跡平滑度指標。
     keypoints: numpy array, shape = (num_frames, 17, 2)
                每幀有17個keypoints的(x, y)座標。
     joint_idx: 欲分析的關節索引(0~16)
     fps: 影片幀率 (frames per second)
+    valid: 有效關節平面，shape = (num_frames, 17)，只使用該關節有效的幀 (見 ingest.py)
+    lam: 設定時改用固定 λ 的平滑樣條 (預先計算的線性運算子，見 smoothing.py) 取代 UnivariateSpline，
+         整段錄影所有視窗與關節可用 smoothing.sliding_smoothness 一次算出
+    掉點的關節會造成 jerk 尖峰，可先以 preprocess.preprocess_keypoints 補齊缺漏再計算。
     """
+    if valid is not None:
+        keypoints = np.asarray(keypoints)[np.asarray(valid)[:, joint_idx]]
+
     # 從keypoints中取出特定關節的x,y序列
     x = keypoints[:, joint_idx, 0]
     y = keypoints[:, joint_idx, 1]
@@ -23,23 +42,14 @@ def compute_trajectory_smoothness(keypoints, joint_idx=10, fps=30):
     num_frames = len(x)
     t = np.arange(num_frames) / fps  # t是秒為單位
 
-    # 計算速度
-    # 使用一階差分 approximates v(t_i) = [p(t_{i+1}) - p(t_i)] / Δt
+    # 速度、加速度與 jerk 一次算出 (見 kinematics.py)
+    # 使用一階差分 approximates v(t_i) = [p(t_{i+1}) - p(t_i)] / Δt，再依序差分兩次
     dt = 1.0 / fps
-    vx = np.diff(x) / dt
-    vy = np.diff(y) / dt
-
-    # 計算加速度
-    ax = np.diff(vx) / dt
-    ay = np.diff(vy) / dt
-
-    # 計算 jerk
-    jx = np.diff(ax) / dt
-    jy = np.diff(ay) / dt
+    jerk = _trajectory_kinematics(dt).jerk(keypoints[:, joint_idx, :2])
 
     # 計算 jerk 的平方平均 (MSJ)
     # jerk向量的大小平方： j² = jx² + jy²
-    j_mag_sq = jx**2 + jy**2
+    j_mag_sq = np.einsum('ij,ij->i', jerk, jerk)
     MSJ = np.mean(j_mag_sq) if len(j_mag_sq) > 0 else 0.0
 
     # 計算軌跡的平滑擬合來評估變異量 Var
@@ -47,15 +57,19 @@ def compute_trajectory_smoothness(keypoints, joint_idx=10, fps=30):
     # 試用程度 (s平滑參數) 可依情況調整，這裡先預設為較小值
     s_factor = 1e-3
 
-    spline_x = UnivariateSpline(t, x, s=s_factor)
-    spline_y = UnivariateSpline(t, y, s=s_factor)
+    if lam is None:
+        spline_x = UnivariateSpline(t, x, s=s_factor)
+        spline_y = UnivariateSpline(t, y, s=s_factor)
 
-    x_hat = spline_x(t)
-    y_hat = spline_y(t)
+        x_hat = spline_x(t)
+        y_hat = spline_y(t)
 
-    # 計算原軌跡與擬合軌跡的誤差向量
-    ex = x - x_hat
-    ey = y - y_hat
+        # 計算原軌跡與擬合軌跡的誤差向量
+        ex = x - x_hat
+        ey = y - y_hat
+    else:
+        # 固定 λ 時擬合是線性的，誤差向量即殘差運算子乘上軌跡
+        ex, ey = smoothing_residuals(keypoints[:, joint_idx, :2], fps, lam).T
     e_dist = np.sqrt(ex**2 + ey**2)
 
     # 計算誤差的變異量 Var
@@ -72,6 +86,104 @@ def compute_trajectory_smoothness(keypoints, joint_idx=10, fps=30):
         "Smoothness": Smoothness
     }
 
+class StreamingTrajectorySmoothness:
+    """
+    串流版的軌跡平滑度指標，每次只推入一幀新的關鍵點。
+    結果與對最近 window_size 幀呼叫 compute_trajectory_smoothness 相同，
+    但 jerk 平方和以環形緩衝區增量維護，不必每幀重做三次 np.diff。
+    """
+
+    def __init__(self, window_size=30, joint_idx=10, fps=30, s_factor=1e-3, lam=None):
+        """
+        window_size: 視窗大小(幀數)，至少 4 幀
+        joint_idx: 欲分析的關節索引(0~16)
+        fps: 影片幀率 (frames per second)
+        s_factor: 樣條擬合的平滑參數，與 compute_trajectory_smoothness 相同
+        lam: 設定時改用預先計算的線性平滑運算子 (見 smoothing.py)，每幀只需一次矩陣乘法
+        """
+        if window_size < 4:
+            raise ValueError("window_size must be at least 4 frames.")
+        self.window_size = window_size
+        self.joint_idx = joint_idx
+        self.fps = fps
+        self.dt = 1.0 / fps
+        self.s_factor = s_factor
+        self.lam = lam
+
+        # 位置環形緩衝區寫兩份 (i 與 i + window_size)，視窗永遠是連續切片，不需複製
+        self._xy = np.zeros((2 * window_size, 2))
+        # jerk 平方的環形緩衝區，視窗內最多 window_size - 3 個 jerk
+        self._jerk_sq = np.zeros(window_size - 3)
+        self._jerk_sum = 0.0
+        self._t = np.arange(window_size) / fps
+        self._kinematics = Kinematics(self.dt)
+        self.count = 0
+
+    def reset(self):
+        self._xy[:] = 0.0
+        self._jerk_sq[:] = 0.0
+        self._jerk_sum = 0.0
+        self.count = 0
+
+    def window(self):
+        """回傳目前視窗內的 (x, y) 軌跡，shape = (n, 2)，為緩衝區的 view"""
+        n = min(self.count, self.window_size)
+        end = self.count % self.window_size + self.window_size
+        return self._xy[end - n:end]
+
+    def update(self, frame_keypoints, valid=None):
+        """
+        推入一幀關鍵點並回傳最新的指標。
+        frame_keypoints: numpy array, shape = (17, 2)
+        valid: 有效關節，shape = (17,)；關節無效的幀直接略過，與 compute_trajectory_smoothness 相同
+        回傳 dict(MSJ, Var, Smoothness)，累積不足 4 幀或略過此幀時回傳 None
+        """
+        if valid is not None and not valid[self.joint_idx]:
+            return None
+        w = self.window_size
+        pos = self.count % w
+        self._xy[pos] = frame_keypoints[self.joint_idx, :2]
+        self._xy[pos + w] = self._xy[pos]
+        self.count += 1
+
+        if self.count < 4:
+            return None
+
+        # 以最近四個位置的三階差分得到最新的 jerk (寫入預先配置的工作區)
+        jerk = self._kinematics.jerk(self.window()[-4:])[0]
+        jerk_sq = jerk[0] ** 2 + jerk[1] ** 2
+
+        n_jerk = len(self._jerk_sq)
+        slot = (self.count - 4) % n_jerk
+        self._jerk_sum += jerk_sq - self._jerk_sq[slot]
+        self._jerk_sq[slot] = jerk_sq
+        # 每繞一圈重新加總一次，避免大數值相減累積浮點誤差
+        if slot == n_jerk - 1:
+            self._jerk_sum = np.sum(self._jerk_sq)
+
+        num_jerk = min(self.count - 3, n_jerk)
+        MSJ = self._jerk_sum / num_jerk
+
+        # 樣條擬合的殘差取決於整個視窗，直接在緩衝區的連續 view 上擬合
+        xy = self.window()
+        if self.lam is None:
+            t = self._t[:len(xy)]
+            x_hat = UnivariateSpline(t, xy[:, 0], s=self.s_factor)(t)
+            y_hat = UnivariateSpline(t, xy[:, 1], s=self.s_factor)(t)
+            e_dist = np.hypot(xy[:, 0] - x_hat, xy[:, 1] - y_hat)
+        else:
+            residuals = residual_operator(len(xy), self.fps, self.lam) @ xy
+            e_dist = np.hypot(residuals[:, 0], residuals[:, 1])
+        Var = np.var(e_dist)
+
+        Smoothness = 1.0 / (1.0 + MSJ * Var)
+
+        return {
+            "MSJ": MSJ,
+            "Var": Var,
+            "Smoothness": Smoothness
+        }
+
 # 範例使用：假設 keypoints 是已載入的 (num_frames, 17, 2) numpy 陣列
 # 這裡只示意，實際上keypoints需先定義或讀取
 #
@@ -81,18 +193,85 @@ def compute_trajectory_smoothness(keypoints, joint_idx=10, fps=30):
 # print("Var:", result["Var"])
 # print("Smoothness:", result["Smoothness"])
 
+# 關節角度三元組表 (前一關節, 頂點關節, 後一關節)，可依需求替換或擴充
+JOINT_TRIPLES = {
+    "hip": (11, 12, 13),
+    "knee": (12, 13, 14),
+    "ankle": (13, 14, 15),
+}
+
+def batch_joint_angles(keypoints, triples, fill_value=0.0, valid=None):
+    """
+    Compute every joint angle of every frame in one vectorized pass.
+
+    Parameters:
+    keypoints (np.array): Keypoints with shape (frames, 17, 2).
+    triples (array-like): Joint triples (prev, curr, next) with shape (triples, 3).
+    fill_value (float): Angle returned when a limb vector has zero length or a joint is invalid.
+    valid (np.array): Optional joint validity plane with shape (frames, 17), see ingest.py.
+
+    Returns:
+    np.array: Joint angles in radians with shape (triples, frames).
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    triples = np.asarray(triples, dtype=np.intp).reshape(-1, 3)
+
+    # (frames, triples, 2)
+    vec1 = keypoints[:, triples[:, 0]] - keypoints[:, triples[:, 1]]
+    vec2 = keypoints[:, triples[:, 2]] - keypoints[:, triples[:, 1]]
+
+    dot = np.einsum('ftc,ftc->ft', vec1, vec2)
+    denom = np.sqrt(np.einsum('ftc,ftc->ft', vec1, vec1) *
+                    np.einsum('ftc,ftc->ft', vec2, vec2))
+
+    # 零長度肢段沒有定義角度，直接填入 fill_value 以避免 NaN 與警告
+    defined = denom > 0
+    if valid is not None:
+        valid = np.asarray(valid, dtype=bool)
+        defined &= valid[:, triples[:, 0]] & valid[:, triples[:, 1]] & valid[:, triples[:, 2]]
+    cos_theta = np.divide(dot, denom, out=np.ones_like(dot), where=defined)
+    angles = np.arccos(np.clip(cos_theta, -1.0, 1.0))
+    angles[~defined] = fill_value
+
+    return angles.T
+
+
+def _hold_angles(angles):
+    """
+    Replace undefined (NaN) angles with the last defined angle of the same joint.
+
+    Parameters:
+    angles (np.array): Joint angles with shape (triples, frames).
+
+    Returns:
+    np.array: Held angles; frames before a joint's first defined angle stay NaN.
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    defined = ~np.isnan(angles)
+    if defined.all():
+        return angles
+    last = np.where(defined, np.arange(angles.shape[1]), 0)
+    np.maximum.accumulate(last, axis=1, out=last)
+    return np.take_along_axis(angles, last, axis=1)
+
+
 class JointAngleDynamics:
-    def __init__(self, keypoints, fps):
+    def __init__(self, keypoints, fps, joint_triples=None, valid=None):
         """
         Initialize the class with keypoints in YOLO format and FPS.
 
         Parameters:
         keypoints (list): List of 17 keypoints (x, y) for each frame.
         fps (float): Frames per second of the data.
+        joint_triples (dict): Joint name to (prev, curr, next) indices, defaults to JOINT_TRIPLES.
+        valid (np.array): Optional joint validity plane with shape (frames, 17), see ingest.py.
         """
         self.keypoints = keypoints
+        self.valid = valid
         self.fps = fps
         self.dt = 1 / fps
+        self.joint_triples = dict(JOINT_TRIPLES if joint_triples is None else joint_triples)
+        self._kinematics = Kinematics(self.dt)
 
     def calculate_angle(self, joint_prev, joint_curr, joint_next):
         """
@@ -118,22 +297,22 @@ class JointAngleDynamics:
         Returns:
         dict: Dictionary of joint angles over time for each joint pair.
         """
-        joint_pairs = {
-            "hip": (11, 12, 13),
-            "knee": (12, 13, 14),
-            "ankle": (13, 14, 15),
-        }
-        joint_angles = {joint: [] for joint in joint_pairs}
+        angles = self.calculate_joint_angle_matrix()
+        return {joint: angles[i] for i, joint in enumerate(self.joint_triples)}
 
-        for frame in self.keypoints:
-            for joint, (p1, p2, p3) in joint_pairs.items():
-                joint_prev = frame[p1]
-                joint_curr = frame[p2]
-                joint_next = frame[p3]
-                angle = self.calculate_angle(joint_prev, joint_curr, joint_next)
-                joint_angles[joint].append(angle)
+    def calculate_joint_angle_matrix(self):
+        """
+        Calculate joint angles for every frame and joint triple at once.
 
-        return joint_angles
+        An invalid joint or zero-length limb holds the joint's previous angle instead of
+        reading as 0 (which would show up as a jerk spike and distort the covariance).
+
+        Returns:
+        np.array: Joint angles with shape (triples, frames), ordered as self.joint_triples.
+            Frames before a joint's first defined angle are NaN.
+        """
+        return _hold_angles(batch_joint_angles(self.keypoints, list(self.joint_triples.values()),
+                                               fill_value=np.nan, valid=self.valid))
 
     def calculate_dynamics(self, angles):
         """
@@ -143,11 +322,10 @@ class JointAngleDynamics:
         angles (list): Time series of joint angles.
 
         Returns:
-        tuple: Angular velocity, acceleration, and jerk.
+        tuple: Angular velocity, acceleration, and jerk. These are views of the instance's
+            finite-difference workspace; the next call overwrites them, so copy to keep them.
         """
-        angular_velocity = np.diff(angles) / self.dt
-        angular_acceleration = np.diff(angular_velocity) / self.dt
-        angular_jerk = np.diff(angular_acceleration) / self.dt
+        angular_velocity, angular_acceleration, angular_jerk = self._kinematics.compute(angles)
 
         return angular_velocity, angular_acceleration, angular_jerk
 
@@ -198,6 +376,8 @@ class JointAngleDynamics:
     def compute_adaptability(self, series1, series2):
         """
         Compute adaptability using Dynamic Time Warping (DTW).
+        For many queries against a template bank use adaptability.adaptability_matrix
+        or adaptability.nearest_templates instead.
         
         Parameters:
         series1, series2 (list or np.array): Two time series to compare.
@@ -215,27 +395,287 @@ class JointAngleDynamics:
         Returns:
         dict: JAD index and supporting metrics.
         """
-        joint_angles = self.calculate_joint_angles()
+        angle_matrix = self.calculate_joint_angle_matrix()
+        # Frames before every joint has a defined angle are skipped, as in the streaming version
+        angle_matrix = angle_matrix[:, ~np.isnan(angle_matrix).any(axis=0)]
+        joint_angles = {joint: angle_matrix[i] for i, joint in enumerate(self.joint_triples)}
+        # All joints' derivatives in one pass, shape (frames - 3, triples)
+        jerk = self._kinematics.jerk(angle_matrix.T)
         results = {}
-        for joint, angles in joint_angles.items():
-            vel, acc, jerk = self.calculate_dynamics(angles)
+        for i, (joint, angles) in enumerate(joint_angles.items()):
             variability = self.compute_variability(angles)
             high_freq_energy_ratio = self.compute_frequency_features(angles)
             results[joint] = {
                 "variability": variability,
-                "mean_squared_jerk": np.mean(jerk ** 2),
+                "mean_squared_jerk": np.mean(jerk[:, i] ** 2),
                 "high_freq_energy_ratio": high_freq_energy_ratio,
             }
 
-        coordination_index = self.compute_pca_coordination(
-            np.array(list(joint_angles.values()))
-        )
+        coordination_index = self.compute_pca_coordination(angle_matrix)
 
         return {
             "joint_metrics": results,
             "coordination_index": coordination_index,
         }
 
+    def rolling_features(self, window_size=30, chunk_windows=4096):
+        """
+        Offline JAD over a whole recording: aggregate_features() of every sliding window in one call.
+
+        Windows are strided views of the angle matrix. The Welch spectra of all windows and
+        joints are one batched welch() call, and the coordination index comes from eigvalsh()
+        on the stacked (triples x triples) covariance matrices instead of a PCA fit per window.
+
+        Parameters:
+        window_size (int): Number of frames in each window, at least 4.
+        chunk_windows (int): Windows processed per batch, bounds the temporary memory.
+
+        Returns:
+        dict: Same layout as aggregate_features() with per-frame arrays of shape (frames,).
+            Frame f holds the window ending at f; the first window_size - 1 frames are NaN,
+            as are windows that start before every joint has a defined angle.
+        """
+        if window_size < 4:
+            raise ValueError("window_size must be at least 4 frames.")
+        angle_matrix = self.calculate_joint_angle_matrix()
+        # Leading frames without every angle are skipped; the remaining ones are contiguous
+        defined = ~np.isnan(angle_matrix).any(axis=0)
+        skipped = int(np.argmax(defined)) if defined.any() else angle_matrix.shape[1]
+        num_joints, num_frames = angle_matrix.shape
+        angle_matrix = angle_matrix[:, skipped:]
+        variability = np.full((num_joints, num_frames), np.nan)
+        mean_squared_jerk = np.full((num_joints, num_frames), np.nan)
+        high_freq_energy_ratio = np.full((num_joints, num_frames), np.nan)
+        coordination_index = np.full(num_frames, np.nan)
+
+        if angle_matrix.shape[1] >= window_size:
+            # Jerk of the whole recording once; each window averages its window_size - 3 values
+            jerk = self._kinematics.jerk(angle_matrix.T)
+            jerk_windows = sliding_window_view(jerk.T ** 2, window_size - 3, axis=1)
+            windows = sliding_window_view(angle_matrix, window_size, axis=1)  # (triples, windows, n)
+            nperseg = min(window_size, 256)  # welch() default, without the short-signal warning
+
+            for begin in range(0, windows.shape[1], chunk_windows):
+                end = min(begin + chunk_windows, windows.shape[1])
+                frames = slice(skipped + begin + window_size - 1, skipped + end + window_size - 1)
+                chunk = windows[:, begin:end]
+                variability[:, frames] = np.std(chunk, axis=-1)
+                mean_squared_jerk[:, frames] = np.mean(jerk_windows[:, begin:end], axis=-1)
+
+                f, Pxx = welch(chunk, fs=self.fps, nperseg=nperseg, axis=-1)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    high_freq_energy_ratio[:, frames] = (
+                        np.sum(Pxx[..., f > 0.5 * np.max(f)], axis=-1) / np.sum(Pxx, axis=-1))
+
+                # Stacked covariance matrices, shape (windows, triples, triples)
+                centered = chunk - chunk.mean(axis=-1, keepdims=True)
+                cov = np.einsum('iwn,jwn->wij', centered, centered) / (window_size - 1)
+                eigenvalues = np.clip(np.linalg.eigvalsh(cov)[:, ::-1], 0.0, None)
+                total_var = eigenvalues.sum(axis=1)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    explained_variance = np.cumsum(eigenvalues / total_var[:, None], axis=1)
+                num_components = np.sum(explained_variance < 0.9, axis=1) + 1
+                coordination_index[frames] = np.where(total_var > 0, 1 / num_components, 1.0)
+
+        results = {}
+        for i, joint in enumerate(self.joint_triples):
+            results[joint] = {
+                "variability": variability[i],
+                "mean_squared_jerk": mean_squared_jerk[i],
+                "high_freq_energy_ratio": high_freq_energy_ratio[i],
+            }
+
+        return {
+            "joint_metrics": results,
+            "coordination_index": coordination_index,
+        }
+
+class StreamingJointAngleDynamics:
+    """
+    Incremental Joint Angle Dynamics over a sliding window.
+
+    Each update pushes one frame of keypoints. Rolling angle buffers keep the
+    variability and jerk sums current, the covariance matrix behind the
+    coordination index is updated by rank-one add/remove steps instead of a PCA
+    refit, and a sliding DFT keeps the spectrum used by the high-frequency energy
+    ratio. The results match aggregate_features() on the same window.
+
+    An invalid joint holds its previous angle; frames before every joint has had a
+    defined angle are skipped, so no placeholder value enters the sums.
+    """
+
+    def __init__(self, fps, window_size=30, joint_triples=None):
+        """
+        Parameters:
+        fps (float): Frames per second of the data.
+        window_size (int): Number of frames in the analysis window.
+        joint_triples (dict): Joint name to (prev, curr, next) indices, defaults to JOINT_TRIPLES.
+        """
+        if window_size < 4:
+            raise ValueError("window_size must be at least 4 frames.")
+        self.fps = fps
+        self.dt = 1 / fps
+        self.window_size = window_size
+        self.joint_triples = dict(JOINT_TRIPLES if joint_triples is None else joint_triples)
+        self._triples = np.array(list(self.joint_triples.values()), dtype=np.intp)
+
+        num_joints = len(self._triples)
+        # Angles are written twice (i and i + window_size) so the window is always a contiguous view
+        self._angles = np.zeros((num_joints, 2 * window_size))
+        self._jerk_sq = np.zeros((num_joints, window_size - 3))
+        self._jerk_sum = np.zeros(num_joints)
+        self._sum = np.zeros(num_joints)
+        self._outer = np.zeros((num_joints, num_joints))
+
+        # scipy's welch() uses a single Hann segment when the series is at most 256 samples long
+        self._sliding_dft = window_size <= 256
+        bins = np.arange(window_size // 2 + 1)
+        self._twiddle = np.exp(2j * np.pi * bins / window_size)
+        self._spectrum = np.zeros((num_joints, len(bins)), dtype=complex)
+        freqs = np.fft.rfftfreq(window_size, d=self.dt)
+        self._high_freq = freqs > 0.5 * np.max(freqs)
+        # One-sided density doubles every bin except DC (and Nyquist for even lengths)
+        self._onesided = np.full(len(bins), 2.0)
+        self._onesided[0] = 1.0
+        if window_size % 2 == 0:
+            self._onesided[-1] = 1.0
+
+        self._kinematics = Kinematics(self.dt)
+        self._last_angles = np.full(num_joints, np.nan)
+        self.count = 0
+
+    def window(self):
+        """
+        Return the current angle window.
+
+        Returns:
+        np.array: View of the buffered angles with shape (triples, frames).
+        """
+        n = min(self.count, self.window_size)
+        end = self.count % self.window_size + self.window_size
+        return self._angles[:, end - n:end]
+
+    def update(self, frame_keypoints, valid=None):
+        """
+        Push one frame of keypoints and return the metrics of the current window.
+
+        Parameters:
+        frame_keypoints (np.array): Keypoints of one frame with shape (17, 2).
+        valid (np.array): Optional joint validity with shape (17,), see batch_joint_angles().
+
+        Returns:
+        dict: Same layout as JointAngleDynamics.aggregate_features(), or None until the window is
+            full and for skipped frames.
+        """
+        w = self.window_size
+        if valid is not None:
+            valid = np.asarray(valid)[None]
+        angles = batch_joint_angles(np.asarray(frame_keypoints)[None, :, :2], self._triples,
+                                    fill_value=np.nan, valid=valid)[:, 0]
+        defined = ~np.isnan(angles)
+        self._last_angles[defined] = angles[defined]
+        angles = self._last_angles.copy()
+        if np.isnan(angles).any():
+            return None
+
+        pos = self.count % w
+        full = self.count >= w
+        oldest = self._angles[:, pos].copy() if full else np.zeros_like(angles)
+
+        # Rank-one add/remove updates of the running sums behind mean and covariance
+        self._sum += angles - oldest
+        self._outer += np.outer(angles, angles) - np.outer(oldest, oldest)
+        # Sliding DFT: drop the oldest sample, append the newest and rotate every bin
+        self._spectrum = (self._spectrum + (angles - oldest)[:, None]) * self._twiddle
+
+        self._angles[:, pos] = angles
+        self._angles[:, pos + w] = angles
+        self.count += 1
+
+        if self.count >= 4:
+            # Latest jerk of every joint from the shared finite-difference workspace
+            jerk = self._kinematics.jerk(self.window()[:, -4:].T)[0]
+            slot = (self.count - 4) % (w - 3)
+            self._jerk_sum += jerk ** 2 - self._jerk_sq[:, slot]
+            self._jerk_sq[:, slot] = jerk ** 2
+
+        if self.count % w == 0:
+            self._resync()
+
+        if self.count < w:
+            return None
+        return self._features()
+
+    def _resync(self):
+        """Recompute the running sums from the buffer once per lap to bound float drift."""
+        window = self.window()
+        self._sum = window.sum(axis=1)
+        self._outer = window @ window.T
+        self._spectrum = np.fft.rfft(window, axis=1)
+        self._jerk_sum = self._jerk_sq.sum(axis=1)
+
+    def _high_freq_energy_ratios(self):
+        """
+        High-frequency energy ratio of every joint, matching compute_frequency_features().
+
+        Returns:
+        np.array: Ratio per joint triple.
+        """
+        if not self._sliding_dft:
+            f, Pxx = welch(self.window(), fs=self.fps, axis=-1)
+            return np.sum(Pxx[:, f > 0.5 * np.max(f)], axis=1) / np.sum(Pxx, axis=1)
+
+        w = self.window_size
+        rect = self._spectrum.copy()
+        rect[:, 0] = 0.0  # Constant detrend only removes the DC bin
+        # Periodic Hann window as a 3-tap convolution in the frequency domain
+        lower = np.concatenate([np.conj(rect[:, 1:2]), rect[:, :-1]], axis=1)
+        upper = np.concatenate([rect[:, 1:], np.conj(rect[:, w - rect.shape[1]:w - rect.shape[1] + 1])], axis=1)
+        hann = 0.5 * rect - 0.25 * lower - 0.25 * upper
+        power = np.abs(hann) ** 2 * self._onesided
+
+        total_energy = power.sum(axis=1)
+        high_freq_energy = power[:, self._high_freq].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return high_freq_energy / total_energy
+
+    def _coordination_index(self):
+        """
+        Coordination index from the rolling covariance matrix, matching compute_pca_coordination().
+
+        Returns:
+        float: Coordination index.
+        """
+        n = self.window_size
+        cov = (self._outer - np.outer(self._sum, self._sum) / n) / (n - 1)
+        eigenvalues = np.clip(np.linalg.eigvalsh(cov)[::-1], 0.0, None)
+        total_var = eigenvalues.sum()
+        if total_var <= 0:
+            return 1.0
+        explained_variance = np.cumsum(eigenvalues / total_var)
+        num_components = np.searchsorted(explained_variance, 0.9) + 1
+        return 1 / num_components
+
+    def _features(self):
+        n = self.window_size
+        mean = self._sum / n
+        variability = np.sqrt(np.clip(np.diag(self._outer) / n - mean ** 2, 0.0, None))
+        mean_squared_jerk = self._jerk_sum / (n - 3)
+        high_freq_energy_ratio = self._high_freq_energy_ratios()
+
+        results = {}
+        for i, joint in enumerate(self.joint_triples):
+            results[joint] = {
+                "variability": variability[i],
+                "mean_squared_jerk": mean_squared_jerk[i],
+                "high_freq_energy_ratio": high_freq_energy_ratio[i],
+            }
+
+        return {
+            "joint_metrics": results,
+            "coordination_index": self._coordination_index(),
+        }
+
 # Test Example
 if __name__ == "__main__":
     # Sample keypoints in YOLO format: 17 points (x, y) per frame
@@ -249,3 +689,65 @@ if __name__ == "__main__":
     jad = JointAngleDynamics(sample_keypoints, fps=30)
     features = jad.aggregate_features()
     print(features)
+
+    # 串流平滑度與批次版本比對 (與 exp2_a.py 相同的視窗取法)
+    rng = np.random.default_rng(0)
+    walk_keypoints = np.cumsum(rng.normal(size=(120, 17, 2)), axis=0) + 500
+    window_size = 30
+    smoother = StreamingTrajectorySmoothness(window_size=window_size)
+    for i in range(len(walk_keypoints)):
+        streamed = smoother.update(walk_keypoints[i])
+        if i + 1 > 3:
+            batch = compute_trajectory_smoothness(walk_keypoints[max(0, i + 1 - window_size):i + 1])
+            for key in ("MSJ", "Var", "Smoothness"):
+                assert np.isclose(streamed[key], batch[key], rtol=1e-6), (i, key, streamed[key], batch[key])
+    print("StreamingTrajectorySmoothness matches compute_trajectory_smoothness")
+
+    # 串流 JAD 與每幀重建 JointAngleDynamics 的結果比對
+    streaming_jad = StreamingJointAngleDynamics(fps=30, window_size=window_size)
+    for i in range(len(walk_keypoints)):
+        streamed = streaming_jad.update(walk_keypoints[i])
+        if i + 1 >= window_size:
+            batch = JointAngleDynamics(walk_keypoints[i + 1 - window_size:i + 1], fps=30).aggregate_features()
+            assert streamed["coordination_index"] == batch["coordination_index"], i
+            for joint, metrics in batch["joint_metrics"].items():
+                for key, value in metrics.items():
+                    assert np.isclose(streamed["joint_metrics"][joint][key], value, rtol=1e-6), (i, joint, key)
+    print("StreamingJointAngleDynamics matches JointAngleDynamics.aggregate_features")
+
+    # 整段錄影一次算出的 JAD 與逐視窗 aggregate_features 比對
+    offline = JointAngleDynamics(walk_keypoints, fps=30).rolling_features(window_size)
+    assert np.all(np.isnan(offline["coordination_index"][:window_size - 1]))
+    for i in range(window_size - 1, len(walk_keypoints)):
+        batch = JointAngleDynamics(walk_keypoints[i + 1 - window_size:i + 1], fps=30).aggregate_features()
+        assert offline["coordination_index"][i] == batch["coordination_index"], i
+        for joint, metrics in batch["joint_metrics"].items():
+            for key, value in metrics.items():
+                assert np.isclose(offline["joint_metrics"][joint][key][i], value, rtol=1e-9), (i, joint, key)
+    print("JointAngleDynamics.rolling_features matches aggregate_features on every window")
+
+    # 掉點的關節 (座標為 0、無效) 沿用前一個角度：串流與整段計算一致，且不會出現 jerk 尖峰
+    dropped = walk_keypoints.copy()
+    valid = np.ones(dropped.shape[:2], dtype=bool)
+    valid[:3, 13] = False  # 開頭就缺少的關節：所有角度都有值之前的幀略過
+    valid[rng.random(valid.shape) < 0.05] = False
+    dropped[~valid] = 0.0
+    offline = JointAngleDynamics(dropped, fps=30, valid=valid).rolling_features(window_size)
+    streaming_jad = StreamingJointAngleDynamics(fps=30, window_size=window_size)
+    for i in range(len(dropped)):
+        streamed = streaming_jad.update(dropped[i], valid=valid[i])
+        if streamed is None:
+            assert np.isnan(offline["coordination_index"][i]), i
+            continue
+        assert streamed["coordination_index"] == offline["coordination_index"][i], i
+        for joint, metrics in streamed["joint_metrics"].items():
+            for key, value in metrics.items():
+                assert np.isclose(offline["joint_metrics"][joint][key][i], value, rtol=1e-6), (i, joint, key)
+    held = JointAngleDynamics(dropped, fps=30, valid=valid).calculate_joint_angle_matrix()
+    skipped = int(np.argmax(~np.isnan(held).any(axis=0)))
+    assert skipped >= 3 and streaming_jad.count == len(dropped) - skipped
+    zero_filled = JointAngleDynamics(dropped, fps=30).rolling_features(window_size)
+    held_jerk = np.nanmax([m["mean_squared_jerk"] for m in offline["joint_metrics"].values()])
+    zero_jerk = np.nanmax([m["mean_squared_jerk"] for m in zero_filled["joint_metrics"].values()])
+    assert held_jerk < zero_jerk
+    print(f"Dropped joints hold the previous angle (max MSJ {held_jerk:.3g} vs {zero_jerk:.3g} with zeros)")
@@ -0,0 +1,218 @@
+import os
+import threading
+from queue import Queue
+import cv2
+from analysis import MetricsRecorder, DCR_CONNECTIONS
+from ingest import PoseFrame, ingest_raw, mask_raw
+
+# 多支影片的批次處理管線：
+# 解碼執行緒 -> (有界佇列) -> 批次推論 -> (有界佇列) -> 指標/輸出執行緒
+# 三個階段同時運作，輸出與 exp2_a.py 逐幀處理的 CSV 相同。
+
+_END = object()  # 管線結束標記
+
+
+class _Worker(threading.Thread):
+    """
+    執行階段函數並保留例外。
+    發生錯誤時對下游送出結束標記、並把上游排空到結束標記，避免其他階段卡住。
+    """
+
+    def __init__(self, target, args, downstream=None, upstream=None):
+        super().__init__(daemon=True)
+        self._target_fn = target
+        self._args = args
+        self._downstream = downstream
+        self._upstream = upstream
+        self.error = None
+
+    def run(self):
+        try:
+            self._target_fn(*self._args)
+        except BaseException as exc:
+            self.error = exc
+            if self._downstream is not None:
+                self._downstream.put(_END)
+            if self._upstream is not None:
+                while self._upstream.get() is not _END:
+                    pass
+
+
+def decode_frames(video_paths, frame_queue, cache=None, cache_keys=None):
+    """
+    依序解碼每支影片並放入有界佇列。
+    每支影片結束時放入 (video_idx, None, None)，全部結束時放入 _END。
+    快取中已有結果的影片不解碼，直接放入 (video_idx, frame_index, PoseFrame)。
+    """
+    for video_idx, video_path in enumerate(video_paths):
+        if cache is not None and cache_keys[video_idx] in cache:
+            for frame_index, pose in cache.replay(cache_keys[video_idx]):
+                frame_queue.put((video_idx, frame_index, pose))
+            frame_queue.put((video_idx, None, None))
+            continue
+        cap = cv2.VideoCapture(video_path)
+        frame_index = 0
+        while cap.isOpened():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frame_queue.put((video_idx, frame_index, frame))
+            frame_index += 1
+        cap.release()
+        frame_queue.put((video_idx, None, None))
+    frame_queue.put(_END)
+
+
+def infer_batches(model, frame_queue, result_queue, batch_size=8, params=None, cache=None, cache_keys=None):
+    """
+    從佇列收集 batch_size 幀後一次送入 YOLO Pose 模型。
+    輸出 (video_idx, frame_index, pose)，pose 為 ingest.PoseFrame，整批結果只搬到 CPU 一次。
+    params: 推論參數，傳給 model(frames, **params)
+    cache / cache_keys: 推論完的影片寫入 PoseCache；已快取的影片由 decode_frames 直接送出結果
+    """
+    params = dict(params or {})
+    batch = []
+    writers = {}
+
+    def flush():
+        if not batch:
+            return
+        results = model([frame for _, _, frame in batch], verbose=False, **params)
+        for (video_idx, frame_index, _), (data, track_ids) in zip(batch, ingest_raw(results)):
+            if cache is not None:
+                if video_idx not in writers:
+                    writers[video_idx] = cache.writer(cache_keys[video_idx], metadata={'params': params})
+                # 快取未套用門檻的原始座標，之後可用其他 conf_threshold 重播
+                writers[video_idx].metadata['tracked'] = track_ids is not None
+                writers[video_idx].write(frame_index, data[..., :2], data[..., 2], track_ids)
+            result_queue.put((video_idx, frame_index, mask_raw(data, track_ids)))
+        batch.clear()
+
+    try:
+        while True:
+            item = frame_queue.get()
+            if item is _END:
+                flush()
+                result_queue.put(_END)
+                return
+            if item[1] is None:
+                # 影片結束：先送出剩餘的幀再轉送結束標記，維持順序
+                flush()
+                if item[0] in writers:
+                    writers.pop(item[0]).close()
+                result_queue.put(item)
+                continue
+            if isinstance(item[2], PoseFrame):
+                # 快取的結果不需推論，送出前先清空批次以維持順序
+                flush()
+                result_queue.put(item)
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size:
+                flush()
+    finally:
+        # 中途失敗時不留下不完整的快取
+        for writer in writers.values():
+            writer.abort()
+
+
+def record_metrics(result_queue, video_paths, output_dirs, window_size=30, fps=30, keypoints_csv=False,
+                   dcr_connections=DCR_CONNECTIONS, preprocess=None, smoothing_lam=None):
+    """依影片各自維護 MetricsRecorder，影片結束時寫出關鍵點與指標檔案"""
+    recorders = {}
+
+    def recorder_for(video_idx):
+        if video_idx not in recorders:
+            recorders[video_idx] = MetricsRecorder(
+                output_dirs[video_idx], window_size=window_size, fps=fps,
+                keypoints_csv=keypoints_csv, metadata={'video': video_paths[video_idx]},
+                dcr_connections=dcr_connections, preprocess=preprocess, smoothing_lam=smoothing_lam)
+        return recorders[video_idx]
+
+    while True:
+        item = result_queue.get()
+        if item is _END:
+            return
+        video_idx, frame_index, pose = item
+        if frame_index is None:
+            recorder_for(video_idx).close()
+            del recorders[video_idx]
+            print(f"Metrics saved: {output_dirs[video_idx]}")
+            continue
+        recorder_for(video_idx).update(frame_index, pose.xy, track_ids=pose.track_ids,
+                                       confidences=pose.conf, valid=pose.valid)
+
+
+def run_pipeline(video_paths, model, output_root='./output', batch_size=8,
+                 queue_size=64, window_size=30, fps=30, keypoints_csv=False, dcr_connections=DCR_CONNECTIONS,
+                 preprocess=None, cache=None, weights_path=None, params=None, smoothing_lam=None):
+    """
+    以解碼、推論、指標三個階段並行處理多支影片。
+    video_paths: 影片路徑列表
+    model: YOLO Pose 模型
+    output_root: 輸出根目錄，每支影片輸出至 output_root/<影片檔名>/
+    batch_size: 每次推論的幀數
+    queue_size: 階段之間佇列的上限 (幀數)，限制記憶體用量
+    keypoints_csv: 是否另外轉出舊版的 keypoints_data.csv
+    dcr_connections: DCR 使用的肢段連接關係
+    preprocess: 平滑度與 JAD 前的缺漏補齊/濾波設定，見 MetricsRecorder
+    cache: pose_cache.PoseCache，已快取的影片不解碼也不推論
+    weights_path: 模型權重檔 (快取鍵的一部分)
+    params: 推論參數，傳給 model(frames, **params) (快取鍵的一部分)
+    smoothing_lam: 平滑度 Var 使用的線性平滑運算子 λ，見 MetricsRecorder
+    回傳每支影片的輸出目錄
+    """
+    output_dirs = [
+        os.path.join(output_root, os.path.splitext(os.path.basename(path))[0])
+        for path in video_paths
+    ]
+    cache_keys = None
+    if cache is not None:
+        cache_keys = [cache.key(path, weights_path, params) for path in video_paths]
+    frame_queue = Queue(maxsize=queue_size)
+    result_queue = Queue(maxsize=queue_size)
+
+    decoder = _Worker(decode_frames, (video_paths, frame_queue, cache, cache_keys), downstream=frame_queue)
+    writer = _Worker(record_metrics,
+                     (result_queue, video_paths, output_dirs, window_size, fps, keypoints_csv,
+                      dcr_connections, preprocess, smoothing_lam),
+                     upstream=result_queue)
+    decoder.start()
+    writer.start()
+
+    try:
+        infer_batches(model, frame_queue, result_queue, batch_size, params, cache, cache_keys)
+    except BaseException:
+        result_queue.put(_END)
+        raise
+    finally:
+        # 推論結束後排空解碼佇列，避免解碼執行緒卡在 put
+        while decoder.is_alive():
+            while not frame_queue.empty():
+                frame_queue.get_nowait()
+            decoder.join(timeout=0.1)
+        writer.join()
+
+    for worker in (decoder, writer):
+        if worker.error is not None:
+            raise worker.error
+    return output_dirs
+
+
+if __name__ == "__main__":
+    from ultralytics import YOLO
+    from pose_cache import PoseCache
+
+    # 載入 YOLO Pose 模型
+    weights_path = '../exp1/yolo11x-pose.pt'
+    model = YOLO(weights_path)
+
+    # 設定欲處理的影片
+    video_paths = [
+        './normal_walk.mp4',
+        './abnormal_walk.mp4',
+    ]
+
+    # 與 exp2_a.py 的預設相同：不做缺漏補齊 (preprocess=None)，使用推論快取
+    run_pipeline(video_paths, model, output_root='./output', batch_size=8,
+                 cache=PoseCache(), weights_path=weights_path)
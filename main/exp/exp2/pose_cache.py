@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+from ingest import CONF_THRESHOLD, ingest_raw, mask_raw
+from keypoint_io import KeypointArrayWriter, load_keypoints, metadata_path
+from profiling import NULL_PROFILER
+
+# 姿態推論結果的磁碟快取：
+# 以 (影片內容雜湊, 模型權重雜湊, 推論參數) 為鍵，每支影片存成一個
+# keypoints_data.npy 格式的檔案 (見 keypoint_io.py)，讀取時以記憶體映射開啟。
+# 快取命中時分析腳本不必解碼也不必推論，只需調整指標或門檻後重跑。
+# 快取保存模型輸出的原始 (x, y, conf) (低信心關節不設為 0)，讀取時才依 conf_threshold 建立有效關節平面。
+# 總大小超過上限時，依最後使用時間 (LRU) 刪除最舊的項目。
+
+CACHE_FORMAT = 2  # 快取內容格式改變時遞增，舊的項目自然失效 (2: 保存未套用門檻的原始座標)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pose_cache')
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _CacheWriter(KeypointArrayWriter):
+    """寫入暫存檔，關閉時才放入快取，避免中斷的推論留下不完整的項目"""
+
+    def __init__(self, cache, key, max_persons, metadata):
+        self._cache = cache
+        self._key = key
+        # person 欄位不足時自動擴充，快取的結果與重新推論完全相同
+        super().__init__(cache._path(key, partial=True), max_persons=max_persons, metadata=metadata, grow=True)
+
+    def close(self):
+        if self._file.closed:
+            return
+        super().close()
+        self._cache._commit(self._key)
+
+    def abort(self):
+        """放棄此項目 (例如推論中途失敗)"""
+        if not self._file.closed:
+            self._file.close()
+        for path in (self.path, metadata_path(self.path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class PoseCache:
+    """
+    以影片、權重與推論參數為鍵的關鍵點快取。
+    get() 回傳記憶體映射的 (frames, persons, 17, 3) 陣列，writer() 寫入新項目。
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=20 * 1024 ** 3):
+        """
+        root: 快取資料夾
+        max_bytes: 快取總大小上限 (位元組)，超過時依 LRU 刪除
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._index_path = os.path.join(root, 'index.json')
+        self._index = {'entries': {}, 'digests': {}}
+        if os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+
+    def _save_index(self):
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(tmp_path, self._index_path)
+
+    def _path(self, key, partial=False):
+        return os.path.join(self.root, key + ('.partial.npy' if partial else '.npy'))
+
+    def digest(self, path):
+        """檔案內容雜湊；以 (路徑, 大小, 修改時間) 記住結果，未變動的大影片不必重算"""
+        stat = os.stat(path)
+        signature = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        digests = self._index['digests']
+        if signature not in digests:
+            digests[signature] = file_digest(path)
+            self._save_index()
+        return digests[signature]
+
+    def key(self, video_path, weights_path, params=None):
+        """快取鍵：影片內容、模型權重與推論參數 (例如 imgsz、conf) 的雜湊"""
+        content = {
+            'format': CACHE_FORMAT,
+            'video': self.digest(video_path),
+            'weights': self.digest(weights_path) if os.path.exists(weights_path) else weights_path,
+            'params': params or {},
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def __contains__(self, key):
+        return key in self._index['entries'] and os.path.exists(self._path(key))
+
+    def get(self, key, mmap_mode='r'):
+        """
+        讀取快取項目並更新最後使用時間。
+        回傳 (keypoints, metadata)，不存在時回傳 None
+        """
+        if key not in self:
+            return None
+        self._index['entries'][key]['last_access'] = time.time()
+        self._save_index()
+        return load_keypoints(self._path(key), mmap_mode=mmap_mode)
+
+    def writer(self, key, max_persons=8, metadata=None):
+        """
+        建立新項目的寫入器 (介面同 KeypointArrayWriter)，close() 後才會出現在快取中。
+        請寫入 ingest.ingest_raw 的原始 (x, y, conf)；max_persons 只是初始欄位數，人數較多時自動擴充
+        """
+        return _CacheWriter(self, key, max_persons, metadata)
+
+    def _commit(self, key):
+        partial = self._path(key, partial=True)
+        os.replace(metadata_path(partial), metadata_path(self._path(key)))
+        os.replace(partial, self._path(key))
+        size = os.path.getsize(self._path(key)) + os.path.getsize(metadata_path(self._path(key)))
+        self._index['entries'][key] = {'size': size, 'last_access': time.time()}
+        self.evict()
+        self._save_index()
+
+    def remove(self, key):
+        for path in (self._path(key), metadata_path(self._path(key))):
+            if os.path.exists(path):
+                os.remove(path)
+        self._index['entries'].pop(key, None)
+
+    def evict(self):
+        """刪除最久未使用的項目，直到總大小不超過 max_bytes"""
+        entries = self._index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_access']):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]['size']
+            self.remove(key)
+
+    def size(self):
+        return sum(entry['size'] for entry in self._index['entries'].values())
+
+    def replay(self, key, conf_threshold=CONF_THRESHOLD):
+        """
+        依幀產生快取中的偵測結果，與 ingest.ingest_results 的輸出相同。
+        有效關節平面依 conf_threshold 重新計算，調整門檻不必重新推論。
+        產生 (frame_index, PoseFrame)
+        """
+        keypoints, metadata = self.get(key)
+        track_ids = np.asarray(metadata.get('track_ids') or [], dtype=np.int64)
+        tracked = metadata.get('tracked', False)
+        for frame_index in range(len(keypoints)):
+            row = np.asarray(keypoints[frame_index])
+            present = ~np.all(np.isnan(row[..., 0]), axis=-1)
+            yield frame_index, mask_raw(row[present], track_ids[present[:len(track_ids)]] if tracked else None,
+                                        conf_threshold)
+
+
+def video_poses(video_path, model, cache=None, weights_path=None, params=None, need_frames=True,
+                conf_threshold=CONF_THRESHOLD, max_persons=8, profiler=None):
+    """
+    逐幀產生影片的姿態結果，有快取時直接讀取。
+    video_path: 影片路徑
+    model: YOLO Pose 模型，以 model(frame, **params) 推論
+    cache: PoseCache，None 時不使用快取
+    weights_path: 模型權重檔 (快取鍵的一部分)
+    params: 推論參數 (快取鍵的一部分)
+    need_frames: 快取命中時是否仍要解碼影格 (顯示或繪圖用)；False 時影格為 None
+    max_persons: 快取的初始 person 欄位數 (人數較多時自動擴充，不會丟棄偵測)
+    profiler: profiling.StageProfiler，分別計時 'decode'、'inference'、'transfer' 與 'cache' 階段
+    產生 (frame_index, frame, PoseFrame)
+    """
+    import cv2
+
+    profiler = NULL_PROFILER if profiler is None else profiler
+    params = dict(params or {})
+    key = cache.key(video_path, weights_path, params) if cache is not None else None
+
+    if key is not None and key in cache:
+        cap = cv2.VideoCapture(video_path) if need_frames else None
+        for frame_index, pose in cache.replay(key, conf_threshold):
+            frame = None
+            if cap is not None:
+                with profiler.stage('decode'):
+                    ret, frame = cap.read()
+                if not ret:
+                    break
+            yield frame_index, frame, pose
+        if cap is not None:
+            cap.release()
+        return
+
+    writer = None
+    if key is not None:
+        writer = cache.writer(key, max_persons=max_persons,
+                              metadata={'video': video_path, 'weights': weights_path, 'params': params})
+    cap = cv2.VideoCapture(video_path)
+    completed = False
+    try:
+        frame_index = 0
+        tracked = False
+        while cap.isOpened():
+            with profiler.stage('decode'):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            with profiler.stage('inference'):
+                results = model(frame, **params)
+            data, track_ids = ingest_raw(results, profiler)[0]
+            pose = mask_raw(data, track_ids, conf_threshold)
+            if writer is not None:
+                with profiler.stage('cache'):
+                    # 快取未套用門檻的原始座標，之後可用其他 conf_threshold 重播
+                    tracked |= track_ids is not None
+                    writer.write(frame_index, data[..., :2], data[..., 2], track_ids)
+            yield frame_index, frame, pose
+            frame_index += 1
+        completed = True
+    finally:
+        cap.release()
+        if writer is not None:
+            if completed:
+                writer.metadata['tracked'] = tracked
+                writer.close()
+            else:
+                # 中途停止 (例如按下 q) 時不寫入不完整的快取
+                writer.abort()
@@ -0,0 +1,291 @@
+from collections import deque
+import numpy as np
+from scipy.interpolate import CubicSpline
+from scipy.signal import savgol_filter
+from ingest import valid_mask
+
+# jerk 指標前的前處理：
+# 掉點的關節 (0, 0) 經三次差分會產生極大的 jerk (MSJ 約 1e10)，
+# 因此先補齊缺漏再 (選擇性) 平滑，所有關節與所有幀一次處理。
+
+
+def fill_gaps(keypoints, valid=None, method='linear', max_gap=None):
+    """
+    以有效幀內插補齊無效的關節座標，一次處理所有關節。
+    keypoints: shape = (frames, 17, 2)
+    valid: 有效關節平面，shape = (frames, 17)，None 時以座標是否 > 0 判斷
+    method: 'linear' 線性內插，或 'spline' 三次樣條 (有效幀少於 4 的關節改用線性)
+    max_gap: 最多補齊的連續缺漏幀數，None 為不限；頭尾的缺漏以最近的有效值補齊
+    回傳 (keypoints, valid)，valid 標記補齊後有值的關節
+    """
+    keypoints = np.array(keypoints, dtype=np.float64)
+    if valid is None:
+        valid = valid_mask(keypoints)
+    valid = np.asarray(valid, dtype=bool)
+    num_frames, num_joints = valid.shape
+    if num_frames == 0:
+        return keypoints, valid.copy()
+
+    frames = np.broadcast_to(np.arange(num_frames)[:, None], valid.shape)
+    joints = np.arange(num_joints)[None, :]
+    # 每個位置前一個與後一個有效幀的索引
+    prev_idx = np.maximum.accumulate(np.where(valid, frames, -1), axis=0)
+    next_idx = np.minimum.accumulate(np.where(valid, frames, num_frames)[::-1], axis=0)[::-1]
+    has_prev = prev_idx >= 0
+    has_next = next_idx < num_frames
+
+    prev_xy = keypoints[np.clip(prev_idx, 0, None), joints]
+    next_xy = keypoints[np.clip(next_idx, None, num_frames - 1), joints]
+    both = has_prev & has_next
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(both, (frames - prev_idx) / (next_idx - prev_idx), 0.0)
+    interpolated = np.where(both[..., None], prev_xy + weight[..., None] * (next_xy - prev_xy),
+                            np.where(has_prev[..., None], prev_xy, next_xy))
+
+    if method == 'spline':
+        interior = both & ~valid
+        for joint in np.flatnonzero(interior.any(axis=0)):
+            known = np.flatnonzero(valid[:, joint])
+            if len(known) >= 4:
+                missing = np.flatnonzero(interior[:, joint])
+                interpolated[missing, joint] = CubicSpline(known, keypoints[known, joint], axis=0)(missing)
+    elif method != 'linear':
+        raise ValueError(f"Unknown gap filling method: {method}")
+
+    fill = ~valid & (has_prev | has_next)
+    if max_gap is not None:
+        # 內部缺漏以整段長度判斷，頭尾缺漏以距離最近有效幀的幀數判斷
+        gap = np.where(both, next_idx - prev_idx - 1,
+                       np.where(has_prev, frames - prev_idx, next_idx - frames))
+        fill &= gap <= max_gap
+    keypoints[fill] = interpolated[fill]
+    return keypoints, valid | fill
+
+
+def savgol_smooth(keypoints, window_length=7, polyorder=3, fps=30, deriv=0):
+    """
+    Savitzky-Golay 平滑，對所有關節與座標沿時間軸一次計算。
+    deriv > 0 時直接回傳該階導數 (單位為每秒)，不必再對平滑後的軌跡做差分。
+    keypoints: shape = (frames, ...)，幀數需至少 window_length
+    """
+    return savgol_filter(np.asarray(keypoints, dtype=np.float64), window_length, polyorder,
+                         deriv=deriv, delta=1.0 / fps, axis=0)
+
+
+def savgol_derivatives(keypoints, window_length=7, polyorder=3, fps=30):
+    """
+    以同一個 Savitzky-Golay 擬合取得位置、速度、加速度與 jerk (polyorder 需至少 3)。
+    回傳 dict，每個值的 shape 與 keypoints 相同
+    """
+    if polyorder < 3:
+        raise ValueError("polyorder must be at least 3 to estimate jerk.")
+    names = ("position", "velocity", "acceleration", "jerk")
+    return {name: savgol_smooth(keypoints, window_length, polyorder, fps, deriv=order)
+            for order, name in enumerate(names)}
+
+
+class OneEuroFilter:
+    """
+    One-Euro 濾波器，同時處理所有關節 (Casiez et al., 2012)。
+    速度越快截止頻率越高，靜止時平滑、快速動作時延遲小；
+    濾波後的速度保存在 derivative，可直接作為一階導數使用。
+    """
+
+    def __init__(self, fps=30, min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+        """
+        fps: 影片幀率，未提供 frame_index 時的取樣間隔
+        min_cutoff: 最低截止頻率 (Hz)，越小越平滑
+        beta: 截止頻率隨速度增加的比例，越大延遲越小
+        d_cutoff: 速度估計的截止頻率 (Hz)
+        """
+        self.fps = fps
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.reset()
+
+    def reset(self):
+        self._x = None
+        self.derivative = None
+        self._ready = None
+        self._last_frame = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        tau = 1.0 / (2 * np.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def __call__(self, keypoints, valid=None, frame_index=None):
+        """
+        濾波一幀。
+        keypoints: shape = (17, 2)
+        valid: shape = (17,)，無效的關節保留上一個濾波值且不更新狀態
+        frame_index: 幀編號，有跳幀時以實際間隔計算
+        回傳濾波後的座標，shape = (17, 2)
+        """
+        x = np.asarray(keypoints, dtype=np.float64)
+        valid = np.ones(x.shape[0], dtype=bool) if valid is None else np.asarray(valid, dtype=bool)
+        if self._x is None:
+            self._x = x.copy()
+            self.derivative = np.zeros_like(x)
+            self._ready = valid.copy()
+            self._last_frame = frame_index
+            return self._x.copy()
+
+        dt = 1.0 / self.fps
+        if frame_index is not None and self._last_frame is not None and frame_index > self._last_frame:
+            dt *= frame_index - self._last_frame
+        self._last_frame = frame_index
+
+        update = valid & self._ready
+        dx = (x - self._x) / dt
+        a_d = self._alpha(self.d_cutoff, dt)
+        dx_hat = a_d * dx + (1 - a_d) * self.derivative
+        cutoff = self.min_cutoff + self.beta * np.abs(dx_hat)
+        a = self._alpha(cutoff, dt)
+        x_hat = a * x + (1 - a) * self._x
+
+        self.derivative = np.where(update[:, None], dx_hat, self.derivative)
+        self._x = np.where(update[:, None], x_hat, self._x)
+        # 第一次出現的有效關節直接作為初始值
+        start = valid & ~self._ready
+        self._x[start] = x[start]
+        self._ready |= valid
+        return self._x.copy()
+
+
+def one_euro(keypoints, valid=None, fps=30, min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+    """對整段 (frames, 17, 2) 軌跡套用 One-Euro 濾波，回傳相同 shape 的陣列"""
+    keypoints = np.asarray(keypoints, dtype=np.float64)
+    euro = OneEuroFilter(fps, min_cutoff, beta, d_cutoff)
+    output = np.empty_like(keypoints)
+    for i, frame_keypoints in enumerate(keypoints):
+        output[i] = euro(frame_keypoints, None if valid is None else valid[i])
+    return output
+
+
+def preprocess_keypoints(keypoints, valid=None, method='linear', max_gap=None, smoothing=None,
+                         fps=30, **filter_kwargs):
+    """
+    離線前處理：補齊缺漏後選擇性平滑，結果可直接送入 compute_trajectory_smoothness、
+    JointAngleDynamics 等以三次差分計算 jerk 的指標。
+    smoothing: None、'savgol' (filter_kwargs: window_length, polyorder) 或 'one_euro'
+               (filter_kwargs: min_cutoff, beta, d_cutoff)
+    回傳 (keypoints, valid)
+    """
+    keypoints, valid = fill_gaps(keypoints, valid, method=method, max_gap=max_gap)
+    if smoothing == 'savgol':
+        keypoints = savgol_smooth(keypoints, fps=fps, **filter_kwargs)
+    elif smoothing == 'one_euro':
+        keypoints = one_euro(keypoints, valid, fps=fps, **filter_kwargs)
+    elif smoothing is not None:
+        raise ValueError(f"Unknown smoothing filter: {smoothing}")
+    return keypoints, valid
+
+
+class StreamingPreprocessor:
+    """
+    串流版前處理，最多延遲 lookahead 幀。
+    每幀推入後，輸出 lookahead 幀之前的那一幀：缺漏的關節以前一個有效值與
+    lookahead 內下一個有效值線性內插 (之後沒有有效值時沿用前一個)，
+    再選擇性套用 One-Euro 濾波。lookahead = 0 時完全不延遲，只沿用前一個有效值。
+    """
+
+    def __init__(self, lookahead=5, max_gap=None, one_euro=False, fps=30,
+                 min_cutoff=1.0, beta=0.007, d_cutoff=1.0):
+        """
+        lookahead: 往後看的幀數 (輸出延遲)
+        max_gap: 最多補齊的連續缺漏幀數，None 為不限
+        one_euro: 是否在補齊後套用 One-Euro 濾波
+        """
+        self.lookahead = lookahead
+        self.max_gap = max_gap
+        self._pending = deque()
+        self._last_xy = None
+        self._last_frame = None
+        self._filter = OneEuroFilter(fps, min_cutoff, beta, d_cutoff) if one_euro else None
+
+    def update(self, frame_index, keypoints, valid=None):
+        """
+        推入一幀。
+        keypoints: shape = (17, 2)
+        valid: shape = (17,)，None 時以座標是否 > 0 判斷
+        回傳已可輸出的 (frame_index, keypoints, valid) 列表 (0 或 1 個)
+        """
+        keypoints = np.array(keypoints, dtype=np.float64)[:, :2]
+        valid = valid_mask(keypoints) if valid is None else np.array(valid, dtype=bool)
+        self._pending.append((frame_index, keypoints, valid))
+        output = []
+        while len(self._pending) > self.lookahead:
+            output.append(self._emit())
+        return output
+
+    def flush(self):
+        """輸出所有尚在等待的幀 (影片結束時呼叫)"""
+        output = []
+        while self._pending:
+            output.append(self._emit())
+        return output
+
+    def _emit(self):
+        frame_index, keypoints, valid = self._pending.popleft()
+        if self._last_xy is None:
+            self._last_xy = np.zeros_like(keypoints)
+            self._last_frame = np.full(len(valid), -np.inf)
+
+        filled = valid.copy()
+        missing = ~valid
+        if missing.any():
+            # lookahead 內每個關節下一個有效值
+            next_xy = np.zeros_like(keypoints)
+            next_frame = np.full(len(valid), np.inf)
+            for future_index, future_xy, future_valid in self._pending:
+                take = missing & future_valid & np.isinf(next_frame)
+                next_xy[take] = future_xy[take]
+                next_frame[take] = future_index
+
+            has_prev = np.isfinite(self._last_frame)
+            has_next = np.isfinite(next_frame)
+            both = missing & has_prev & has_next
+            with np.errstate(invalid='ignore'):
+                weight = (frame_index - self._last_frame) / (next_frame - self._last_frame)
+            keypoints = keypoints.copy()
+            hold = missing & has_prev & ~has_next
+            ahead = missing & ~has_prev & has_next
+            if self.max_gap is not None:
+                both &= next_frame - self._last_frame - 1 <= self.max_gap
+                hold &= frame_index - self._last_frame <= self.max_gap
+                ahead &= next_frame - frame_index <= self.max_gap
+            keypoints[both] = self._last_xy[both] + weight[both, None] * (next_xy[both] - self._last_xy[both])
+            keypoints[hold] = self._last_xy[hold]
+            keypoints[ahead] = next_xy[ahead]
+            filled |= both | hold | ahead
+
+        self._last_xy[valid] = keypoints[valid]
+        self._last_frame[valid] = frame_index
+        if self._filter is not None:
+            keypoints = self._filter(keypoints, filled, frame_index)
+        return frame_index, keypoints, filled
+
+
+if __name__ == "__main__":
+    # 串流版 (lookahead 足夠時) 與離線線性補齊結果相同
+    rng = np.random.default_rng(0)
+    walk = np.cumsum(rng.normal(size=(200, 17, 2)), axis=0) + 300
+    valid = rng.uniform(size=(200, 17)) > 0.2
+    walk[~valid] = 0.0
+
+    offline, offline_valid = fill_gaps(walk, valid)
+    stream = StreamingPreprocessor(lookahead=200)
+    emitted = []
+    for i, frame_keypoints in enumerate(walk):
+        emitted += stream.update(i, frame_keypoints, valid[i])
+    emitted += stream.flush()
+    streamed = np.array([xy for _, xy, _ in emitted])
+    assert np.allclose(streamed, offline) and np.array_equal([v for _, _, v in emitted], offline_valid)
+
+    # 掉點造成的 jerk 尖峰
+    jerk_raw = np.diff(walk[:, 10], n=3, axis=0) * 30 ** 3
+    derivatives = savgol_derivatives(offline, window_length=9, polyorder=3, fps=30)
+    print(f"MSJ raw: {np.mean(np.sum(jerk_raw ** 2, axis=1)):.3e}, "
+          f"gap-filled + Savitzky-Golay: {np.mean(np.sum(derivatives['jerk'][:, 10] ** 2, axis=1)):.3e}")
@@ -0,0 +1,314 @@
+import bisect
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from collections import deque
+import numpy as np
+
+# 熱路徑分段計時：
+# 以 perf_counter 計時每一幀的各個階段 (解碼、推論、.cpu() 搬移、指標、繪圖、輸出...)，
+# 每個階段保留整段執行的對數刻度直方圖與最近 window 個樣本 (滾動百分位數)，另外記錄幀率與記憶體峰值。
+# 可選擇在第 profile_start 幀起對 profile_frames 幀啟用 cProfile。
+# 結束時以 save() 寫出 JSON 報告，換模型或指標後用 compare_reports 比對兩份報告找出變慢的階段。
+
+# 直方圖的桶邊界 (秒)：10 微秒 ~ 10 秒，每 10 倍分 8 桶
+HISTOGRAM_EDGES = tuple(float(edge) for edge in 10.0 ** np.arange(-5, 1.0001, 0.125))
+
+
+class _Stage:
+    """單一階段的計時器與統計；作為 context manager 使用 (同一階段不可巢狀)"""
+
+    __slots__ = ('name', 'count', 'total', 'max', 'buckets', 'recent', '_start')
+
+    def __init__(self, name, window):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_EDGES) + 1)  # 第 0 桶與最後一桶為超出範圍
+        self.recent = deque(maxlen=window)
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.add(time.perf_counter() - self._start)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[bisect.bisect_right(HISTOGRAM_EDGES, seconds)] += 1
+        self.recent.append(seconds)
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_ms': self.total / self.count * 1000 if self.count else None,
+            'max_ms': self.max * 1000,
+        }
+        if self.recent:
+            recent = np.asarray(self.recent) * 1000
+            for q in (50, 90, 99):
+                summary[f'recent_p{q}_ms'] = float(np.percentile(recent, q))
+        # 只輸出非空的桶：[下界毫秒, 上界毫秒, 次數]，None 為無界
+        edges = (None,) + tuple(edge * 1000 for edge in HISTOGRAM_EDGES) + (None,)
+        summary['histogram'] = [[edges[i], edges[i + 1], count] for i, count in enumerate(self.buckets) if count]
+        return summary
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _peak_rss_mb():
+    """行程的記憶體峰值 (MB)；不支援 resource 模組的平台 (Windows) 回傳 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 單位為 KB，macOS 為 bytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _cuda_peak_mb():
+    """已載入 torch 且使用 CUDA 時的 GPU 記憶體峰值 (MB)，不會為此載入 torch"""
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available() or not torch.cuda.is_initialized():
+        return None
+    return torch.cuda.max_memory_allocated() / 1024 ** 2
+
+
+class StageProfiler:
+    """
+    每幀各階段的計時、幀率與記憶體峰值。
+    用法：
+        with profiler.stage('metrics'):
+            ...
+        profiler.frame()  # 每幀結束時呼叫一次
+    enabled=False 時 stage() 與 frame() 幾乎沒有成本，呼叫端不必另外判斷
+    """
+
+    def __init__(self, enabled=True, window=1000, profile_frames=0, profile_start=0, profile_path=None,
+                 metadata=None):
+        """
+        window: 滾動百分位數與滾動幀率使用的最近樣本數
+        profile_frames: 啟用 cProfile 的幀數，0 為不啟用
+        profile_start: 從第幾幀開始 cProfile (略過模型暖機的幀)
+        profile_path: cProfile 結果另存為 .prof (可用 snakeviz / pstats 開啟)，None 時只寫入報告
+        metadata: 寫入報告的附加資訊 (影片、權重、推論參數...)，比對報告時用來確認條件相同
+        """
+        self.enabled = enabled
+        self.window = window
+        self.profile_frames = profile_frames
+        self.profile_start = profile_start
+        self.profile_path = profile_path
+        self.metadata = dict(metadata or {})
+        self.stages = {}
+        self.frames = 0
+        self._frame_times = deque(maxlen=window + 1)
+        self._frame_stage = _Stage('frame', window)
+        self._started = time.perf_counter()
+        self._last_frame = self._started
+        self._profiler = None
+        self._profile_stats = None
+        if enabled and profile_frames > 0 and profile_start <= 0:
+            self._start_profile()
+
+    def stage(self, name):
+        """回傳階段 name 的計時 context manager"""
+        if not self.enabled:
+            return _NULL_STAGE
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = _Stage(name, self.window)
+        return stage
+
+    def iterate(self, iterable, name):
+        """
+        逐項產生 iterable 的內容，並把每次取得下一項的時間計入階段 name。
+        用於姿態來源 (產生器)：不論來源為何都能得到每幀取得姿態的總時間，
+        各姿態來源另外細分的 decode / inference / transfer 等階段已包含在內
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        stage = self.stage(name)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            stage.add(time.perf_counter() - start)
+            yield item
+
+    def frame(self):
+        """標記一幀結束：更新幀率與每幀時間，並依設定開始/停止 cProfile"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self._frame_stage.add(now - self._last_frame)
+        self._last_frame = now
+        self._frame_times.append(now)
+        self.frames += 1
+
+        if self.profile_frames > 0:
+            if self.frames == self.profile_start:
+                self._start_profile()
+            elif self._profiler is not None and self.frames >= self.profile_start + self.profile_frames:
+                self._stop_profile()
+
+    def _start_profile(self):
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def _stop_profile(self):
+        self._profiler.disable()
+        if self.profile_path is not None:
+            self._profiler.dump_stats(self.profile_path)
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        # 依累計時間排序的前 30 個函式：[函式, 呼叫次數, 自身時間, 累計時間]
+        self._profile_stats = {
+            'frames': self.frames - max(self.profile_start, 0),
+            'top_cumulative': [
+                [f"{os.path.basename(filename)}:{line}({function})", calls, own, cumulative]
+                for (filename, line, function), (_, calls, own, cumulative, _)
+                in sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:30]
+            ],
+        }
+        self._profiler = None
+
+    def fps(self):
+        """最近 window 幀的滾動幀率"""
+        if len(self._frame_times) < 2:
+            return None
+        return (len(self._frame_times) - 1) / (self._frame_times[-1] - self._frame_times[0])
+
+    def report(self):
+        """回傳 dict 報告 (可直接 json.dump)"""
+        if self._profiler is not None:
+            self._stop_profile()  # 執行在 profile_frames 幀之前結束
+        elapsed = time.perf_counter() - self._started
+        return {
+            'metadata': self.metadata,
+            'frames': self.frames,
+            'elapsed_s': elapsed,
+            'fps': self.frames / elapsed if elapsed > 0 else None,
+            'recent_fps': self.fps(),
+            'frame': self._frame_stage.summary(),
+            'stages': {name: stage.summary() for name, stage in self.stages.items()},
+            'memory': {'peak_rss_mb': _peak_rss_mb(), 'cuda_peak_mb': _cuda_peak_mb()},
+            'cprofile': self._profile_stats,
+        }
+
+    def save(self, path):
+        report = self.report()
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+        return report
+
+    def print_summary(self, report=None):
+        """印出每個階段的平均與 p90 (毫秒) 以及占總時間的比例"""
+        report = self.report() if report is None else report
+        fps = report['fps'] or 0.0
+        print(f"Profile: {report['frames']} frames in {report['elapsed_s']:.1f}s ({fps:.1f} fps)")
+        for name, stage in report['stages'].items():
+            share = stage['total_s'] / report['elapsed_s'] * 100 if report['elapsed_s'] > 0 else 0.0
+            p90 = stage.get('recent_p90_ms', float('nan'))
+            print(f"  {name:<14} mean {stage['mean_ms'] or 0.0:8.2f}ms  p90 {p90:8.2f}ms  {share:5.1f}%")
+
+
+NULL_PROFILER = StageProfiler(enabled=False)
+
+
+def compare_reports(baseline, current, tolerance=0.1):
+    """
+    比較兩份報告 (dict 或 JSON 路徑) 各階段的平均時間。
+    tolerance: 平均時間增加超過此比例視為退步
+    回傳 [(階段, 基準毫秒, 目前毫秒, 比例)] 中退步的項目，依比例由大到小排序
+    """
+    reports = []
+    for report in (baseline, current):
+        if not isinstance(report, dict):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append(report)
+    baseline, current = reports
+
+    regressions = []
+    stages = dict(current['stages'], frame=current['frame'])
+    baseline_stages = dict(baseline['stages'], frame=baseline['frame'])
+    for name, stage in stages.items():
+        before = baseline_stages.get(name, {}).get('mean_ms')
+        after = stage.get('mean_ms')
+        if before and after and after > before * (1 + tolerance):
+            regressions.append((name, before, after, after / before))
+    return sorted(regressions, key=lambda item: item[3], reverse=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        # 用法: python profiling.py baseline.json current.json
+        regressions = compare_reports(sys.argv[1], sys.argv[2])
+        for name, before, after, ratio in regressions:
+            print(f"{name:<14} {before:8.2f}ms -> {after:8.2f}ms ({ratio:.2f}x)")
+        sys.exit(1 if regressions else 0)
+
+    # 自我檢查：各階段計時、cProfile 區間、報告與比對
+    profiler = StageProfiler(window=50, profile_frames=5, profile_start=10)
+    for _ in range(40):
+        with profiler.stage('fast'):
+            time.sleep(0.001)
+        with profiler.stage('slow'):
+            time.sleep(0.004)
+        profiler.frame()
+    report = profiler.report()
+    json.dumps(report)
+    stages = report['stages']
+    assert report['frames'] == 40 and stages['fast']['count'] == 40
+    assert stages['fast']['mean_ms'] < stages['slow']['mean_ms']
+    assert sum(count for _, _, count in stages['slow']['histogram']) == 40
+    assert report['cprofile']['frames'] == 5 and report['cprofile']['top_cumulative']
+    assert report['frame']['mean_ms'] >= stages['slow']['mean_ms']
+
+    slower = json.loads(json.dumps(report))
+    slower['stages']['slow']['mean_ms'] *= 2
+    assert [name for name, *_ in compare_reports(report, slower)] == ['slow']
+    assert NULL_PROFILER.stage('x') is _NULL_STAGE
+    assert list(profiler.iterate(range(3), 'source')) == [0, 1, 2] and profiler.stages['source'].count == 3
+    assert list(NULL_PROFILER.iterate(range(3), 'source')) == [0, 1, 2]
+
+    # 停用時的成本
+    start = time.perf_counter()
+    for _ in range(100000):
+        with NULL_PROFILER.stage('x'):
+            pass
+    null_cost = (time.perf_counter() - start) / 100000
+    start = time.perf_counter()
+    for _ in range(100000):
+        with profiler.stage('x'):
+            pass
+    cost = (time.perf_counter() - start) / 100000
+    profiler.print_summary(report)
+    print(f"overhead per stage: {cost * 1e6:.2f}us enabled, {null_cost * 1e6:.2f}us disabled")
@@ -10,8 +10,10 @@ if __name__ == '__main__':
     dcr_data = pd.read_csv(f'{master_dir}dcr_values.csv')
     jad_data = pd.read_csv(f'{master_dir}jad_values.csv')
 
-    aggregated_data = pd.merge(smoothness_data, dcr_data, on='Frame')
-    aggregated_data = pd.merge(aggregated_data, jad_data, on='Frame')
+    # Newer recordings carry a Person (track ID) column and are merged per person
+    keys = ['Frame', 'Person'] if 'Person' in smoothness_data.columns else ['Frame']
+    aggregated_data = pd.merge(smoothness_data, dcr_data, on=keys)
+    aggregated_data = pd.merge(aggregated_data, jad_data, on=keys)
 
     # Save the aggregated data
     aggregated_data.to_csv(f"{master_dir}aggregated_data.csv", index=False)
\ No newline at end of file
@@ -1,6 +1,14 @@
+import os
+import sys
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.pyplot import get_cmap
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keypoint_io import load_keypoints
 
 # Define the skeleton connections
 connections = [
@@ -15,74 +23,133 @@ connections = [
     (11, 12)                   # Left hip to right hip
 ]
 
-def plot_skeleton(frame_data, connections, ax=None):
+def keypoints_to_array(data, person=0):
+    """
+    Pivot keypoints_data.csv rows of one person into a (frames, 17, 2) array.
+
+    :param data: DataFrame with Frame, Person, Keypoint_Index, Keypoint_X and Keypoint_Y columns.
+    :param person: Person (track ID) to select.
+    :return: (frame_ids, keypoints) where missing keypoints are NaN.
+    """
+    data = data[data['Person'] == person]
+    frame_ids, frame_pos = np.unique(data['Frame'].to_numpy(), return_inverse=True)
+    keypoints = np.full((len(frame_ids), 17, 2), np.nan, dtype=np.float32)
+    keypoint_idx = data['Keypoint_Index'].to_numpy()
+    keypoints[frame_pos, keypoint_idx, 0] = data['Keypoint_X'].to_numpy()
+    keypoints[frame_pos, keypoint_idx, 1] = data['Keypoint_Y'].to_numpy()
+    return frame_ids, keypoints
+
+def load_keypoint_array(file_path, person=0):
+    """
+    Load one person's keypoints as a (frames, 17, 2) array.
+
+    :param file_path: Columnar keypoints_data.npy file or a legacy keypoints_data.csv.
+    :param person: Person (track ID) to select.
+    :return: (frame_ids, keypoints). For .npy files the keypoints are a memory-mapped view.
+    """
+    if file_path.endswith('.npy'):
+        keypoints, metadata = load_keypoints(file_path)
+        track_ids = metadata.get('track_ids') or list(range(keypoints.shape[1]))
+        frames = keypoints[:, track_ids.index(person), :, :2]
+        frame_ids = np.flatnonzero(~np.all(np.isnan(frames[..., 0]), axis=1))
+        if len(frame_ids) == len(frames):
+            return frame_ids, frames
+        return frame_ids, frames[frame_ids]
+    return keypoints_to_array(pd.read_csv(file_path), person)
+
+def skeleton_segments(keypoints, connections):
+    """
+    Build line segments for every frame and connection at once.
+
+    :param keypoints: Array with shape (frames, 17, 2).
+    :param connections: List of tuples indicating keypoint connections.
+    :return: (segments, valid) with shapes (frames, connections, 2, 2) and (frames, connections).
+    """
+    connections = np.asarray(connections, dtype=np.intp)
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    with np.errstate(invalid='ignore'):
+        visible = np.all(keypoints > 0, axis=-1)  # Filter (0, 0) and NaN keypoints
+    segments = keypoints[:, connections]
+    valid = visible[:, connections[:, 0]] & visible[:, connections[:, 1]]
+    return segments, valid
+
+def _draw_segments(ax, segments, valid, colors, alpha=1.0):
+    """Draw every valid segment as one LineCollection plus one scatter for the joints."""
+    lines = segments[valid]
+    line_colors = np.broadcast_to(colors[:, None, :], valid.shape + (4,))[valid]
+    ax.add_collection(LineCollection(lines, colors=line_colors, alpha=alpha))
+    ax.scatter(lines[:, :, 0].ravel(), lines[:, :, 1].ravel(), s=25,
+               c=np.repeat(line_colors, 2, axis=0), alpha=alpha)
+    ax.autoscale_view()
+
+def plot_skeleton(frame_keypoints, connections, ax=None):
     """
     Plot a single frame's skeleton on a given matplotlib axis.
-    
-    :param frame_data: DataFrame containing keypoints for a single frame.
+
+    :param frame_keypoints: Array of one frame's keypoints with shape (17, 2).
     :param connections: List of tuples indicating keypoint connections.
     :param ax: Matplotlib axis to draw the skeleton.
     """
     if ax is None:
         fig, ax = plt.subplots(figsize=(8, 6))
-    
-    for kp1, kp2 in connections:
-        kp1_data = frame_data[(frame_data['Keypoint_Index'] == kp1) & (frame_data['Keypoint_X'] > 0) & (frame_data['Keypoint_Y'] > 0)]
-        kp2_data = frame_data[(frame_data['Keypoint_Index'] == kp2) & (frame_data['Keypoint_X'] > 0) & (frame_data['Keypoint_Y'] > 0)]
-        if not kp1_data.empty and not kp2_data.empty:
-            x = [kp1_data['Keypoint_X'].values[0], kp2_data['Keypoint_X'].values[0]]
-            y = [kp1_data['Keypoint_Y'].values[0], kp2_data['Keypoint_Y'].values[0]]
-            ax.plot(x, y, marker='o', markersize=5, color='blue')
-    
+
+    segments, valid = skeleton_segments(np.asarray(frame_keypoints)[None], connections)
+    _draw_segments(ax, segments, valid, np.array([[0.0, 0.0, 1.0, 1.0]]))
+
     ax.set_aspect('equal')
     ax.invert_yaxis()
     ax.set_title('Skeleton Plot')
 
-def plot_multiple_frames(data, connections, num_frames=5):
+def plot_multiple_frames(keypoints, connections, frame_stride=5, frame_ids=None,
+                         output_path='skeletons_across_multiple_frames.png'):
     """
     Plot multiple frames' skeletons on a single plot.
-    
-    :param data: DataFrame containing keypoints for multiple frames.
+
+    :param keypoints: Array with shape (frames, 17, 2).
     :param connections: List of tuples indicating keypoint connections.
-    :param num_frames: Number of frames to plot.
+    :param frame_stride: Plot every frame_stride-th frame.
+    :param frame_ids: Frame numbers used in the legend, defaults to 0..frames-1.
+    :param output_path: Where to save the figure, or None to skip saving.
     """
     fig, ax = plt.subplots(figsize=(10, 8))
     cmap = get_cmap('tab10')  # Colormap for different frames
 
-    frames = data['Frame'].unique()
-    for i, frame in enumerate(frames[::num_frames]):
-        frame_data = data[data['Frame'] == frame]
-        color = cmap(i % 10)  # Cycle through colormap
-        label_added = False  # Ensure label is added only once per frame
-        for kp1, kp2 in connections:
-            kp1_data = frame_data[(frame_data['Keypoint_Index'] == kp1) & (frame_data['Keypoint_X'] > 0) & (frame_data['Keypoint_Y'] > 0)]
-            kp2_data = frame_data[(frame_data['Keypoint_Index'] == kp2) & (frame_data['Keypoint_X'] > 0) & (frame_data['Keypoint_Y'] > 0)]
-            if not kp1_data.empty and not kp2_data.empty:
-                x = [kp1_data['Keypoint_X'].values[0], kp2_data['Keypoint_X'].values[0]]
-                y = [kp1_data['Keypoint_Y'].values[0], kp2_data['Keypoint_Y'].values[0]]
-                ax.plot(x, y, marker='o', markersize=5, color=color, alpha=0.7, label=f'Frame {frame}' if not label_added else "")
-                label_added = True  # Label is added once
+    if frame_ids is None:
+        frame_ids = np.arange(len(keypoints))
+    frame_ids = np.asarray(frame_ids)[::frame_stride]
+    segments, valid = skeleton_segments(keypoints[::frame_stride], connections)
+    colors = cmap(np.arange(len(frame_ids)) % 10)  # Cycle through colormap
+    _draw_segments(ax, segments, valid, colors, alpha=0.7)
+
+    # One legend entry per plotted frame that has at least one limb
+    handles = [
+        Line2D([], [], marker='o', markersize=5, color=color, alpha=0.7, label=f'Frame {frame}')
+        for frame, color, has_limb in zip(frame_ids, colors, valid.any(axis=1)) if has_limb
+    ]
 
     ax.set_aspect('equal')
     ax.invert_yaxis()
     ax.set_title('Skeletons Across Multiple Frames')
-    ax.legend(loc='upper right', fontsize='small')
+    ax.legend(handles=handles, loc='upper right', fontsize='small')
     # plt.show()
-    plt.savefig('skeletons_across_multiple_frames.png')
+    if output_path is not None:
+        plt.savefig(output_path)
 
 # Load the keypoints data
-def main():
-    file_path = './walk/abnormal/keypoints_data.csv'
-    keypoints_data = pd.read_csv(file_path)
+def main(file_path='./walk/abnormal/keypoints_data.csv', person=0, frame_stride=10,
+         output_path='skeletons_across_multiple_frames.png'):
+    # Prefer the columnar file written by newer runs
+    npy_path = os.path.splitext(file_path)[0] + '.npy'
+    frame_ids, keypoints = load_keypoint_array(npy_path if os.path.exists(npy_path) else file_path, person)
 
     # Plot the first frame
-    frame_0_person_0 = keypoints_data[(keypoints_data['Frame'] == 0) & (keypoints_data['Person'] == 0)]
     fig, ax = plt.subplots(figsize=(8, 6))
-    plot_skeleton(frame_0_person_0, connections, ax=ax)
+    plot_skeleton(keypoints[0], connections, ax=ax)
     plt.show()
 
     # Plot multiple frames
-    plot_multiple_frames(keypoints_data, connections, num_frames=10)
+    plot_multiple_frames(keypoints, connections, frame_stride=frame_stride, frame_ids=frame_ids,
+                         output_path=output_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
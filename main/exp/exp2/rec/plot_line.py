@@ -61,7 +61,8 @@ if __name__ == '__main__':
     jad_data = pd.read_csv('./jump/fail/jad_values.csv')
 
     # Merge DCR and JAD data on Frame
-    dcr_jad_data = pd.merge(dcr_data, jad_data, on='Frame', how='inner')
+    keys = ['Frame', 'Person'] if 'Person' in dcr_data.columns else ['Frame']
+    dcr_jad_data = pd.merge(dcr_data, jad_data, on=keys, how='inner')
 
     # Plot the smoothness data
     plot_smoothness(smoothness_data)
@@ -0,0 +1,98 @@
+import numpy as np
+import cv2
+
+# 定義骨架連接關係 (根據 COCO 格式)
+COCO_CONNECTIONS = [
+    (0, 1), (0, 2),            # 鼻子到雙眼
+    (1, 3), (2, 4),            # 左眼到左耳，右眼到右耳
+    (0, 5), (0, 6),            # 鼻子到雙肩
+    (5, 7), (7, 9),            # 左肩到左手肘，再到左手腕
+    (6, 8), (8, 10),           # 右肩到右手肘，再到右手腕
+    (5, 11), (6, 12),          # 左肩到左髖，右肩到右髖
+    (11, 13), (13, 15),        # 左髖到左膝，再到左腳踝
+    (12, 14), (14, 16),        # 右髖到右膝，再到右腳踝
+    (11, 12)                   # 左髖到右髖
+]
+
+
+def draw_skeleton(frame, keypoints, connections=COCO_CONNECTIONS, point_color=(255, 0, 0),
+                  line_color=(0, 255, 0), radius=5, thickness=2, valid=None):
+    """
+    在影像上繪製骨架，每個人只呼叫一次 cv2.polylines 畫點、一次畫線，不逐點迴圈。
+    frame: BGR 影像 (就地繪製)
+    keypoints: numpy array, shape = (persons, 17, 2) 或 (17, 2)
+    connections: 關節連接關係列表
+    valid: 有效關節平面，shape = (persons, 17) 或 (17,)，None 時過濾座標為 (0, 0) 的關節 (見 ingest.py)
+    """
+    keypoints = np.asarray(keypoints)
+    keypoints = keypoints.reshape((-1,) + keypoints.shape[-2:])[..., :2]
+    connections = np.asarray(connections, dtype=np.intp).reshape(-1, 2)
+    if valid is None:
+        valid = np.all(keypoints > 0, axis=-1)
+    valid = np.asarray(valid, dtype=bool).reshape(keypoints.shape[:2])
+
+    for person_keypoints, person_valid in zip(keypoints, valid):
+        points = person_keypoints.astype(np.int32)
+
+        # 點以長度為 0 的粗線段繪製，線端為圓形
+        if person_valid.any():
+            dots = np.repeat(points[person_valid][:, None, :], 2, axis=1)
+            cv2.polylines(frame, dots, False, point_color, thickness=2 * radius)
+
+        limb_valid = person_valid[connections[:, 0]] & person_valid[connections[:, 1]]
+        if limb_valid.any():
+            cv2.polylines(frame, points[connections[limb_valid]], False, line_color, thickness=thickness)
+
+    return frame
+
+
+class OverlayWriter:
+    """
+    將骨架疊加到影格上並寫成影片，供無顯示器 (headless) 的批次執行使用。
+    frame_stride > 1 時只處理每 frame_stride 幀，其他幀不繪製也不寫出。
+    """
+
+    def __init__(self, path, fps=30, frame_stride=1, connections=COCO_CONNECTIONS, fourcc='mp4v'):
+        """
+        path: 輸出影片路徑
+        fps: 原始影片幀率，輸出幀率為 fps / frame_stride
+        frame_stride: 每隔幾幀寫出一幀
+        connections: 關節連接關係列表
+        fourcc: 影片編碼
+        """
+        self.path = path
+        self.fps = fps
+        self.frame_stride = max(1, int(frame_stride))
+        self.connections = connections
+        self.fourcc = fourcc
+        self._writer = None
+
+    def write(self, frame_index, frame, keypoints, copy=False, valid=None):
+        """
+        繪製並寫出一幀，不在 stride 上的幀直接略過。
+        copy: 在影格副本上繪製，保留原影格 (例如仍要顯示在畫面上時)
+        valid: 有效關節平面，見 draw_skeleton
+        回傳是否有寫出。
+        """
+        if frame_index % self.frame_stride:
+            return False
+        if copy:
+            frame = frame.copy()
+        if self._writer is None:
+            height, width = frame.shape[:2]
+            self._writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc),
+                                           self.fps / self.frame_stride, (width, height))
+        draw_skeleton(frame, keypoints, self.connections, valid=valid)
+        self._writer.write(frame)
+        return True
+
+    def release(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
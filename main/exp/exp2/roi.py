@@ -0,0 +1,206 @@
+import numpy as np
+from ingest import CONF_THRESHOLD, PoseFrame, ingest_results
+from adaptive import match_persons, read_frames
+from profiling import NULL_PROFILER
+
+# ROI 追蹤推論：
+# 以前一幀目標人物關鍵點的外框加上邊界 (依外框大小與移動速度) 裁切影格，
+# 在較小的 imgsz 上推論後把關鍵點映射回原始座標；
+# 定期或追蹤遺失時改以整張影格重新偵測。1080p / 4K 影片中人只佔一小塊時可大幅降低推論成本。
+# 只追蹤一個目標人物 (以 match_persons 與前一幀的目標配對)，多人相距很遠時裁切範圍不會擴大成整張影格；
+# 裁切推論的輸出只包含裁切範圍內的人。
+
+
+class RoiTracker:
+    """
+    由前一幀目標人物的姿態決定下一幀的裁切範圍。
+    目標人物為與前一幀目標配對到的人；沒有目標 (開始或遺失後) 時選有效關鍵點最多的人。
+    """
+
+    def __init__(self, margin=0.25, motion_scale=2.0, min_size=96, redetect_every=30, min_valid=5):
+        """
+        margin: 外框四周額外保留的比例 (相對於外框寬高)
+        motion_scale: 依前後幀中心位移再加大的邊界倍數
+        min_size: 裁切範圍的最小邊長 (像素)
+        redetect_every: 每隔幾幀以整張影格重新偵測 (0 為只在遺失時)
+        min_valid: 裁切推論的有效關鍵點少於此數時視為遺失，立即整張影格重新偵測
+        """
+        self.margin = margin
+        self.motion_scale = motion_scale
+        self.min_size = min_size
+        self.redetect_every = redetect_every
+        self.min_valid = min_valid
+        self.box = None
+        self._target = None  # 前一幀目標人物的 (xy (17, 2), valid (17,))
+        self._center = None
+        self._velocity = np.zeros(2)
+        self._last_full = None
+
+    def reset(self):
+        self.box = None
+        self._target = None
+        self._center = None
+        self._velocity = np.zeros(2)
+        self._last_full = None
+
+    def needs_full_frame(self, frame_index):
+        if self.box is None or self._last_full is None:
+            return True
+        return self.redetect_every > 0 and frame_index - self._last_full >= self.redetect_every
+
+    def target_index(self, pose):
+        """
+        此幀姿態 (原始影格座標) 中目標人物的索引，沒有人時回傳 None。
+        """
+        if len(pose.xy) == 0:
+            return None
+        if self._target is not None:
+            matches = match_persons(self._target[0][None], self._target[1][None], pose.xy, pose.valid)
+            matched = np.flatnonzero(matches == 0)
+            if len(matched):
+                return int(matched[0])
+        return int(np.argmax(np.count_nonzero(pose.valid, axis=1)))
+
+    def lost(self, pose):
+        """目標人物不在此幀或有效關鍵點少於 min_valid"""
+        target = self.target_index(pose)
+        return target is None or int(np.count_nonzero(pose.valid[target])) < self.min_valid
+
+    def update(self, frame_index, pose, frame_shape, full_frame):
+        """以此幀目標人物的姿態更新下一幀的裁切範圍 (x0, y0, x1, y1)"""
+        if full_frame:
+            self._last_full = frame_index
+        if self.lost(pose):
+            self.box = None
+            self._target = None
+            self._center = None
+            return
+        target = self.target_index(pose)
+        self._target = (np.array(pose.xy[target], dtype=np.float32), np.array(pose.valid[target], dtype=bool))
+        points = pose.xy[target][pose.valid[target]]
+        low, high = points.min(axis=0), points.max(axis=0)
+        center = (low + high) / 2
+        if self._center is not None:
+            self._velocity = center - self._center
+        self._center = center
+
+        size = np.maximum(high - low, 1.0)
+        half = size / 2 + self.margin * size + self.motion_scale * np.abs(self._velocity)
+        half = np.maximum(half, self.min_size / 2)
+        height, width = frame_shape[:2]
+        center = center + self._velocity  # 預測下一幀的位置
+        x0, y0 = np.floor(np.maximum(center - half, 0)).astype(int)
+        x1, y1 = np.ceil(np.minimum(center + half, (width, height))).astype(int)
+        self.box = (int(x0), int(y0), int(x1), int(y1)) if x1 > x0 and y1 > y0 else None
+
+
+def _offset_pose(pose, x0, y0):
+    xy = np.array(pose.xy, dtype=np.float32)
+    xy[pose.valid] += (x0, y0)
+    return PoseFrame(xy, pose.conf, pose.valid, pose.track_ids)
+
+
+def roi_poses(frames, model, tracker=None, roi_imgsz=320, params=None, conf_threshold=CONF_THRESHOLD,
+              profiler=None):
+    """
+    以 ROI 裁切推論逐幀產生姿態。
+    frames: (frame_index, frame) 的迭代器
+    model: YOLO Pose 模型
+    tracker: RoiTracker，None 時使用預設值
+    roi_imgsz: 裁切推論使用的 imgsz；整張影格推論使用 params 中的設定
+    profiler: profiling.StageProfiler，分別計時 'inference' (裁切與整張影格) 與 'transfer' 階段
+    產生 (frame_index, frame, PoseFrame, full_frame)
+    """
+    profiler = NULL_PROFILER if profiler is None else profiler
+    tracker = RoiTracker() if tracker is None else tracker
+    params = dict(params or {})
+    roi_params = dict(params, imgsz=roi_imgsz)
+
+    for frame_index, frame in frames:
+        full_frame = tracker.needs_full_frame(frame_index)
+        pose = None
+        if not full_frame:
+            x0, y0, x1, y1 = tracker.box
+            crop = np.ascontiguousarray(frame[y0:y1, x0:x1])
+            with profiler.stage('inference'):
+                results = model(crop, **roi_params)
+            pose = _offset_pose(ingest_results(results, conf_threshold, profiler)[0], x0, y0)
+            if tracker.lost(pose):
+                # 裁切範圍內找不到目標人物：同一幀改以整張影格重新偵測
+                full_frame = True
+        if full_frame:
+            with profiler.stage('inference'):
+                results = model(frame, **params)
+            pose = ingest_results(results, conf_threshold, profiler)[0]
+        tracker.update(frame_index, pose, frame.shape, full_frame)
+        yield frame_index, frame, pose, full_frame
+
+
+def roi_video_poses(video_path, model, roi_imgsz=320, redetect_every=30, params=None,
+                    conf_threshold=CONF_THRESHOLD, profiler=None, **tracker_kwargs):
+    """
+    與 pose_cache.video_poses 相同的介面：產生 (frame_index, frame, PoseFrame)，
+    但以 ROI 裁切推論。tracker_kwargs 傳給 RoiTracker (margin、motion_scale 等)。
+    profiler: profiling.StageProfiler，計時 'decode'、'inference' 與 'transfer' 階段
+    """
+    tracker = RoiTracker(redetect_every=redetect_every, **tracker_kwargs)
+    for frame_index, frame, pose, _ in roi_poses(read_frames(video_path, profiler), model, tracker,
+                                                 roi_imgsz, params, conf_threshold, profiler):
+        yield frame_index, frame, pose
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 2:
+        # 自我檢查：1080p 影格中兩個相距很遠的人，裁切範圍只跟隨目標人物 (偵測順序每幀交換)
+        rng = np.random.default_rng(0)
+        skeleton = rng.uniform(-60, 60, (17, 2)).astype(np.float32)
+        tracker = RoiTracker(redetect_every=0)
+        for frame_index in range(60):
+            walker = skeleton + (300 + 5 * frame_index, 500)
+            other = skeleton + (1600, 300)
+            xy = np.stack([walker, other] if frame_index % 2 else [other, walker])
+            valid = np.ones((2, 17), dtype=bool)
+            valid[frame_index % 2, :3] = False  # 目標人物每隔一幀少幾個關鍵點，仍不可換人
+            pose = PoseFrame(xy, valid.astype(np.float32), valid, None)
+            assert frame_index == 0 or not tracker.lost(pose)
+            tracker.update(frame_index, pose, (1080, 1920), frame_index == 0)
+            x0, y0, x1, y1 = tracker.box
+            assert x1 - x0 < 400 and y1 - y0 < 400, tracker.box
+            center = walker.mean(axis=0)
+            assert x0 <= center[0] <= x1 and y0 <= center[1] <= y1, (frame_index, tracker.box)
+        empty = PoseFrame(np.zeros((0, 17, 2), np.float32), np.zeros((0, 17), np.float32),
+                          np.zeros((0, 17), bool), None)
+        assert tracker.lost(empty)
+        print(f"ROI follows one person, final box {tracker.box}")
+        sys.exit(0)
+
+    from ultralytics import YOLO
+
+    # 用法: python roi.py [video.mp4 [weights.pt] [roi_imgsz]]；不給影片時只執行 RoiTracker 的自我檢查
+    # 比較整張影格推論與 ROI 推論的耗時與關鍵點差異
+    video_path = sys.argv[1]
+    model = YOLO(sys.argv[2] if len(sys.argv) > 2 else '../exp1/yolo11x-pose.pt')
+    roi_imgsz = int(sys.argv[3]) if len(sys.argv) > 3 else 320
+
+    start = time.perf_counter()
+    full = [ingest_results(model(frame, verbose=False))[0] for _, frame in read_frames(video_path)]
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    roi = list(roi_poses(read_frames(video_path), model, roi_imgsz=roi_imgsz, params={'verbose': False}))
+    roi_time = time.perf_counter() - start
+
+    errors = []
+    for (_, _, pose, _), reference in zip(roi, full):
+        matches = match_persons(reference.xy, reference.valid, pose.xy, pose.valid)
+        for i, j in enumerate(matches):
+            if j >= 0:
+                both = pose.valid[i] & reference.valid[j]
+                errors.append(np.linalg.norm(pose.xy[i][both] - reference.xy[j][both], axis=-1))
+    errors = np.concatenate(errors) if errors else np.zeros(0)
+    print(f"full frame: {full_time:.2f}s, ROI: {roi_time:.2f}s ({full_time / roi_time:.2f}x), "
+          f"full-frame redetections: {sum(full_frame for *_, full_frame in roi)}/{len(roi)}, "
+          f"mean keypoint difference: {errors.mean() if len(errors) else 0.0:.2f}px")
@@ -0,0 +1,463 @@
+import os
+import csv
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from analysis import MetricsRecorder, DCR_CONNECTIONS
+from ingest import CONF_THRESHOLD, ingest_results
+from keypoint_io import KeypointArrayWriter, load_keypoints, to_csv
+from metrics import JOINT_TRIPLES
+from tracks import MAX_MISSED
+
+# 單支長影片的分段平行處理：
+# 影片依時間切成數段，每段往前多讀 overlap 幀 (預設 window_size) 讓視窗指標先暖機，
+# 各段在獨立的行程中以 CAP_PROP_POS_FRAMES 跳到起點後解碼、推論並計算指標，
+# 最後去掉重疊的幀、依重疊區的關鍵點把各段的追蹤 ID 對回同一組，合併成與逐幀處理相同的輸出。
+# 視窗指標以每個人的偵測次數計算 (不是幀數)，常漏偵測的人需要更長的暖機：
+# 各段跑完後檢查跨越段界的每個人在段界前是否已有 window_size + 1 次偵測 (段尾則是 lookahead 次)，
+# 不足的段加倍暖機 (或段尾) 長度重跑，直到每個人都暖機完成或讀到影片開頭/結尾。
+
+METRIC_FILES = ('dcr_values.csv', 'smoothness_values.csv', 'jad_values.csv')
+
+
+def load_yolo(weights_path):
+    """預設的模型載入函數 (在每個子行程中呼叫)"""
+    from ultralytics import YOLO
+
+    return YOLO(weights_path)
+
+
+def shard_ranges(num_frames, num_shards, overlap=30, lookahead=0, align=1):
+    """
+    將 num_frames 幀切成 num_shards 段。
+    overlap: 每段往前多讀的暖機幀數
+    lookahead: 每段往後多讀的幀數 (前處理的延遲)，讓段尾的缺漏補齊與逐幀處理相同
+    align: 分段起點對齊的倍數 (對齊 window_size 時滾動總和的重算時機與逐幀處理一致)
+    回傳 [(read_start, start, end, read_end), ...]，只輸出 [start, end) 的幀；
+    最後一段的 end 與 read_end 為 None (讀到影片結尾，不依賴可能不準確的幀數)
+    """
+    chunk = -(-num_frames // max(num_shards, 1))
+    chunk = max(-(-chunk // align) * align, align)
+    ranges = []
+    for start in range(0, num_frames, chunk):
+        end = start + chunk
+        if end >= num_frames:
+            ranges.append((max(start - overlap, 0), start, None, None))
+            break
+        ranges.append((max(start - overlap, 0), start, end, end + lookahead))
+    return ranges
+
+
+def _seek(video_path, frame_index):
+    """開啟影片並跳到 frame_index；無法精確跳轉的編碼改為從頭逐幀略過"""
+    cap = cv2.VideoCapture(video_path)
+    if frame_index > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != frame_index:
+            cap.release()
+            cap = cv2.VideoCapture(video_path)
+            for _ in range(frame_index):
+                if not cap.grab():
+                    break
+    return cap
+
+
+def _run_shard(video_path, shard_dir, read_start, read_end, weights_path, model_factory, params,
+               batch_size, recorder_kwargs):
+    """
+    在子行程中處理一段：解碼 [read_start, read_end) (read_end 為 None 時到結尾) 並推論、計算指標。
+    記錄器使用段內的幀索引 (從 0 開始)，避免關鍵點檔案前面補上大量空白幀。
+    """
+    model = model_factory(weights_path)
+    params = dict(params or {})
+    recorder = MetricsRecorder(shard_dir, **recorder_kwargs)
+    cap = _seek(video_path, read_start)
+    batch = []
+
+    def flush():
+        results = model([frame for _, frame in batch], verbose=False, **params)
+        for (local_index, _), pose in zip(batch, ingest_results(results)):
+            recorder.update(local_index, pose.xy, track_ids=pose.track_ids,
+                            confidences=pose.conf, valid=pose.valid)
+        batch.clear()
+
+    try:
+        local_index = 0
+        while read_end is None or local_index < read_end - read_start:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            batch.append((local_index, frame))
+            local_index += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        cap.release()
+    recorder.close()
+    return shard_dir
+
+
+def _present(keypoints):
+    """(frames, persons, 17, 3) 中每格是否有人"""
+    return ~np.all(np.isnan(keypoints[..., 0]), axis=-1)
+
+
+def _warmed_up(keypoints, read_start, start, end, read_end, window_size, margin, lookahead,
+               max_missed=MAX_MISSED, joint_idx=10, conf_threshold=CONF_THRESHOLD,
+               joint_triples=JOINT_TRIPLES):
+    """
+    檢查一段的暖機是否足以讓輸出與逐幀處理相同。
+    keypoints: 此段的 (frames, persons, 17, 3)，第 0 幀為 read_start
+    margin: 暖機開頭不計入的幀數 (前處理補齊缺漏時往回參考的 max_gap)
+    回傳 (head_ok, tail_ok)：
+    head_ok: 段界前已出現且在 [start, end) 仍有偵測的每個人，在 [read_start + margin, start) 至少有
+             window_size + 1 次偵測 (JAD 的視窗與輸出門檻)，其中 joint_idx 有效的至少 window_size 次
+             (平滑度只推入 joint_idx 有效的幀；以原始信心值計算，前處理補齊後只會更多)，
+             且每個 JAD 關節角度在這些偵測的前 (次數 - window_size + 1) 次中至少有效一次
+             (無效的角度沿用前一個值，第一個輸出視窗沿用的值必須在暖機內)
+    tail_ok: [start, end) 有偵測的每個人在 end 之後至少有 lookahead 次偵測，
+             或已超過 max_missed 幀沒有偵測 (逐幀處理中也不會再配對到同一人)
+    """
+    present = _present(keypoints)
+    with np.errstate(invalid='ignore'):
+        valid = keypoints[..., 2] >= conf_threshold
+    joint_valid = valid[:, :, joint_idx]
+    triples = np.array(list(joint_triples.values()), dtype=np.intp)
+    angle_valid = valid[:, :, triples].all(axis=-1)  # (frames, persons, triples)
+    emit_begin = start - read_start
+    emit_end = len(present) if end is None else min(end - read_start, len(present))
+    # 讀到影片結尾 (實際幀數少於要求) 時段尾不需要再延長
+    at_eof = end is None or read_end is None or len(present) < read_end - read_start
+    head_ok = tail_ok = True
+    for track, track_joint, track_angles in zip(present.T, joint_valid.T, angle_valid.transpose(1, 0, 2)):
+        if not track[emit_begin:emit_end].any():
+            continue
+        if read_start > 0 and track[:emit_begin].any():
+            warmup = slice(min(margin, emit_begin), emit_begin)
+            detections = np.flatnonzero(track[warmup])
+            if len(detections) < window_size + 1 or track_joint[warmup].sum() < window_size:
+                head_ok = False
+            elif not track_angles[warmup][detections[:len(detections) - window_size + 1]].any(axis=0).all():
+                head_ok = False
+        if lookahead > 0 and not at_eof and track[emit_end:].sum() < lookahead:
+            last = np.flatnonzero(track)[-1]
+            if len(track) - 1 - last <= max_missed:
+                tail_ok = False
+    return head_ok, tail_ok
+
+
+def _match_tracks(keypoints, track_ids, offset, previous, prev_offset, prev_global, overlap_frames):
+    """
+    依重疊區的關鍵點把此段的 person 欄位對到前一段的全域追蹤 ID。
+    兩段在重疊幀的偵測來自同一張影格，同一個人的座標完全相同。
+    回傳 {本段追蹤 ID: 全域追蹤 ID}
+    """
+    mapping = {}
+    if previous is None or overlap_frames <= 0:
+        return mapping
+    # 兩段都讀到的幀：[max(offset, prev_offset), offset + overlap_frames) (暖機加長後可能早於前一段的起點)
+    begin = max(offset, prev_offset)
+    current = keypoints[begin - offset:overlap_frames]
+    prior = previous[begin - prev_offset:offset + overlap_frames - prev_offset]
+    n = min(len(current), len(prior))
+    current, prior = current[:n], prior[:n]
+    scores = []
+    for slot in range(current.shape[1]):
+        for prev_slot in range(min(prior.shape[1], len(prev_global))):
+            if prev_global[prev_slot] is None:
+                continue
+            both = _present(current[:, slot]) & _present(prior[:, prev_slot])
+            same = np.all(np.isclose(current[both, slot], prior[both, prev_slot], equal_nan=True), axis=(-1, -2))
+            if same.any():
+                scores.append((-int(same.sum()), slot, prev_slot))
+    used = set()
+    for _, slot, prev_slot in sorted(scores):
+        if slot < len(track_ids) and track_ids[slot] not in mapping and prev_slot not in used:
+            mapping[track_ids[slot]] = prev_global[prev_slot]
+            used.add(prev_slot)
+    return mapping
+
+
+def stitch_shards(shard_dirs, ranges, output_dir, max_persons=8, metadata=None, keypoints_csv=False):
+    """
+    合併各段的輸出：每段只保留 [start, end) 的幀，幀索引換回整支影片的索引，
+    追蹤 ID 以重疊區配對後統一編號 (新出現的人依出現順序接續編號)。
+    寫出 keypoints_data.npy 與三個指標 CSV，回傳 output_dir
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # 每個全域追蹤 ID 佔一欄，欄位不足時擴充 (與 MetricsRecorder 相同，不丟棄偵測)
+    writer = KeypointArrayWriter(os.path.join(output_dir, 'keypoints_data.npy'), max_persons=max_persons,
+                                 metadata=metadata, grow=True)
+    rows = {name: [] for name in METRIC_FILES}
+    headers = {}
+    previous, prev_offset, prev_global = None, 0, []
+    next_id = 0
+
+    for shard_dir, (read_start, start, end, _) in zip(shard_dirs, ranges):
+        keypoints, shard_meta = load_keypoints(os.path.join(shard_dir, 'keypoints_data.npy'))
+        keypoints = np.asarray(keypoints)
+        track_ids = list(shard_meta.get('track_ids') or [])
+        mapping = _match_tracks(keypoints, track_ids, read_start, previous, prev_offset, prev_global,
+                                start - read_start)
+
+        def global_id(track_id):
+            nonlocal next_id
+            if track_id not in mapping:
+                mapping[track_id] = next_id
+            next_id = max(next_id, mapping[track_id] + 1)
+            return mapping[track_id]
+
+        # 依 person 欄位順序 (即首次出現順序) 先為新的人編號，與逐幀處理的編號順序相同
+        emitted = keypoints[start - read_start:None if end is None else end - read_start]
+        present = _present(emitted)
+        for slot in np.argsort([np.argmax(present[:, s]) if present[:, s].any() else len(present)
+                                for s in range(len(track_ids))], kind='stable'):
+            if present[:, slot].any():
+                global_id(track_ids[slot])
+
+        for local_index, row in enumerate(emitted):
+            slots = np.flatnonzero(present[local_index])
+            writer.write(start + local_index, row[slots, :, :2], row[slots, :, 2],
+                         [global_id(track_ids[slot]) for slot in slots])
+
+        for name in METRIC_FILES:
+            with open(os.path.join(shard_dir, name), newline='') as f:
+                reader = csv.reader(f)
+                headers[name] = next(reader)
+                for row in reader:
+                    frame_index = int(row[0]) + read_start
+                    if start <= frame_index and (end is None or frame_index < end):
+                        rows[name].append([frame_index, global_id(int(row[1]))] + row[2:])
+
+        previous, prev_offset = keypoints, read_start
+        prev_global = [mapping.get(track_id) for track_id in track_ids]
+
+    writer.close()
+    if keypoints_csv:
+        to_csv(writer.path)
+    for name in METRIC_FILES:
+        # 段與段交界處各段送出延遲幀的先後不同，依幀排序 (同一幀內維持原順序)
+        rows[name].sort(key=lambda row: row[0])
+        with open(os.path.join(output_dir, name), 'w', newline='') as f:
+            csvwriter = csv.writer(f)
+            csvwriter.writerow(headers[name])
+            csvwriter.writerows(rows[name])
+    return output_dir
+
+
+def run_sharded(video_path, weights_path, output_dir='.', num_shards=None, window_size=30, fps=30,
+                overlap=None, keypoints_csv=False, dcr_connections=DCR_CONNECTIONS, preprocess=None,
+                params=None, batch_size=8, max_persons=8, model_factory=load_yolo, keep_shards=False,
+                smoothing_lam=None):
+    """
+    以多個行程分段處理一支長影片，輸出與 exp2_a.py 逐幀處理相同的檔案。
+    video_path: 影片路徑
+    weights_path: 模型權重檔，每個子行程以 model_factory(weights_path) 各自載入模型
+    output_dir: 輸出資料夾
+    num_shards: 分段數 (也是行程數)，None 時為 CPU 核心數
+    overlap: 每段往前多讀的初始暖機幀數，None 時為 window_size (至少 tracks.MAX_MISSED)；
+             跨越段界的人偵測次數不足時該段自動加倍暖機重跑
+    preprocess: 與 MetricsRecorder 相同的前處理設定；段尾另外多讀 lookahead 幀
+    params: 推論參數，傳給 model(frames, **params)
+    model_factory: 可被 pickle 的模型載入函數 (模組層級的函數)
+    keep_shards: 是否保留各段的中間輸出 (output_dir/shards/)
+    smoothing_lam: 平滑度 Var 使用的線性平滑運算子 λ，見 MetricsRecorder
+    回傳 output_dir
+    """
+    cap = cv2.VideoCapture(video_path)
+    num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    if num_frames <= 0:
+        raise ValueError(f"Cannot read the frame count of {video_path}.")
+
+    num_shards = num_shards or os.cpu_count() or 1
+    # 暖機至少涵蓋 max_missed 幀，段界後出現的人若在逐幀處理中延續先前的追蹤，該追蹤一定在暖機區內
+    overlap = max(window_size if overlap is None else overlap, MAX_MISSED)
+    lookahead = 0 if preprocess is None else preprocess.get('lookahead', 5)
+    # 前處理補齊缺漏時最多往回參考 max_gap 幀；max_gap 為 None 時不限，以 window_size 近似
+    margin = 0 if preprocess is None else preprocess.get('max_gap') or window_size
+    ranges = [list(r) for r in shard_ranges(num_frames, num_shards, overlap, lookahead, align=window_size)]
+
+    shard_root = os.path.join(output_dir, 'shards')
+    shard_dirs = [os.path.join(shard_root, f'shard_{i:03d}') for i in range(len(ranges))]
+    recorder_kwargs = {'window_size': window_size, 'fps': fps, 'max_persons': max_persons,
+                       'dcr_connections': dcr_connections, 'preprocess': preprocess,
+                       'smoothing_lam': smoothing_lam}
+
+    # 可用 fork 時以 fork 建立子行程，exp2_a.py 這類沒有 __main__ 保護的腳本不會在子行程中重新執行；
+    # 父行程在此之前不可先執行 GPU 推論 (CUDA 無法在 fork 後沿用)，各段的模型在子行程中才載入
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+    pending = list(range(len(ranges)))
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=context) as executor:
+        while pending:
+            futures = [
+                executor.submit(_run_shard, video_path, shard_dirs[i], ranges[i][0], ranges[i][3], weights_path,
+                                model_factory, params, batch_size, recorder_kwargs)
+                for i in pending
+            ]
+            for future in futures:
+                future.result()
+
+            # 暖機或段尾不足的段加長後重跑
+            rerun = []
+            for i in pending:
+                read_start, start, end, read_end = ranges[i]
+                keypoints, _ = load_keypoints(os.path.join(shard_dirs[i], 'keypoints_data.npy'))
+                head_ok, tail_ok = _warmed_up(np.asarray(keypoints), read_start, start, end, read_end,
+                                              window_size, margin, lookahead)
+                if not head_ok:
+                    ranges[i][0] = max(start - 2 * (start - read_start), 0)
+                if not tail_ok:
+                    ranges[i][3] = end + max(2 * (read_end - end), MAX_MISSED + lookahead)
+                if not (head_ok and tail_ok):
+                    rerun.append(i)
+            pending = rerun
+
+    stitch_shards(shard_dirs, [tuple(r) for r in ranges], output_dir, max_persons,
+                  metadata={'fps': fps, 'window_size': window_size, 'video': video_path,
+                            'shards': len(ranges)},
+                  keypoints_csv=keypoints_csv)
+    if not keep_shards:
+        shutil.rmtree(shard_root, ignore_errors=True)
+    return output_dir
+
+
+def _relative_difference(a, b):
+    """逐元素相對差異 |a - b| / max(|a|, |b|) 的最大值 (兩者皆為 0 時為 0)；NaN 位置不同時為 inf"""
+    if a.shape != b.shape or not np.array_equal(np.isnan(a), np.isnan(b)):
+        return np.inf
+    scale = np.maximum(np.abs(a), np.abs(b))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        relative = np.where(scale > 0, np.abs(a - b) / scale, 0.0)
+    return float(np.nanmax(relative, initial=0.0))
+
+
+def compare_outputs(dir_a, dir_b):
+    """
+    比較兩個輸出資料夾 (例如逐幀與分段處理)。
+    回傳 {檔名: 最大相對差異}；關鍵點比較整個陣列，指標 CSV 依 (Frame, Person) 排序後比較數值。
+    MSJ 等指標數值很大，以相對差異判斷才不會把正常的浮點誤差當成不同
+    """
+    report = {}
+    a, _ = load_keypoints(os.path.join(dir_a, 'keypoints_data.npy'))
+    b, _ = load_keypoints(os.path.join(dir_b, 'keypoints_data.npy'))
+    report['keypoints_data.npy'] = _relative_difference(np.asarray(a), np.asarray(b))
+    for name in METRIC_FILES:
+        tables = []
+        for directory in (dir_a, dir_b):
+            table = np.loadtxt(os.path.join(directory, name), delimiter=',', skiprows=1, ndmin=2)
+            tables.append(table[np.lexsort((table[:, 1], table[:, 0]))] if len(table) else table)
+        report[name] = _relative_difference(*tables)
+    return report
+
+
+class _SyntheticPoseModel:
+    """
+    自我檢查用的假模型：影格左上角以兩個像素記錄幀索引，依幀索引產生 3 個人的關鍵點。
+    第 1 個人每 3 幀漏偵測一次、第 2 個人每 250 幀有一段 12 幀的缺漏，部分關節為低信心，
+    用來檢查漏偵測時分段處理仍與逐幀處理相同。
+    """
+
+    def __init__(self):
+        rng = np.random.default_rng(0)
+        self.skeleton = rng.uniform(-40, 40, (17, 2))
+
+    def poses(self, frame_index):
+        rng = np.random.default_rng(frame_index)
+        t = frame_index / 30
+        people = []
+        for person, center_x in enumerate((150.0, 450.0, 750.0)):
+            if person == 1 and frame_index % 3 == 0:
+                continue
+            if person == 2 and 100 <= frame_index % 250 < 112:
+                continue
+            center = np.array([center_x + 40 * np.sin(2 * np.pi * (0.3 + 0.2 * person) * t),
+                               300 + 20 * np.cos(2 * np.pi * 0.5 * t)])
+            xy = center + self.skeleton + rng.normal(0, 1, (17, 2))
+            conf = rng.uniform(0.3, 1.0, 17)
+            people.append(np.concatenate([xy, conf[:, None]], axis=-1))
+        return np.array(people, dtype=np.float32).reshape(-1, 17, 3)
+
+    def __call__(self, frames, **params):
+        from types import SimpleNamespace
+
+        if not isinstance(frames, list):
+            frames = [frames]
+        return [SimpleNamespace(keypoints=SimpleNamespace(data=self.poses(int(frame[0, 0, 0]) + 256 * int(frame[0, 1, 0]))),
+                                boxes=None)
+                for frame in frames]
+
+
+def _synthetic_model(weights_path):
+    return _SyntheticPoseModel()
+
+
+def _write_synthetic_video(path, num_frames, fps=30):
+    """寫出無損 (FFV1) 的測試影片，左上角兩個像素為幀索引"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'FFV1'), fps, (32, 32))
+    if not writer.isOpened():
+        raise IOError("The FFV1 codec is required for the synthetic sharding check.")
+    for frame_index in range(num_frames):
+        frame = np.zeros((32, 32, 3), dtype=np.uint8)
+        frame[0, 0] = frame_index % 256
+        frame[0, 1] = frame_index // 256
+        writer.write(frame)
+    writer.release()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    import tempfile
+    from pose_cache import video_poses
+
+    # 用法: python sharding.py                                  以假模型與合成影片檢查 (有漏偵測的人)
+    #       python sharding.py video.mp4 [weights.pt] [num_shards] 以 YOLO 檢查實際影片
+    # 分段平行處理與逐幀處理的輸出應相同 (相對誤差 1e-6 內)
+    preprocess = {'lookahead': 5, 'max_gap': 15}
+    if len(sys.argv) > 1:
+        video_path = sys.argv[1]
+        weights_path = sys.argv[2] if len(sys.argv) > 2 else '../exp1/yolo11x-pose.pt'
+        num_shards = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+        model_factory = load_yolo
+        output_root = './sharding_check'
+    else:
+        output_root = tempfile.mkdtemp()
+        video_path = os.path.join(output_root, 'synthetic.avi')
+        _write_synthetic_video(video_path, 900)
+        weights_path = None
+        num_shards = 5
+        model_factory = _synthetic_model
+
+    failed = False
+    for name, settings in (('preprocess', preprocess), ('raw', None)):
+        # 分段處理先執行：父行程尚未使用 GPU 才能 fork
+        # 逐幀推論對照，分段也以 batch_size=1 推論，避免批次推論本身的數值差異
+        sharded_dir = os.path.join(output_root, name, 'sharded')
+        serial_dir = os.path.join(output_root, name, 'serial')
+        start = time.perf_counter()
+        run_sharded(video_path, weights_path, sharded_dir, num_shards, preprocess=settings, batch_size=1,
+                    model_factory=model_factory)
+        sharded_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        model = model_factory(weights_path)
+        recorder = MetricsRecorder(serial_dir, window_size=30, fps=30, preprocess=settings)
+        for frame_index, _, pose in video_poses(video_path, model, params={'verbose': False}):
+            recorder.update(frame_index, pose.xy, track_ids=pose.track_ids, confidences=pose.conf,
+                            valid=pose.valid)
+        recorder.close()
+        serial_time = time.perf_counter() - start
+
+        report = compare_outputs(serial_dir, sharded_dir)
+        print(f"[{name}] serial: {serial_time:.1f}s, {num_shards} shards: {sharded_time:.1f}s")
+        for filename, difference in report.items():
+            print(f"  {filename}: max relative difference {difference:.3g}")
+        failed |= max(report.values()) > 1e-6
+    if failed:
+        sys.exit("Sharded output differs from the serial run.")
@@ -0,0 +1,114 @@
+from functools import lru_cache
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from kinematics import finite_differences
+
+# 平滑殘差引擎：
+# compute_trajectory_smoothness 的 Var 是軌跡與平滑擬合之間誤差距離的變異量。
+# 固定 λ 的三次平滑樣條 (scipy.interpolate.make_smoothing_spline) 對資料是線性的，
+# 視窗長度與 fps 固定時時間軸 t 不變，擬合就是固定的 (n, n) 矩陣 S，殘差為 (I - S) x。
+# 這裡依視窗長度快取 R = I - S，整段錄影所有視窗、17 個關節與 x/y 兩軸以一次矩陣乘法算出殘差，
+# 取代每個視窗兩次 UnivariateSpline 擬合 (後者的節點依資料而定，無法預先計算)。
+
+DEFAULT_LAM = 1e-8  # 接近 UnivariateSpline(s=1e-3) 幾乎內插的程度 (t 以秒為單位)
+
+
+@lru_cache(maxsize=64)
+def residual_operator(length, fps=30, lam=DEFAULT_LAM):
+    """
+    長度為 length 的視窗的殘差運算子 R，殘差 e = R @ x。
+    少於 5 幀時三次樣條會完全內插，R 為 0。
+    回傳唯讀的 (length, length) 陣列 (依參數快取)
+    """
+    from scipy.interpolate import make_smoothing_spline
+
+    if length < 5:
+        operator = np.zeros((length, length))
+    else:
+        t = np.arange(length) / fps
+        # 對每個單位向量擬合一次即得到平滑矩陣 S 的每一欄
+        smoother = np.column_stack([make_smoothing_spline(t, basis, lam=lam)(t) for basis in np.eye(length)])
+        operator = np.eye(length) - smoother
+    operator.setflags(write=False)
+    return operator
+
+
+def smoothing_residuals(series, fps=30, lam=DEFAULT_LAM):
+    """
+    series 沿第 0 軸 (時間) 的平滑殘差。
+    series: shape = (frames, ...)，例如單一關節的 (frames, 2)
+    回傳與 series 相同 shape 的殘差
+    """
+    series = np.asarray(series, dtype=np.float64)
+    operator = residual_operator(len(series), fps, lam)
+    return np.tensordot(operator, series, axes=(1, 0))
+
+
+def sliding_smoothness(keypoints, window_size=30, fps=30, lam=DEFAULT_LAM, chunk_windows=4096):
+    """
+    整段錄影每一幀、每個關節的平滑度指標 (與 compute_trajectory_smoothness(lam=lam) 相同)。
+    keypoints: shape = (frames, 17, 2)，缺漏的關節請先以 preprocess.fill_gaps 補齊
+    window_size: 視窗大小(幀數)，至少 4 幀
+    chunk_windows: 每次矩陣乘法處理的視窗數，限制暫存記憶體
+    回傳 dict(MSJ, Var, Smoothness)，各為 shape = (frames, 17)；
+    第 f 幀為視窗 [f - window_size + 1, f] 的結果，視窗未滿的前 window_size - 1 幀為 NaN
+    """
+    if window_size < 4:
+        raise ValueError("window_size must be at least 4 frames.")
+    keypoints = np.asarray(keypoints, dtype=np.float64)[..., :2]
+    num_frames, num_joints = keypoints.shape[:2]
+    results = {name: np.full((num_frames, num_joints), np.nan) for name in ('MSJ', 'Var', 'Smoothness')}
+    if num_frames < window_size:
+        return results
+
+    # 每幀的 jerk 平方 (兩軸相加)，視窗內有 window_size - 3 個
+    _, _, jerk = finite_differences(keypoints, 1.0 / fps)
+    jerk_sq = np.einsum('fjc,fjc->fj', jerk, jerk)
+    jerk_windows = sliding_window_view(jerk_sq, window_size - 3, axis=0)  # (windows, 17, n - 3)
+
+    # (windows, 17, 2, n) 的 view，與 R^T 相乘即為所有視窗、關節與軸的殘差
+    windows = sliding_window_view(keypoints, window_size, axis=0)
+    operator_t = residual_operator(window_size, fps, lam).T
+    for begin in range(0, len(windows), chunk_windows):
+        end = min(begin + chunk_windows, len(windows))
+        residuals = windows[begin:end] @ operator_t
+        e_dist = np.hypot(residuals[:, :, 0], residuals[:, :, 1])
+        frames = slice(begin + window_size - 1, end + window_size - 1)
+        results['Var'][frames] = np.var(e_dist, axis=-1)
+        results['MSJ'][frames] = np.mean(jerk_windows[begin:end], axis=-1)
+    results['Smoothness'] = 1.0 / (1.0 + results['MSJ'] * results['Var'])
+    return results
+
+
+if __name__ == "__main__":
+    import time
+    import warnings
+    from metrics import compute_trajectory_smoothness
+
+    # 與逐視窗的 compute_trajectory_smoothness(lam=...) 相同，並比較 UnivariateSpline 的耗時
+    rng = np.random.default_rng(0)
+    t = np.arange(900) / 30
+    keypoints = (np.stack([200 + 40 * t, 300 + 10 * np.sin(2 * np.pi * t)], axis=-1)[:, None]
+                 + rng.uniform(0, 100, (1, 17, 2)) + rng.normal(0, 1, (900, 17, 2)))
+    window_size = 30
+
+    start = time.perf_counter()
+    batch = sliding_smoothness(keypoints, window_size, fps=30)
+    batch_time = time.perf_counter() - start
+
+    for f in (window_size - 1, 450, 899):
+        for joint in (0, 10, 16):
+            window = keypoints[f - window_size + 1:f + 1]
+            expected = compute_trajectory_smoothness(window, joint, fps=30, lam=DEFAULT_LAM)
+            for name in ('MSJ', 'Var', 'Smoothness'):
+                assert np.isclose(batch[name][f, joint], expected[name], rtol=1e-9), (name, f, joint)
+
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for f in range(window_size - 1, len(keypoints)):
+            for joint in range(17):
+                compute_trajectory_smoothness(keypoints[f - window_size + 1:f + 1], joint, fps=30)
+    spline_time = time.perf_counter() - start
+    print(f"linear operator: {batch_time * 1000:.1f}ms, UnivariateSpline per window: {spline_time * 1000:.0f}ms "
+          f"({spline_time / batch_time:.0f}x)")
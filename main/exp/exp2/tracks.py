@@ -0,0 +1,255 @@
+import numpy as np
+
+NUM_KEYPOINTS = 17
+MAX_MISSED = 30  # default frames a track may go unseen before it is no longer matched
+
+
+class KeypointTrack:
+    """
+    Array-backed keypoint history of one tracked person.
+
+    In growable mode the buffers double when full and keep the whole history.
+    In ring mode only the last `capacity` frames are kept; every frame is
+    written twice (i and i + capacity) so a window is always a contiguous,
+    zero-copy slice.
+    """
+
+    def __init__(self, track_id, capacity=256, ring=False):
+        """
+        Parameters:
+        track_id (int): Person track ID.
+        capacity (int): Initial (growable) or fixed (ring) number of frames.
+        ring (bool): Keep only the last `capacity` frames.
+        """
+        self.track_id = track_id
+        self.capacity = capacity
+        self.ring = ring
+        length = 2 * capacity if ring else capacity
+        self._xy = np.zeros((length, NUM_KEYPOINTS, 2), dtype=np.float32)
+        self._conf = np.zeros((length, NUM_KEYPOINTS), dtype=np.float32)
+        self._frames = np.full(length, -1, dtype=np.int64)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity) if self.ring else self.count
+
+    @property
+    def last_frame(self):
+        return int(self.frames()[-1]) if self.count else -1
+
+    def _grow(self):
+        length = 2 * len(self._xy)
+        for name in ('_xy', '_conf', '_frames'):
+            old = getattr(self, name)
+            new = np.empty((length,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self.capacity = length
+
+    def append(self, frame_index, xy, conf):
+        """
+        Append one frame of keypoints.
+
+        Parameters:
+        frame_index (int): Video frame index.
+        xy (np.array): Keypoint coordinates with shape (17, 2).
+        conf (np.array): Keypoint confidences with shape (17,).
+        """
+        if self.ring:
+            positions = (self.count % self.capacity, self.count % self.capacity + self.capacity)
+        else:
+            if self.count == len(self._xy):
+                self._grow()
+            positions = (self.count,)
+
+        for pos in positions:
+            self._xy[pos] = xy
+            self._conf[pos] = conf
+            self._frames[pos] = frame_index
+        self.count += 1
+
+    def _span(self, size):
+        n = len(self) if size is None else min(size, len(self))
+        end = self.count % self.capacity + self.capacity if self.ring else self.count
+        return slice(end - n, end)
+
+    def window(self, size=None):
+        """
+        Return the last `size` frames of keypoints (all buffered frames when None).
+
+        Returns:
+        np.array: Zero-copy view with shape (frames, 17, 2).
+        """
+        return self._xy[self._span(size)]
+
+    def confidences(self, size=None):
+        """
+        Return the confidence plane matching window(size).
+
+        Returns:
+        np.array: Zero-copy view with shape (frames, 17).
+        """
+        return self._conf[self._span(size)]
+
+    def frames(self, size=None):
+        """
+        Return the video frame indices matching window(size).
+
+        Returns:
+        np.array: Zero-copy view with shape (frames,).
+        """
+        return self._frames[self._span(size)]
+
+    def latest(self):
+        """
+        Return the most recent keypoints of the track.
+
+        Returns:
+        np.array: View with shape (17, 2).
+        """
+        return self.window(1)[0]
+
+
+class KeypointTrackStore:
+    """
+    Per-person keypoint tracks keyed by track ID.
+
+    Detections that come with a tracker ID (e.g. `result.boxes.id` from
+    `model.track`) are stored under that ID. Otherwise each detection is
+    assigned greedily to the nearest recently seen track by mean keypoint
+    position, or starts a new track. A detection without any keypoint
+    above `conf_threshold` has no position to match by; it is skipped
+    instead of opening a new track every frame.
+    """
+
+    def __init__(self, capacity=256, ring=False, max_distance=100.0, max_missed=MAX_MISSED, conf_threshold=0.5):
+        """
+        Parameters:
+        capacity (int): Initial (growable) or fixed (ring) frames per track.
+        ring (bool): Keep only the last `capacity` frames per track.
+        max_distance (float): Largest centroid jump in pixels for associating a detection.
+        max_missed (int): Frames a track may go unseen before it is no longer matched.
+        conf_threshold (float): Keypoints below this confidence are ignored for association.
+        """
+        self.capacity = capacity
+        self.ring = ring
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.conf_threshold = conf_threshold
+        self.tracks = {}
+        self._next_id = 0
+
+    def __contains__(self, track_id):
+        return track_id in self.tracks
+
+    def __getitem__(self, track_id):
+        return self.tracks[track_id]
+
+    def __iter__(self):
+        return iter(self.tracks.values())
+
+    def _new_track(self, track_id=None):
+        if track_id is None:
+            track_id = self._next_id
+        self._next_id = max(self._next_id, track_id + 1)
+        track = KeypointTrack(track_id, self.capacity, self.ring)
+        self.tracks[track_id] = track
+        return track
+
+    def _centroid(self, xy, conf):
+        valid = conf >= self.conf_threshold
+        if not valid.any():
+            return None
+        return xy[valid].mean(axis=0)
+
+    def _associate(self, frame_index, keypoints, confidences):
+        """
+        Greedy nearest-centroid assignment of detections to active tracks.
+
+        Returns:
+        tuple: (assigned, skipped). `assigned` holds a track ID per detection, or None
+            to start a new track; `skipped` flags detections without a valid keypoint.
+        """
+        candidates = [
+            track for track in self.tracks.values()
+            if track.count and frame_index - track.last_frame <= self.max_missed
+        ]
+        detections = [self._centroid(xy, conf) for xy, conf in zip(keypoints, confidences)]
+
+        pairs = []
+        for det_idx, centroid in enumerate(detections):
+            if centroid is None:
+                continue
+            for track in candidates:
+                track_centroid = self._centroid(track.latest(), track.confidences(1)[0])
+                if track_centroid is None:
+                    continue
+                distance = np.linalg.norm(centroid - track_centroid)
+                if distance <= self.max_distance:
+                    pairs.append((distance, det_idx, track.track_id))
+
+        assigned = [None] * len(keypoints)
+        used = set()
+        for _, det_idx, track_id in sorted(pairs):
+            if assigned[det_idx] is None and track_id not in used:
+                assigned[det_idx] = track_id
+                used.add(track_id)
+        return assigned, [centroid is None for centroid in detections]
+
+    def update(self, frame_index, keypoints, confidences=None, track_ids=None):
+        """
+        Store the detections of one frame.
+
+        Parameters:
+        frame_index (int): Video frame index.
+        keypoints (np.array): Keypoints of every person with shape (persons, 17, 2).
+        confidences (np.array): Keypoint confidences with shape (persons, 17). When
+            None, keypoints with x > 0 and y > 0 count as confidence 1.
+        track_ids (array-like): Tracker IDs per person, or None to associate by position.
+
+        Returns:
+        list: Track ID of every detection, in input order. When associating by
+            position, detections without any keypoint above conf_threshold are
+            not stored and get None.
+        """
+        keypoints = np.asarray(keypoints, dtype=np.float32).reshape(-1, NUM_KEYPOINTS, 2)
+        if confidences is None:
+            confidences = np.all(keypoints > 0, axis=-1).astype(np.float32)
+        confidences = np.asarray(confidences, dtype=np.float32).reshape(-1, NUM_KEYPOINTS)
+
+        if track_ids is None:
+            track_ids, skipped = self._associate(frame_index, keypoints, confidences)
+        else:
+            track_ids = [int(track_id) for track_id in track_ids]
+            skipped = [False] * len(track_ids)
+
+        assigned = []
+        for xy, conf, track_id, skip in zip(keypoints, confidences, track_ids, skipped):
+            if skip:
+                assigned.append(None)
+                continue
+            track = self.tracks.get(track_id) if track_id is not None else None
+            if track is None:
+                track = self._new_track(track_id)
+            track.append(frame_index, xy, conf)
+            assigned.append(track.track_id)
+        return assigned
+
+    def window(self, track_id, size=None):
+        """
+        Return the last `size` frames of one track as a zero-copy (frames, 17, 2) view.
+        """
+        return self.tracks[track_id].window(size)
+
+    def rows(self):
+        """
+        Yield (frame, track_id, keypoint_index, x, y) for every stored keypoint in frame order.
+        """
+        entries = []
+        for track in self.tracks.values():
+            for frame_idx, xy in zip(track.frames(), track.window()):
+                entries.append((int(frame_idx), track.track_id, xy))
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+        for frame_idx, track_id, xy in entries:
+            for kp_idx, (x, y) in enumerate(xy):
+                yield frame_idx, track_id, kp_idx, x, y